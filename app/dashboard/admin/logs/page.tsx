@@ -5,7 +5,7 @@ import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Input } from "@/components/ui/input";
 import { Tabs, TabsContent, TabsList, TabsTrigger } from "@/components/ui/tabs";
-import { SetStateAction, useEffect, useState} from "react";
+import { useEffect, useRef, useState} from "react";
 import {useRouter} from "next/navigation";
 import {onAuthStateChanged} from "firebase/auth";
 import {auth, db} from "@/lib/firebaseConfig";
@@ -20,6 +20,8 @@ export default function LogsPage() {
   const [filteredLogs, setFilteredLogs] = useState<any[]>([]);
   const [logFilter, setLogFilter] = useState({email: "", startDate: "", role: "", action: ""});
   const [logsLoading, setLogsLoading] = useState(false);
+  const [logsCursor, setLogsCursor] = useState<string | null>(null);
+  const logFilterTimer = useRef<ReturnType<typeof setTimeout> | null>(null);
   const [clockLogs, setClockLogs] = useState<any[]>([]);
   const [filteredClockLogs, setFilteredClockLogs] = useState<any[]>([]);
   const [clockLogFilter, setClockLogFilter] = useState({name: "", startDate: ""});
@@ -58,102 +60,103 @@ export default function LogsPage() {
     }
   };
 
-  const fetchLogs = async () => {
+  // Activity logs are paged newest first by the backend, which also applies
+  // the date, role and action filters. The email filter is a substring match
+  // over the events already loaded.
+  const filterLogsByEmail = (logList: any[], email: string) =>
+    email ? logList.filter((log) => log.email?.toLowerCase().includes(email.toLowerCase())) : logList;
+
+  const fetchLogs = async (filter = logFilter, cursor: string | null = null) => {
     setLogsLoading(true);
     try {
-      const logsQuery = query(collection(db, "logs"));
-      const snapshot = await getDocs(logsQuery);
-      if (snapshot.empty) {
-        setLogs([]);
-        setFilteredLogs([]);
-        localStorage.setItem("activityLogs", JSON.stringify([]));
-        return;
+      const token = await auth.currentUser?.getIdToken();
+      const params = new URLSearchParams({ limit: "100" });
+      if (filter.startDate) {
+        params.set("since", filter.startDate);
+        params.set("until", filter.startDate);
       }
-      const logList: SetStateAction<any[]> = [];
-      snapshot.forEach((doc) => {
-        const userId = doc.id;
-        const data = doc.data();
-        const entries = data.entries || [];
-        entries.forEach((entry: { email: any; role: any; action: any; timestamp: any; edited_by: any; }, index: any) => {
-          logList.push({
-            id: `${userId}-${index}`, // Unique ID for each entry
-            user_id: userId,
-            email: entry.email || "N/A",
-            role: entry.role || "N/A",
-            action: entry.action || "N/A",
-            timestamp: entry.timestamp || "N/A",
-            edited_by: entry.edited_by || "N/A", // Include edited_by for "User Edited" actions
-          });
-        });
+      if (filter.role.trim()) params.set("role", filter.role.trim().toLowerCase());
+      if (filter.action.trim()) params.set("action", filter.action.trim());
+      if (cursor) params.set("cursor", cursor);
+
+      const response = await fetch(`${apiUrlBase}/logs?${params}`, {
+        headers: { Authorization: `Bearer ${token}` },
       });
-      // Sort by timestamp in descending order
-      logList.sort((a, b) => new Date(b.timestamp) - new Date(a.timestamp));
+      if (!response.ok) throw new Error(`Failed to fetch logs: ${await response.text()}`);
+      const data = await response.json();
+      const page = data.logs.map((event: any) => ({
+        id: event.id,
+        user_id: event.user_id,
+        email: event.email || "N/A",
+        role: event.role || "N/A",
+        action: event.action || "N/A",
+        timestamp: event.timestamp || "N/A",
+        edited_by: event.edited_by || "N/A", // Include edited_by for "User Edited" actions
+      }));
+
+      const logList = cursor ? [...logs, ...page] : page;
       setLogs(logList);
-      setFilteredLogs(logList);
+      setFilteredLogs(filterLogsByEmail(logList, filter.email));
+      setLogsCursor(data.next_cursor);
+      if (!cursor) setCurrentPage((prev) => ({ ...prev, activity: 1 }));
       if (typeof window !== "undefined") {
         localStorage.setItem("activityLogs", JSON.stringify(logList));
       }
     } catch (error) {
-      console.error("Error fetching logs from Firestore:", error);
+      console.error("Error fetching logs:", error);
       setLogs([]);
       setFilteredLogs([]);
+      setLogsCursor(null);
     } finally {
       setLogsLoading(false);
     }
   };
 
-  const fetchClockLogs = async () => {
+  // Clocked time comes pre-totalled per user per day from the backend. A
+  // date fetches that day only; otherwise the last 30 days are shown.
+  const fetchClockLogs = async (date = "", nameFilter = "") => {
     setClockLogsLoading(true);
     setClockLogsError(null);
     try {
-      const clockHistoryQuery = query(collection(db, "clockHistory"));
-      const clockSnapshot = await getDocs(clockHistoryQuery);
-      const usersQuery = query(collection(db, "users"));
-      const usersSnapshot = await getDocs(usersQuery);
-
-      // Create a map of user IDs to names
-      const userMap = new Map();
-      usersSnapshot.forEach((doc) => {
-        const data = doc.data();
-        userMap.set(doc.id, data.name || "Unknown");
-      });
-
-      if (clockSnapshot.empty) {
-        setClockLogs([]);
-        setFilteredClockLogs([]);
-        localStorage.setItem("clockLogs", JSON.stringify([]));
-        return;
-      }
+      const token = await auth.currentUser?.getIdToken();
+      const since = date || new Date(Date.now() - 30 * 24 * 60 * 60 * 1000).toISOString().slice(0, 10);
 
       const clockLogList = [];
-      clockSnapshot.forEach((doc) => {
-        const userId = doc.id;
-        const data = doc.data();
-        const entries = data.entries || [];
-        entries.forEach((entry, index) => {
-          if (entry.action === "out") { // Only include "out" actions
-            clockLogList.push({
-              id: `${userId}-${index}`, // Unique ID for each entry
-              user_id: userId,
-              name: userMap.get(userId) || "Unknown",
-              timestamp: entry.timestamp || "N/A",
-              clockInTimestamp: entry.clockInTimestamp || "N/A",
-              duration: entry.duration || null,
-            });
-          }
+      let cursor = null;
+      do {
+        const params = new URLSearchParams({ period: "day", since, limit: "200" });
+        if (date) params.set("until", date);
+        if (cursor) params.set("cursor", cursor);
+        const response = await fetch(`${apiUrlBase}/clock/reports?${params}`, {
+          headers: { Authorization: `Bearer ${token}` },
         });
-      });
-
-      // Sort by timestamp in descending order
-      clockLogList.sort((a, b) => new Date(b.timestamp) - new Date(a.timestamp));
+        if (!response.ok) throw new Error(`Failed to fetch clock reports: ${await response.text()}`);
+        const data = await response.json();
+        data.totals.forEach((total) => {
+          clockLogList.push({
+            id: total.id,
+            user_id: total.user_id,
+            name: total.name || "Unknown",
+            timestamp: total.start,
+            sessions: total.sessions,
+            duration: total.seconds,
+          });
+        });
+        cursor = data.next_cursor;
+      } while (cursor);
 
       setClockLogs(clockLogList);
-      setFilteredClockLogs(clockLogList);
+      setFilteredClockLogs(
+        nameFilter
+          ? clockLogList.filter((log) => log.name?.toLowerCase().includes(nameFilter.toLowerCase()))
+          : clockLogList
+      );
+      setCurrentPage((prev) => ({ ...prev, clock: 1 }));
       if (typeof window !== "undefined") {
         localStorage.setItem("clockLogs", JSON.stringify(clockLogList));
       }
     } catch (error) {
-      console.error("Error fetching clock logs from Firestore:", error);
+      console.error("Error fetching clock reports:", error);
       setClockLogs([]);
       setFilteredClockLogs([]);
       setClockLogsError(error.message || "Failed to fetch clock logs");
@@ -198,44 +201,26 @@ export default function LogsPage() {
 
   const handleLogFilter = (key: string, value: string) => {
     setLogFilter((prev) => ({ ...prev, [key]: value }));
-    let filtered = logs;
-
-    if (logFilter.email || (key === "email" && value)) {
-      filtered = filtered.filter((log) =>
-        log.email?.toLowerCase().includes((key === "email" ? value : logFilter.email).toLowerCase())
-      );
-    }
-
-    if (logFilter.startDate || (key === "startDate" && value)) {
-      const selectedDateStr = key === "startDate" ? value : logFilter.startDate;
-      const selectedDate = new Date(selectedDateStr);
-      const startOfDay = new Date(Date.UTC(selectedDate.getUTCFullYear(), selectedDate.getUTCMonth(), selectedDate.getUTCDate(), 0, 0, 0, 0));
-      const endOfDay = new Date(Date.UTC(selectedDate.getUTCFullYear(), selectedDate.getUTCMonth(), selectedDate.getUTCDate(), 23, 59, 59, 999));
-
-      filtered = filtered.filter((log) => {
-        const logDate = new Date(log.timestamp);
-        return logDate >= startOfDay && logDate <= endOfDay;
-      });
-    }
-
-    if (logFilter.role || (key === "role" && value)) {
-      filtered = filtered.filter((log) =>
-        log.role?.toLowerCase().includes((key === "role" ? value : logFilter.role).toLowerCase())
-      );
-    }
+    const nextFilter = { ...logFilter, [key]: value };
 
-    if (logFilter.action || (key === "action" && value)) {
-      filtered = filtered.filter((log) =>
-        log.action?.toLowerCase().includes((key === "action" ? value : logFilter.action).toLowerCase())
-      );
+    if (key === "email") {
+      setFilteredLogs(filterLogsByEmail(logs, value));
+      setCurrentPage((prev) => ({ ...prev, activity: 1 }));
+      return;
     }
 
-    setFilteredLogs(filtered);
-    setCurrentPage((prev) => ({ ...prev, activity: 1 }));
+    // Other filters are applied by the backend once typing pauses
+    if (logFilterTimer.current) clearTimeout(logFilterTimer.current);
+    logFilterTimer.current = setTimeout(() => fetchLogs(nextFilter), 400);
   };
 
   const handleClockLogFilter = (key: string, value: string) => {
     setClockLogFilter((prev) => ({ ...prev, [key]: value }));
+    // Dates are looked up on the server, since only recent days are loaded
+    if (key === "startDate") {
+      fetchClockLogs(value, clockLogFilter.name);
+      return;
+    }
     let filtered = clockLogs;
 
     if (clockLogFilter.name || (key === "name" && value)) {
@@ -283,11 +268,16 @@ export default function LogsPage() {
 
   const clearFilters = (type: string) => {
     if (type === "activity") {
-      setLogFilter({ email: "", startDate: "", role: "", action: "" });
-      setFilteredLogs(logs);
+      const emptyFilter = { email: "", startDate: "", role: "", action: "" };
+      setLogFilter(emptyFilter);
+      fetchLogs(emptyFilter);
     } else if (type === "clock") {
       setClockLogFilter({ name: "", startDate: "" });
-      setFilteredClockLogs(clockLogs);
+      if (clockLogFilter.startDate) {
+        fetchClockLogs();
+      } else {
+        setFilteredClockLogs(clockLogs);
+      }
     } else if (type === "chat") {
       setMessageLogFilter({ sender: "", content: "" });
       setFilteredMessageLogs(messageLogs);
@@ -419,7 +409,7 @@ export default function LogsPage() {
                 <div className="flex justify-center items-center h-32">
                   <div className="animate-spin rounded-full h-8 w-8 border-t-2 border-b-2 border-primary"></div>
                 </div>
-              ) : logs.length > 0 ? (
+              ) : logs.length > 0 || logFilter.startDate || logFilter.role || logFilter.action ? (
                 <>
                   <div className="mb-6 flex flex-wrap gap-4">
                     <div className="flex-1 min-w-[200px]">
@@ -515,6 +505,15 @@ export default function LogsPage() {
                       >
                         Next
                       </Button>
+                      {logsCursor && (
+                        <Button
+                          variant="outline"
+                          onClick={() => fetchLogs(logFilter, logsCursor)}
+                          className="border-input text-foreground hover:bg-muted"
+                        >
+                          Load More
+                        </Button>
+                      )}
                     </div>
                     <Button
                       variant="outline"
@@ -526,7 +525,7 @@ export default function LogsPage() {
                   </div>
                   <Button
                     variant="outline"
-                    onClick={fetchLogs}
+                    onClick={() => fetchLogs()}
                     className="mt-4 border-primary text-primary hover:bg-primary/10"
                   >
                     Refresh Activity Logs
@@ -700,7 +699,7 @@ export default function LogsPage() {
                 </div>
               ) : clockLogsError ? (
                 <p className="text-destructive">Error: {clockLogsError}</p>
-              ) : clockLogs.length > 0 ? (
+              ) : clockLogs.length > 0 || clockLogFilter.startDate ? (
                 <>
                   <div className="mb-6 flex flex-wrap gap-4">
                     <div className="flex-1 min-w-[200px]">
@@ -733,24 +732,20 @@ export default function LogsPage() {
                     <table className="w-full text-sm text-foreground">
                       <thead className="bg-muted sticky top-0">
                         <tr>
-                          <th className="text-left p-4">Date/Time</th>
+                          <th className="text-left p-4">Date</th>
                           <th className="text-left p-4">Name</th>
                           <th className="text-left p-4">UserID</th>
-                          <th className="text-left p-4">Clock-In Time</th>
-                          <th className="text-left p-4">Duration</th>
+                          <th className="text-left p-4">Sessions</th>
+                          <th className="text-left p-4">Total Time</th>
                         </tr>
                       </thead>
                       <tbody>
                         {paginate(filteredClockLogs, currentPage.clock).map((log) => (
                           <tr key={log.id} className="border-t border-muted hover:bg-muted/50 transition-colors">
-                            <td className="p-4">
-                              {log.timestamp ? new Date(log.timestamp).toLocaleString() : "N/A"}
-                            </td>
+                            <td className="p-4">{log.timestamp || "N/A"}</td>
                             <td className="p-4">{log.name || "N/A"}</td>
                             <td className="p-4">{log.user_id || "N/A"}</td>
-                            <td className="p-4">
-                              {log.clockInTimestamp ? new Date(log.clockInTimestamp).toLocaleString() : "N/A"}
-                            </td>
+                            <td className="p-4">{log.sessions ?? "N/A"}</td>
                             <td className="p-4">{log.duration ? formatDuration(log.duration) : "N/A"}</td>
                           </tr>
                         ))}
@@ -786,7 +781,7 @@ export default function LogsPage() {
                   </div>
                   <Button
                     variant="outline"
-                    onClick={fetchClockLogs}
+                    onClick={() => fetchClockLogs(clockLogFilter.startDate, clockLogFilter.name)}
                     className="mt-4 border-primary text-primary hover:bg-primary/10"
                   >
                     Refresh Clock Logs
@@ -9,7 +9,7 @@ import { checkUserRole } from "@/lib/checkAuth"
 import { useRouter } from "next/navigation"
 import { db, auth, getStudents } from "@/lib/firebaseConfig"
 import { apiUrlBase } from "@/lib/configEnv"
-import { collection, doc, setDoc, onSnapshot, where, query } from "firebase/firestore"
+import { collection, setDoc, onSnapshot, where, query } from "firebase/firestore"
 import { onAuthStateChanged } from "firebase/auth"
 import { markMessageAsRead } from "@/lib/firestoreUtil"
 import { StudentProgressTable } from "@/components/StudentProgressTable"
@@ -219,36 +219,44 @@ export default function InstructorDashboard() {
     return () => unsubscribeQuery()
   }, [userRole, userId, studentIds])
 
-  // Fetch clock-in/out history
-  useEffect(() => {
-    if (!userId) return
-
-    const clockDocRef = doc(db, "clockHistory", userId)
+  // Fetch clock-in/out status and completed sessions
+  const fetchClockSessions = async () => {
+    const token = await auth.currentUser?.getIdToken()
+    if (!token) return
 
-    const unsubscribe = onSnapshot(clockDocRef, (docSnap) => {
-      if (docSnap.exists()) {
-        const data = docSnap.data()
-        const history: ClockHistoryEntry[] = data.entries || []
-        setClockHistory(history.sort((a, b) => new Date(b.timestamp).getTime() - new Date(a.timestamp).getTime()))
+    try {
+      const response = await fetch(`${apiUrlBase}/clock/sessions`, {
+        headers: { Authorization: `Bearer ${token}` },
+      })
+      if (!response.ok) {
+        throw new Error(`Failed to fetch clock sessions: ${await response.text()}`)
+      }
+      const data = await response.json()
 
-        const lastEntry = history[0]
-        if (lastEntry && lastEntry.action === "in" && !lastEntry.clockOutTimestamp) {
-          setIsClockedIn(true)
-          const startTime = new Date(lastEntry.timestamp)
-          const now = new Date()
-          setCurrentSessionDuration(Math.floor((now.getTime() - startTime.getTime()) / 1000))
-        } else {
-          setIsClockedIn(false)
-          setCurrentSessionDuration(0)
-        }
+      // Each completed session is shown as the clock-out that closed it
+      const history: ClockHistoryEntry[] = (data.sessions || []).map((session: any) => ({
+        action: "out",
+        timestamp: session.clock_out,
+        clockInTimestamp: session.clock_in,
+        duration: session.duration,
+      }))
+      setClockHistory(history)
+
+      if (data.isClockedIn && data.clock_in) {
+        setIsClockedIn(true)
+        setCurrentSessionDuration(Math.floor((Date.now() - new Date(data.clock_in).getTime()) / 1000))
       } else {
-        setClockHistory([])
         setIsClockedIn(false)
         setCurrentSessionDuration(0)
       }
-    })
+    } catch (error) {
+      console.error("Error fetching clock sessions:", error)
+    }
+  }
 
-    return () => unsubscribe()
+  useEffect(() => {
+    if (!userId) return
+    fetchClockSessions()
   }, [userId])
 
   // Update current session duration every second if clocked in
@@ -286,7 +294,7 @@ export default function InstructorDashboard() {
       const data = await response.json()
       console.log(`Clock ${action} successful:`, data)
 
-      setIsClockedIn(!isClockedIn)
+      await fetchClockSessions()
     } catch (error) {
       console.error(`Error during clock ${action}:`, error)
     }
@@ -265,7 +265,7 @@ export default function StudentDashboard() {
       try {
         const memberProgressPromises = userGroup.members.map(async (member: GroupMember) => {
           try {
-            const response = await fetch(`${apiUrlBase}/get-user-progress?user_id=${member.user_id}`)
+            const response = await fetch(`${apiUrlBase}/get-user-progress?user_id=${member.user_id}&completed=true`)
             let progressData: ProgressItem[] = []
 
             if (response.ok) {
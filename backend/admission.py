@@ -0,0 +1,77 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+# Coalesces concurrent identical reads: the first caller for a key runs the
+# read and every caller that arrives while it is in flight waits for and
+# shares its result, or its exception. Nothing is kept once the read ends,
+# so this never serves stale data; it only collapses a burst into one call.
+class SingleFlight:
+    def __init__(self):
+        self.leaders = 0
+        self.shared = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if not owner:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+
+# Per-key token buckets holding up to `burst` tokens, refilled at `rate`
+# tokens per second. Only the `max_keys` most recently used keys are kept;
+# an evicted key starts again with a full bucket.
+class RateLimiter:
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.limited = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Take a token for `key`. Returns 0 if the call may go ahead, otherwise
+    # the number of seconds until a token is available.
+    def acquire(self, key):
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+                self.allowed += 1
+            else:
+                wait = (1 - tokens) / self.rate
+                self.limited += 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
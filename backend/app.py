@@ -1,23 +1,94 @@
 import os
-import json
-from datetime import datetime, timedelta
-import firebase_admin
-from firebase_admin import firestore, credentials, auth, storage
+import math
+import uuid
+import hashlib
+from datetime import datetime
+from concurrent.futures import as_completed
 from flask_cors import CORS
-from flask import Flask, request, jsonify
-
-# Set up Firestore database
-service_account_json = os.environ.get("FIREBASE_SERVICE_ACCOUNT_JSON")
-service_account_path = os.environ.get("FIREBASE_SERVICE_ACCOUNT_PATH", "key.json")
-cred = credentials.Certificate(json.loads(service_account_json)) if service_account_json else credentials.Certificate(service_account_path)
-
-if not firebase_admin._apps:
-    firebase_admin.initialize_app(cred, {
-        "storageBucket": "cansat-education-tool.firebasestorage.app"
-    })
-
-bucket = storage.bucket()
-db = firestore.client()
+from flask import Flask, Response, request, jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
+from firebase_clients import db, bucket, auth, FieldPath
+from token_cache import verify_id_token, token_cache
+from user_cache import UserRepository
+from audit_log import create_audit_log
+from blob_catalog import BlobCatalog, BlobContentCache
+from progress_store import ProgressStore, progress_items, UNTYPED
+from clock_store import ClockStore
+from provisioning import provision_users, parse_csv_roster, normalize_row
+from uploads import UploadTracker, UploadTooLarge, UploadHashMismatch, stream_to_blob, valid_upload_id
+from code_runner import CodeRunner, ProblemCatalog, normalize_output
+from admission import SingleFlight, RateLimiter
+import metrics
+import responses
+
+# Firestore, Storage and Auth are set up on first use (see firebase_clients)
+users = UserRepository(db, ttl=int(os.environ.get("USER_CACHE_TTL", "30")))
+
+audit_log = create_audit_log(db)
+progress_store = ProgressStore(db, rollup_shards=int(os.environ.get("SCHOOL_ROLLUP_SHARDS", "10")))
+clock_store = ClockStore(db)
+pdf_catalog = BlobCatalog(
+    bucket,
+    "pdfs/",
+    predicate=lambda name: name.endswith(".pdf"),
+    ttl=int(os.environ.get("PDF_CATALOG_TTL", "300")),
+)
+
+# Languages of the source files served by /get-code, by file extension
+CODE_EXTENSION_LANGUAGES = {
+    ".ino": "cpp",
+    ".c": "c",
+    ".cpp": "cpp",
+    ".h": "cpp",
+    ".py": "python",
+    ".js": "javascript",
+    ".ts": "typescript",
+}
+code_catalog = BlobCatalog(
+    bucket,
+    "code/",
+    predicate=lambda name: any(name.endswith(ext) for ext in CODE_EXTENSION_LANGUAGES),
+    ttl=int(os.environ.get("CODE_CATALOG_TTL", "300")),
+)
+code_contents = BlobContentCache(max_bytes=int(os.environ.get("CODE_CACHE_BYTES", str(32 * 1024 * 1024))))
+
+# Largest PDF accepted by /upload-pdf
+MAX_PDF_BYTES = int(os.environ.get("MAX_PDF_UPLOAD_MB", "100")) * 1024 * 1024
+pdf_uploads = UploadTracker(db)
+
+# Shared pool for fanning out independent Firestore and Storage calls. Its
+# tasks run in the request's context so their calls show up in its metrics.
+io_pool = metrics.ContextThreadPoolExecutor(max_workers=int(os.environ.get("IO_POOL_SIZE", "16")))
+
+# Auth accounts are created on their own small pool so a large roster
+# neither trips Auth rate limits nor starves the shared I/O pool
+provision_pool = metrics.ContextThreadPoolExecutor(max_workers=int(os.environ.get("PROVISION_WORKERS", "8")))
+
+# Student sketches submitted to /run-code are compiled and run on this pool
+# of sandboxed worker processes, graded against the coding problems
+code_runner = CodeRunner(
+    workers=int(os.environ.get("CODE_RUN_WORKERS", "4")),
+    cache_size=int(os.environ.get("CODE_RUN_CACHE_SIZE", "1024")),
+    run_timeout=int(os.environ.get("CODE_RUN_TIMEOUT", "2")),
+    memory_mb=int(os.environ.get("CODE_RUN_MEMORY_MB", "256")),
+    loop_iterations=int(os.environ.get("CODE_RUN_LOOP_ITERATIONS", "1")),
+    allow_unsandboxed=os.environ.get("CODE_RUN_ALLOW_UNSANDBOXED", "").lower() in ("1", "true", "yes"),
+)
+coding_problems = ProblemCatalog(db, ttl=int(os.environ.get("CODING_PROBLEMS_TTL", "60")))
+
+# Largest sketch /run-code accepts
+MAX_CODE_BYTES = 64 * 1024
+
+# Concurrent identical reads of the hot read routes share one upstream call
+read_flights = SingleFlight()
+
+# Per-user limits on the write routes: sustained requests per second and the
+# burst allowed on top. WRITE_RATE_LIMIT=0 turns the limits off.
+write_limits = RateLimiter(
+    rate=float(os.environ.get("WRITE_RATE_LIMIT", "2")),
+    burst=int(os.environ.get("WRITE_RATE_BURST", "30")),
+)
 
 app = Flask(__name__)
 # CORS(app, resources={
@@ -29,11 +100,184 @@ app = Flask(__name__)
 # })
 CORS(app)
 
+# Number of proxies in front of the backend (a load balancer, Vercel) whose
+# X-Forwarded-For entry is trusted as the client address
+TRUSTED_PROXY_COUNT = int(os.environ.get("TRUSTED_PROXY_COUNT", "0"))
+if TRUSTED_PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
+
+# Werkzeug rejects request bodies larger than the biggest PDF upload, plus
+# room for the multipart headers, before they are read or spooled to disk
+app.config["MAX_CONTENT_LENGTH"] = MAX_PDF_BYTES + 64 * 1024
+
+# Per-route latency and backend call metrics, served at /metrics
+metrics.install(app)
+
+# Compression, ETags and Cache-Control for JSON responses
+responses.install(app)
+
+# Cache hit counts reported on /metrics
+def cache_metrics():
+    caches = {
+        "users": users,
+        "tokens": token_cache,
+        "code_contents": code_contents,
+        "code_runs": code_runner.cache,
+    }
+    return [
+        ("cache_hits_total", "counter", "Cache hits since start.", ["cache"],
+         {(name, ): cache.hits for name, cache in caches.items()}),
+        ("cache_misses_total", "counter", "Cache misses since start.", ["cache"],
+         {(name, ): cache.misses for name, cache in caches.items()}),
+    ]
+
+metrics.registry.add_collector(cache_metrics)
+
+# Coalesced reads and rate-limited writes reported on /metrics
+def admission_metrics():
+    return [
+        ("coalesced_reads_total", "counter", "Reads that shared an identical in-flight read.", [],
+         {(): read_flights.shared}),
+        ("rate_limited_requests_total", "counter", "Write requests refused with 429.", [],
+         {(): write_limits.limited}),
+    ]
+
+metrics.registry.add_collector(admission_metrics)
+
+# Helper function to take a write from `uid` on `route`, returning a 429
+# response with Retry-After if they are over their limit, or None. `uid`
+# must identify the caller, see write_limit_key.
+def rate_limited(route, uid):
+    wait = write_limits.acquire((route, uid))
+    if not wait:
+        return None
+    return jsonify({"error": "Too many requests, please try again later"}), 429, {"Retry-After": str(math.ceil(wait))}
+
+# Helper function to get whom to count a write against on routes that take
+# the user id in the body: the verified caller when a Bearer token is sent,
+# otherwise the client address, so nobody can use up another user's limit or
+# dodge their own by changing the id. The body id is only a last resort.
+def write_limit_key(body_user_id):
+    id_token = request.headers.get("Authorization", "").replace("Bearer ", "")
+    if id_token:
+        return "uid:" + verify_id_token(id_token)["uid"]
+    if request.remote_addr:
+        return "addr:" + request.remote_addr
+    return "user:" + body_user_id
+
 # Helper function to get user data
 def get_user_data(uid):
-    user_ref = db.collection("users").document(uid)
-    user_doc = user_ref.get()
-    return user_doc.to_dict() if user_doc.exists else {}
+    return users.get(uid) or {}
+
+# Helper function to get the public part of a user's profile
+def get_user_summary(user_id, user_data):
+    return {
+        "user_id": user_id,
+        "name": user_data.get("name", "Unknown"),
+        "email": user_data.get("email", "No email provided"),
+    }
+
+# Helper function to get the profile of a user whose progress counts towards
+# their school's rollup, or None for users who are not students
+def get_rollup_student(user_id):
+    user_data = users.get(user_id)
+    if user_data is None or user_data.get("role") != "student":
+        return None
+    return user_data
+
+# Helper function to shape a school rollup for /school-progress, adding
+# completion percentages and sorting students by name
+def school_progress_payload(school_id, rollup):
+    students = [
+        {
+            "user_id": user_id,
+            **entry,
+            "percent_complete": round(entry["completed"] * 100 / entry["tracked"], 1) if entry["tracked"] else 0,
+        }
+        for user_id, entry in rollup.get("students", {}).items()
+    ]
+    students.sort(key=lambda student: student["name"].lower())
+
+    materials = []
+    for material_type, type_materials in rollup.get("materials", {}).items():
+        for material_id, material in type_materials.items():
+            materials.append({
+                "material_id": material_id,
+                "type": material_type,
+                **material,
+                "completion_rate": round(material["completed"] * 100 / len(students), 1) if students else 0,
+            })
+    materials.sort(key=lambda material: (material["type"], material.get("title") or ""))
+
+    return {"school_id": school_id, "students": students, "materials": materials}
+
+# Helper function to describe a code file, without its source
+def get_code_entry(idx, blob):
+    filename = blob.name.split("/")[-1]
+    name, ext = os.path.splitext(filename)
+    return {
+        "id": str(idx + 1),
+        "name": name,
+        "filename": filename,
+        "language": CODE_EXTENSION_LANGUAGES.get(ext, "plaintext"),
+        "description": "",
+        "url": code_catalog.signed_url(blob),
+    }
+
+# Helper function to list the code files, with their source unless
+# include_content is false. Shared by the Flask and ASGI /get-code routes, so
+# concurrent identical listings are coalesced whichever serves them.
+def list_code(include_content):
+    def fetch():
+        code_files = code_catalog.blobs()
+        contents = code_contents.fetch_many(code_files, io_pool) if include_content else {}
+
+        code_list = []
+        for idx, blob in enumerate(code_files):
+            code_entry = get_code_entry(idx, blob)
+            if include_content:
+                code_entry["code"] = contents[blob.name]
+            code_list.append(code_entry)
+        return code_list
+
+    return read_flights.do(("get-code", include_content), fetch)
+
+# Maximum number of ids accepted by /users/batch in one call
+MAX_BATCH_USERS = 500
+
+# Maximum number of items accepted by /mark-progress/batch in one call
+MAX_PROGRESS_BATCH = 200
+
+# Multi-document reads are split into chunks of this many documents
+FIRESTORE_CHUNK_SIZE = 100
+
+# Largest page of users /users returns at once
+MAX_USERS_PAGE = 1000
+
+# Largest page of sessions /clock/sessions and totals /clock/reports return at once
+MAX_CLOCK_SESSIONS_PAGE = 200
+
+# Largest page of events /logs returns at once
+MAX_LOGS_PAGE = 200
+
+# Largest roster /provision-users accepts at once
+MAX_PROVISION_ROWS = 1000
+
+# Helper function to split a list into lists of at most size items
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+# Helper function to read the progress documents of many students, with one
+# get_all per chunk running concurrently on the I/O pool. Yields each chunk's
+# existing documents in completion order.
+def iter_progress_chunks(student_ids):
+    def fetch(chunk):
+        refs = [db.collection("progress").document(user_id) for user_id in chunk]
+        return [doc for doc in db.get_all(refs) if doc.exists]
+
+    futures = [io_pool.submit(fetch, chunk) for chunk in chunked(student_ids, FIRESTORE_CHUNK_SIZE)]
+    for future in as_completed(futures):
+        yield future.result()
 
 @app.route("/", methods=["GET"])
 def health():
@@ -46,27 +290,16 @@ def login():
         return "", 200
     try:
         id_token = request.json.get("idToken")
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = verify_id_token(id_token)
         uid = decoded_token["uid"]
 
         user_data = get_user_data(uid)
-        log_ref = db.collection("logs").document(uid)
-        log_entry = {
-            "action": "User Logged In",
-            "timestamp": datetime.now().isoformat(),
-            "email": user_data.get("email", "unknown"),
-            "role": user_data.get("role", "unknown")
-        }
-
-        log_doc = log_ref.get()
-        if log_doc.exists:
-            log_ref.update({
-                "entries": firestore.ArrayUnion([log_entry])
-            })
-        else:
-            log_ref.set({
-                "entries": [log_entry]
-            })
+        audit_log.log(
+            uid,
+            "User Logged In",
+            email=user_data.get("email", "unknown"),
+            role=user_data.get("role", "unknown"),
+        )
 
         return jsonify({"message": "Login successful", "uid": uid}), 200
     except Exception as e:
@@ -82,27 +315,19 @@ def logout():
         id_token = request.json.get("idToken")
         if not id_token:
             return jsonify({"error": "No idToken provided"}), 400
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = verify_id_token(id_token)
         uid = decoded_token["uid"]
 
         user_data = get_user_data(uid)
-        log_ref = db.collection("logs").document(uid)
-        log_entry = {
-            "action": "User Logged Out",
-            "timestamp": datetime.now().isoformat(),
-            "email": user_data.get("email", "unknown"),
-            "role": user_data.get("role", "unknown")
-        }
+        audit_log.log(
+            uid,
+            "User Logged Out",
+            email=user_data.get("email", "unknown"),
+            role=user_data.get("role", "unknown"),
+        )
 
-        log_doc = log_ref.get()
-        if log_doc.exists:
-            log_ref.update({
-                "entries": firestore.ArrayUnion([log_entry])
-            })
-        else:
-            log_ref.set({
-                "entries": [log_entry]
-            })
+        # Signed-out tokens should go through full verification next time
+        token_cache.discard(id_token)
 
         return jsonify({"message": "Logout successful"}), 200
     except Exception as e:
@@ -118,16 +343,15 @@ def avatar():
         id_token = request.headers.get("Authorization", "").replace("Bearer ", "")
         if not id_token:
             return jsonify({"error": "No idToken provided"}), 401
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = verify_id_token(id_token)
         uid = decoded_token["uid"]
 
         user_ref = db.collection("users").document(uid)
 
         if request.method == "GET":
-            user_doc = user_ref.get()
-            if not user_doc.exists:
+            user_data = users.get(uid)
+            if user_data is None:
                 return jsonify({"error": "User not found"}), 404
-            user_data = user_doc.to_dict()
             avatar_seed = user_data.get("avatarSeed", 1)
             return jsonify({"avatarSeed": avatar_seed}), 200
 
@@ -149,6 +373,7 @@ def avatar():
             user_ref.update({
                 "avatarSeed": avatar_seed
             })
+            users.invalidate(uid)
 
             return jsonify({"message": "Avatar updated successfully", "avatarSeed": avatar_seed}), 200
 
@@ -196,24 +421,9 @@ def register():
         }
 
         user_ref.set(user_data)
+        users.invalidate(user_id)
 
-        log_ref = db.collection("logs").document(user_id)
-        log_entry = {
-            "action": "User Registered",
-            "timestamp": datetime.now().isoformat(),
-            "email": email,
-            "role": role
-        }
-
-        log_doc = log_ref.get()
-        if log_doc.exists:
-            log_ref.update({
-            "entries": firestore.ArrayUnion([log_entry])
-            })
-        else:
-            log_ref.set({
-            "entries": [log_entry]
-            })
+        audit_log.log(user_id, "User Registered", email=email, role=role)
 
         response = {
             "message": "User registered successfully.",
@@ -252,17 +462,18 @@ def check_role():
         return "", 200
     try:
         id_token = request.json.get("idToken")
-        decoded_token = auth.verify_id_token(id_token)
-        uid = decoded_token["uid"]
-
-        user_ref = db.collection("users").document(uid)
-        user_doc = user_ref.get()
 
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            return jsonify({"role": user_data.get("role"), "verified": user_data.get("verified")})
-        else:
-            return jsonify({"error": "User not found"}), 404
+        def check():
+            decoded_token = verify_id_token(id_token)
+            user_data = users.get(decoded_token["uid"])
+            if user_data is not None:
+                return {"role": user_data.get("role"), "verified": user_data.get("verified")}, 200
+            return {"error": "User not found"}, 404
+
+        # A page load sends the same token several times at once
+        key = ("check-role", hashlib.sha256(id_token.encode("utf-8")).hexdigest()) if id_token else None
+        payload, status = read_flights.do(key, check) if key else check()
+        return jsonify(payload), status
     except Exception as e:
         return jsonify({"error": str(e)}), 401
 
@@ -274,7 +485,7 @@ def get_users():
         id_token = request.headers.get("Authorization", "").replace("Bearer ", "")
         if not id_token:
             return jsonify({"error": "No idToken provided"}), 401
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = verify_id_token(id_token)
         admin_uid = decoded_token["uid"]
 
         # Verify admin role
@@ -282,10 +493,56 @@ def get_users():
         if admin_data.get("role") != "admin":
             return jsonify({"error": "Unauthorized: Admin access required"}), 403
 
-        users_ref = db.collection("users")
-        users = users_ref.stream()
-        user_list = [{"user_id": user.id, **user.to_dict()} for user in users]
-        return jsonify(user_list)
+        # Optional filters, ordered by document id so pages are stable
+        users_query = db.collection("users")
+        role = request.args.get("role")
+        if role:
+            users_query = users_query.where("role", "==", role)
+        school_id = request.args.get("school_id")
+        if school_id:
+            users_query = users_query.where("school_id", "==", school_id)
+        users_query = users_query.order_by(FieldPath.document_id())
+
+        # Only download the requested fields, e.g. ?fields=name,email,role
+        fields = [field.strip() for field in request.args.get("fields", "").split(",") if field.strip()]
+        if fields:
+            users_query = users_query.select(fields)
+
+        start_after = request.args.get("start_after")
+        if start_after:
+            users_query = users_query.start_after({FieldPath.document_id(): start_after})
+
+        # A malformed limit is refused rather than read as "no limit", and a
+        # large one is cut down to MAX_USERS_PAGE
+        limit = request.args.get("limit")
+        if limit is not None:
+            if not limit.isdigit() or int(limit) < 1:
+                return jsonify({"error": "limit must be a positive integer"}), 400
+            limit = min(int(limit), MAX_USERS_PAGE)
+            # Read one extra user to learn whether there is a next page
+            users_query = users_query.limit(limit + 1)
+
+        # Users are written out as they arrive from Firestore instead of being
+        # collected into a list first. Without a limit the response is the
+        # plain array it has always been; with one it is {users, next_cursor}.
+        def generate():
+            yield "[" if limit is None else '{"users":['
+            last_id = None
+            next_cursor = None
+            count = 0
+            for user_doc in users_query.stream():
+                if limit is not None and count == limit:
+                    next_cursor = last_id
+                    break
+                yield ("," if count else "") + app.json.dumps({"user_id": user_doc.id, **user_doc.to_dict()})
+                last_id = user_doc.id
+                count += 1
+            if limit is None:
+                yield "]"
+            else:
+                yield '],"next_cursor":' + app.json.dumps(next_cursor) + "}"
+
+        return Response(stream_with_context(generate()), mimetype="application/json")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -298,7 +555,7 @@ def edit_user():
         id_token = request.headers.get("Authorization", "").replace("Bearer ", "")
         if not id_token:
             return jsonify({"error": "No idToken provided"}), 401
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = verify_id_token(id_token)
         admin_uid = decoded_token["uid"]
 
         # Verify admin role
@@ -326,31 +583,18 @@ def edit_user():
         except Exception as e:
             return jsonify({"error": f"User not found: {str(e)}"}), 404
 
+        previous_data = get_user_data(user_id)
         user_ref = db.collection("users").document(user_id)
         user_ref.update({
             "email": email,
             "name": name,
             "role": role,
         })
+        users.invalidate(user_id)
+        if previous_data.get("school_id"):
+            progress_store.invalidate_school_rollup(previous_data["school_id"])
 
-        log_ref = db.collection("logs").document(user_id)
-        log_entry = {
-            "action": "User Edited",
-            "timestamp": datetime.now().isoformat(),
-            "email": email,
-            "role": role,
-            "edited_by": admin_uid
-        }
-
-        log_doc = log_ref.get()
-        if log_doc.exists:
-            log_ref.update({
-                "entries": firestore.ArrayUnion([log_entry])
-            })
-        else:
-            log_ref.set({
-                "entries": [log_entry]
-            })
+        audit_log.log(user_id, "User Edited", email=email, role=role, edited_by=admin_uid)
 
         return jsonify({"message": "User updated successfully"}), 200
     except Exception as e:
@@ -364,26 +608,23 @@ def delete_user():
         data = request.json
         user_id = data["user_id"]
 
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
+        user_data = users.get(user_id)
+        if user_data is None:
             return jsonify({"error": "User not found"}), 404
-            
-        user_data = user_doc.to_dict()
 
-        user_ref.delete()
+        db.collection("users").document(user_id).delete()
+        users.invalidate(user_id)
+        if user_data.get("school_id"):
+            progress_store.invalidate_school_rollup(user_data["school_id"])
         auth.delete_user(user_id)
 
-        log_ref = db.collection("logs").document()
-        log_ref.set({
-            "user_id": user_id,
-            "email": user_data.get("email", "unknown"),
-            "name": user_data.get("name", "unknown"),
-            "role": user_data.get("role", "unknown"),
-            "timestamp": datetime.now().isoformat(),
-            "action": "User Deleted"
-        })
+        audit_log.log(
+            user_id,
+            "User Deleted",
+            email=user_data.get("email", "unknown"),
+            name=user_data.get("name", "unknown"),
+            role=user_data.get("role", "unknown"),
+        )
 
         return jsonify({"message": "User deleted successfully"}), 200
     except Exception as e:
@@ -412,42 +653,95 @@ def create_user():
             "school_id": school_id,
             "verified": False
         })
+        users.invalidate(user.uid)
+        if role == "student" and school_id:
+            progress_store.invalidate_school_rollup(school_id)
 
-        log_ref = db.collection("logs").document()
-        log_ref.set({
-            "user_id": user.uid,
-            "email": email,
-            "name": name,
-            "role": role,
-            "timestamp": datetime.now().isoformat(),
-            "action": "User Created"
-        })
+        audit_log.log(user.uid, "User Created", email=email, name=name, role=role)
 
         return jsonify({"message": "User created successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# API route for admins to create many users at once from a roster, sent as
+# CSV (a text/csv body or a "file" upload) or JSON ({"users": [...]} or a
+# list). Rows have the /create-user fields; the response has one result per
+# row, so a partly valid roster still creates every valid user.
+@app.route("/provision-users", methods=["POST", "OPTIONS"])
+def provision_users_route():
+    if request.method == "OPTIONS":
+        return "", 200
+    try:
+        id_token = request.headers.get("Authorization", "").replace("Bearer ", "")
+        if not id_token:
+            return jsonify({"error": "No idToken provided"}), 401
+        decoded_token = verify_id_token(id_token)
+        admin_uid = decoded_token["uid"]
+
+        # Verify admin role
+        admin_data = get_user_data(admin_uid)
+        if admin_data.get("role") != "admin":
+            return jsonify({"error": "Unauthorized: Admin access required"}), 403
+
+        if request.mimetype == "text/csv":
+            rows = parse_csv_roster(request.get_data(as_text=True))
+        elif "file" in request.files:
+            rows = parse_csv_roster(request.files["file"].read().decode("utf-8-sig"))
+        else:
+            data = request.get_json(silent=True)
+            rows = data.get("users") if isinstance(data, dict) else data
+            if not isinstance(rows, list):
+                return jsonify({"error": "Expected a CSV roster or a JSON list of users"}), 400
+            rows = [normalize_row(row) for row in rows]
+
+        if not rows:
+            return jsonify({"error": "Roster is empty"}), 400
+        if len(rows) > MAX_PROVISION_ROWS:
+            return jsonify({"error": f"At most {MAX_PROVISION_ROWS} users can be provisioned at once"}), 400
+
+        results = provision_users(db, rows, provision_pool, admin_uid, log_collection=audit_log.collection)
+
+        # New students change their schools' progress rollups
+        school_ids = {
+            rows[result["row"] - 1].get("school_id")
+            for result in results
+            if result["status"] == "created" and rows[result["row"] - 1]["role"] == "student"
+        }
+        for school_id in school_ids - {None, ""}:
+            progress_store.invalidate_school_rollup(school_id)
+
+        created = sum(1 for result in results if result["status"] == "created")
+        return jsonify({"created": created, "failed": len(results) - created, "results": results}), 200
+
+    except Exception as e:
+        print(f"Provision users error: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 # API route to get pdfs from the database
 @app.route("/get-pdfs", methods=["GET"])
 def get_pdfs():
     try:
-        blobs = bucket.list_blobs(prefix="pdfs/")
-        pdf_files = [blob for blob in blobs if blob.name.endswith(".pdf")]
-
-        pdf_list = []
-        for idx, blob in enumerate(pdf_files):
-            url = blob.generate_signed_url(expiration=timedelta(hours=1), method="GET")
-            size_mb = round(blob.size / (1024 * 1024), 2)
-            last_modified = blob.updated
-
-            pdf_list.append({
-                "id": str(idx + 1),
-                "name": blob.name,
-                "url": url,
-                "size_mb": size_mb,
-                "last_modified": last_modified if last_modified else None
-            })
-
+        def list_pdfs():
+            pdf_files = pdf_catalog.blobs()
+
+            pdf_list = []
+            for idx, blob in enumerate(pdf_files):
+                url = pdf_catalog.signed_url(blob)
+                size_mb = round(blob.size / (1024 * 1024), 2)
+                last_modified = blob.updated
+
+                pdf_list.append({
+                    "id": str(idx + 1),
+                    "name": blob.name,
+                    "url": url,
+                    "size_mb": size_mb,
+                    "last_modified": last_modified if last_modified else None
+                })
+            return pdf_list
+
+        pdf_list = read_flights.do(("get-pdfs",), list_pdfs)
+
+        # Unchanged catalogues are answered with 304 Not Modified (see responses.py)
         return jsonify(pdf_list), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -455,40 +749,65 @@ def get_pdfs():
 # API route to get code resources from the database
 @app.route("/get-code", methods=["GET"])
 def get_code():
-    extension_languages = {
-        ".ino": "cpp",
-        ".c": "c",
-        ".cpp": "cpp",
-        ".h": "cpp",
-        ".py": "python",
-        ".js": "javascript",
-        ".ts": "typescript",
-    }
     try:
-        blobs = bucket.list_blobs(prefix="code/")
-        code_files = [
-            blob for blob in blobs
-            if any(blob.name.endswith(ext) for ext in extension_languages)
-        ]
+        # ?content=false returns the listing only; the source of a single file
+        # is then fetched from /get-code/<id>
+        include_content = request.args.get("content", "true").lower() not in ("0", "false", "no")
+        return jsonify(list_code(include_content)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        code_list = []
-        for idx, blob in enumerate(code_files):
-            filename = blob.name.split("/")[-1]
-            name, ext = os.path.splitext(filename)
-            content = blob.download_as_text()
-            url = blob.generate_signed_url(expiration=timedelta(hours=1), method="GET")
-
-            code_list.append({
-                "id": str(idx + 1),
-                "name": name,
-                "filename": filename,
-                "language": extension_languages.get(ext, "plaintext"),
-                "code": content,
-                "description": "",
-                "url": url,
-            })
+# API route to get a single code resource, including its source
+@app.route("/get-code/<code_id>", methods=["GET"])
+def get_code_file(code_id):
+    try:
+        code_files = code_catalog.blobs()
+        if not code_id.isdigit() or not 1 <= int(code_id) <= len(code_files):
+            return jsonify({"error": "Code resource not found"}), 404
+
+        idx = int(code_id) - 1
+        blob = code_files[idx]
+        code_entry = get_code_entry(idx, blob)
+        code_entry["code"] = code_contents.fetch_many([blob], io_pool)[blob.name]
+        return jsonify(code_entry), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API route to compile and run a student's Arduino sketch. When a
+# problem_id is given the output is also graded against that problem's
+# expected output.
+@app.route("/run-code", methods=["POST"])
+def run_code():
+    try:
+        id_token = request.headers.get("Authorization", "").replace("Bearer ", "")
+        if not id_token:
+            return jsonify({"error": "No idToken provided"}), 401
+        verify_id_token(id_token)
+
+        data = request.json or {}
+        code = data.get("code")
+        if not isinstance(code, str) or not code.strip():
+            return jsonify({"error": "code is required"}), 400
+        if len(code.encode("utf-8")) > MAX_CODE_BYTES:
+            return jsonify({"error": f"Code must be at most {MAX_CODE_BYTES // 1024} KB"}), 413
+
+        problem = None
+        problem_id = data.get("problem_id")
+        # Any id but a missing one is graded; 0 is a valid problem id
+        if problem_id is not None:
+            problem = coding_problems.get(problem_id)
+            if problem is None:
+                return jsonify({"error": "Problem not found"}), 404
+
+        result = code_runner.run(code)
+        result["output"] = normalize_output(result["output"])
+        if problem is not None:
+            result["problem_id"] = problem_id
+            result["correct"] = result["error"] is None and result["output"] == problem.get("expectedOutput")
+        return jsonify(result), 200
 
-        return jsonify(code_list), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -496,40 +815,109 @@ def get_code():
 @app.route("/upload-pdf", methods=["POST"])
 def upload_pdf():
     try:
-        if "file" not in request.files:
-            return jsonify({"error": "No file provided"}), 400
-
-        file = request.files["file"]
-        if not file.filename.endswith(".pdf"):
+        # A raw application/pdf body is streamed straight to storage, with the
+        # file name and user id in the query string or headers. Multipart form
+        # uploads are still accepted and go through the same chunked pipeline.
+        # Checked before request.files, which would read the whole body first.
+        # A multipart body within the limit is still spooled by Werkzeug
+        # before it is copied to storage; only a raw application/pdf body is
+        # streamed straight through.
+        if request.content_length and request.content_length > MAX_PDF_BYTES + 64 * 1024:
+            return jsonify({"error": f"File exceeds the {MAX_PDF_BYTES // (1024 * 1024)} MB upload limit"}), 413
+        upload_id = request.headers.get("X-Upload-Id") or uuid.uuid4().hex
+        if not valid_upload_id(upload_id):
+            return jsonify({"error": "Invalid X-Upload-Id"}), 400
+
+        if request.mimetype == "application/pdf":
+            filename = request.args.get("filename") or request.headers.get("X-Filename", "")
+            id_token = request.args.get("userId") or request.headers.get("X-User-Id")
+            source = request.stream
+        else:
+            if "file" not in request.files:
+                return jsonify({"error": "No file provided"}), 400
+            file = request.files["file"]
+            filename = file.filename
+            id_token = request.form.get("userId")
+            source = file.stream
+
+        filename = os.path.basename(filename or "")
+        if not filename.endswith(".pdf"):
             return jsonify({"error": "Only PDF files are allowed"}), 400
 
-        id_token = request.form.get("userId")
         # if not id_token:
         #     return jsonify({"error": "Authentication token required"}), 401
         # decoded_token = auth.verify_id_token(id_token)
         # uid = decoded_token["uid"]
         user_data = get_user_data(id_token)
 
-        filename = file.filename
+        # Skip the upload when the client's content hash matches the stored file
+        expected_sha256 = request.headers.get("X-Content-SHA256", "").lower() or None
+        if expected_sha256:
+            existing = bucket.get_blob(f"pdfs/{filename}")
+            if existing is not None and (existing.metadata or {}).get("sha256") == expected_sha256:
+                return jsonify({
+                    "message": "File already uploaded",
+                    "name": filename,
+                    "url": existing.public_url,
+                    "sha256": expected_sha256,
+                    "unchanged": True,
+                }), 200
+
+        pdf_uploads.start(upload_id, filename, request.content_length)
         blob = bucket.blob(f"pdfs/{filename}")
-        blob.upload_from_file(file, content_type="application/pdf")
-        blob.make_public()
+        try:
+            sha256, size = stream_to_blob(
+                source,
+                blob,
+                "application/pdf",
+                MAX_PDF_BYTES,
+                expected_sha256=expected_sha256,
+                on_progress=lambda received: pdf_uploads.advance(upload_id, received),
+            )
+        except UploadTooLarge as e:
+            pdf_uploads.finish(upload_id, "failed")
+            return jsonify({"error": str(e)}), 413
+        except UploadHashMismatch as e:
+            pdf_uploads.finish(upload_id, "failed")
+            return jsonify({"error": str(e)}), 400
+        except Exception:
+            pdf_uploads.finish(upload_id, "failed")
+            raise
+        pdf_uploads.finish(upload_id, "complete", size)
 
-        log_ref = db.collection("logs").document()
-        log_ref.set({
-            "user_id": id_token,
-            "email": user_data.get("email", "unknown"),
-            "name": user_data.get("name", "unknown"),
-            "role": user_data.get("role", "unknown"),
-            "timestamp": datetime.now().isoformat(),
-            "action": "PDF Uploaded",
-            "filename": filename
-        })
+        blob.make_public()
+        pdf_catalog.invalidate()
+
+        audit_log.log(
+            id_token,
+            "PDF Uploaded",
+            email=user_data.get("email", "unknown"),
+            name=user_data.get("name", "unknown"),
+            role=user_data.get("role", "unknown"),
+            filename=filename,
+        )
 
-        return jsonify({"message": "File uploaded successfully", "name": filename, "url": blob.public_url}), 200
+        return jsonify({
+            "message": "File uploaded successfully",
+            "name": filename,
+            "url": blob.public_url,
+            "upload_id": upload_id,
+            "sha256": sha256,
+            "size": size,
+        }), 200
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"File exceeds the {MAX_PDF_BYTES // (1024 * 1024)} MB upload limit"}), 413
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# API route to poll the progress of a running /upload-pdf request
+@app.route("/upload-pdf/<upload_id>", methods=["GET"])
+def upload_pdf_progress(upload_id):
+    upload = pdf_uploads.get(upload_id) if valid_upload_id(upload_id) else None
+    if upload is None:
+        return jsonify({"error": "Upload not found"}), 404
+    return jsonify(upload), 200
+
 # API route to delete a pdf from Firebase Storage
 # API route to delete a pdf from Firebase Storage
 @app.route("/delete-pdf", methods=["POST"])
@@ -545,7 +933,7 @@ def delete_pdf():
             return jsonify({"error": "Authentication token required"}), 401
 
         # Verify the user
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = verify_id_token(id_token)
         uid = decoded_token["uid"]
         user_data = get_user_data(uid)
 
@@ -555,18 +943,18 @@ def delete_pdf():
 
         # Delete the file from Firebase Storage
         blob.delete()
+        pdf_catalog.invalidate()
+        code_catalog.invalidate()
 
         # Log the deletion action
-        log_ref = db.collection("logs").document()
-        log_ref.set({
-            "user_id": uid,
-            "email": user_data.get("email", "unknown"),
-            "name": user_data.get("name", "unknown"),
-            "role": user_data.get("role", "unknown"),
-            "timestamp": datetime.now().isoformat(),
-            "action": "PDF Deleted",
-            "filename": file_name
-        })
+        audit_log.log(
+            uid,
+            "PDF Deleted",
+            email=user_data.get("email", "unknown"),
+            name=user_data.get("name", "unknown"),
+            role=user_data.get("role", "unknown"),
+            filename=file_name,
+        )
 
         return jsonify({"message": f"Successfully deleted {file_name}"}), 200
     except Exception as e:
@@ -580,46 +968,44 @@ def mark_progress():
         user_id = data.get('user_id')
         material_id = data.get('material_id')
         title = data.get('title')
-        type = data.get('type')
-        completed = data.get('completed')
-        completion_date = data.get('completion_date')
         accessed_at = data.get('accessed_at')
 
         if not all([user_id, material_id, title, accessed_at]):
             return jsonify({"error": "Missing required fields"}), 400
 
-        progress_ref = db.collection('progress').document(user_id)
-        progress_doc = progress_ref.get()
+        limited = rate_limited("mark-progress", write_limit_key(user_id))
+        if limited:
+            return limited
 
-        if progress_doc.exists:
-            progress_data = progress_doc.to_dict()
-            items = progress_data.get('items', [])
-        else:
-            items = []
+        progress_store.mark(user_id, [data], student=get_rollup_student(user_id))
 
-        # Update or add the progress record
-        found = False
+        return jsonify({"message": "Progress updated successfully"}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API route to send many progress updates for one student at once
+@app.route('/mark-progress/batch', methods=['POST'])
+def mark_progress_batch():
+    try:
+        data = request.json
+        user_id = data.get('user_id')
+        items = data.get('items')
+
+        if not user_id or not isinstance(items, list) or not items:
+            return jsonify({"error": "Missing required fields"}), 400
+        if len(items) > MAX_PROGRESS_BATCH:
+            return jsonify({"error": f"At most {MAX_PROGRESS_BATCH} items can be marked at once"}), 400
         for item in items:
-            if item["material_id"] == material_id:
-                item["completed"] = completed
-                item["completion_date"] = completion_date
-                found = True
-                break
-
-        if not found:
-            items.append({
-                "material_id": material_id,
-                "type": type,
-                "title": title,
-                "accessed_at": accessed_at,
-                "completed": completed,
-                "completion_date": completion_date,
-            })
+            if not isinstance(item, dict) or not all([item.get('material_id'), item.get('title'), item.get('accessed_at')]):
+                return jsonify({"error": "Missing required fields"}), 400
 
-        # Save back to Firestore
-        progress_ref.set({"user_id": user_id, "items": items})
+        limited = rate_limited("mark-progress", write_limit_key(user_id))
+        if limited:
+            return limited
 
-        return jsonify({"message": "Progress updated successfully"}), 200
+        progress_store.mark(user_id, items, student=get_rollup_student(user_id))
+
+        return jsonify({"message": "Progress updated successfully", "count": len(items)}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -632,22 +1018,66 @@ def get_user_progress():
         if not user_id:
             return jsonify({"error": "Missing required parameters"}), 400
 
-        # Fetch the user document from Firestore
-        progress_ref = db.collection('progress').document(user_id)
-        progress_doc = progress_ref.get()
-
-        # Extract progress items if the document exists
-        if progress_doc.exists:
-            progress_data = progress_doc.to_dict()
-            items = progress_data.get('items', [])
-            if not progress_type:
-                return jsonify(items), 200
-            # Filter the progress by type (e.g., "training_material")
-            filtered_items = [item for item in items if item.get('type') == progress_type]
-        else:
-            filtered_items = []
+        completed = request.args.get('completed')
+        if completed is not None:
+            completed = completed.lower() in ("1", "true", "yes")
+
+        # Only the requested type's entries are read when a type is given
+        items = progress_store.items(
+            user_id,
+            progress_type,
+            completed=completed,
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+        )
+
+        # Without a limit the whole filtered list is returned, as before. The
+        # limit only pages the response: a student's progress is one
+        # document, so each page still reads all of their entries of the
+        # requested type (or all entries, without one) and slices them here.
+        limit = request.args.get('limit')
+        if limit is None:
+            return jsonify(items), 200
+        if not limit.isdigit() or int(limit) < 1:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        limit = int(limit)
+
+        # Cursors are "<type>/<material_id>" of the last item of the previous page
+        start = 0
+        cursor = request.args.get('cursor')
+        if cursor:
+            keys = [f"{item.get('type') or UNTYPED}/{item['material_id']}" for item in items]
+            if cursor not in keys:
+                return jsonify({"error": "Invalid cursor"}), 400
+            start = keys.index(cursor) + 1
+
+        page = items[start:start + limit]
+        next_cursor = None
+        if start + limit < len(items):
+            next_cursor = f"{page[-1].get('type') or UNTYPED}/{page[-1]['material_id']}"
+        return jsonify({"items": page, "next_cursor": next_cursor}), 200
 
-        return jsonify(filtered_items), 200  # Returning the filtered list directly
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API route to get a student's progress counts without their full history
+@app.route('/get-user-progress/summary', methods=['GET'])
+def get_user_progress_summary():
+    try:
+        user_id = request.args.get('user_id')
+        if not user_id:
+            return jsonify({"error": "Missing required parameters"}), 400
+
+        summary = progress_store.summary(user_id)
+        tracked = sum(counts["tracked"] for counts in summary.values())
+        completed = sum(counts["completed"] for counts in summary.values())
+        return jsonify({
+            "user_id": user_id,
+            "types": summary,
+            "tracked": tracked,
+            "completed": completed,
+            "percent_complete": round(completed * 100 / tracked, 1) if tracked else 0,
+        }), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -662,11 +1092,10 @@ def get_student_progress():
             return jsonify({"error": "Missing user_id parameter"}), 400
 
         # Fetch instructor's school_id
-        instructor_doc = db.collection("users").document(instructor_id).get()
-        if not instructor_doc.exists:
+        instructor_data = users.get(instructor_id)
+        if instructor_data is None:
             return jsonify({"error": "Instructor not found"}), 404
 
-        instructor_data = instructor_doc.to_dict()
         instructor_school_id = instructor_data.get("school_id")
 
         if not instructor_school_id:
@@ -674,24 +1103,64 @@ def get_student_progress():
 
         # Fetch all students in the same school
         students_query = db.collection("users").where("school_id", "==", instructor_school_id).where("role", "==", "student")
-        students_docs = students_query.stream()
+        students = {doc.id: doc.to_dict() for doc in students_query.stream()}
 
-        student_ids = [doc.id for doc in students_docs]
-
-        if not student_ids:
+        if not students:
             return jsonify({"message": "No students found for this school"}), 200
 
-        # Fetch progress data for all students in this school
-        progress_query = db.collection("progress").where("user_id", "in", student_ids)
-        progress_docs = progress_query.stream()
+        # Optionally embed each student's name and email so the client does not
+        # have to look every student up separately
+        include_users = request.args.get("include_users", "").lower() in ("1", "true", "yes")
+
+        # Fetch progress data for all students in this school, streaming each
+        # chunk back as soon as its read completes
+        def generate():
+            yield "["
+            first = True
+            for progress_docs in iter_progress_chunks(list(students)):
+                for doc in progress_docs:
+                    progress_data = doc.to_dict()
+                    progress_entry = {
+                        "id": doc.id,  # Include document ID
+                        "user_id": progress_data.get("user_id", doc.id),
+                        "items": progress_items(progress_data),
+                    }
+                    if include_users:
+                        progress_entry.update(get_user_summary(doc.id, students.get(doc.id, {})))
+                    yield ("" if first else ",") + app.json.dumps(progress_entry)
+                    first = False
+            yield "]"
+
+        return Response(stream_with_context(generate()), mimetype="application/json"), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API route to get the instructor's school progress from its rollup, a
+# handful of shard reads however many students the school has
+@app.route('/school-progress', methods=['GET'])
+def get_school_progress():
+    try:
+        instructor_id = request.args.get("user_id")  # Instructor's user_id
+
+        if not instructor_id:
+            return jsonify({"error": "Missing user_id parameter"}), 400
+
+        instructor_data = users.get(instructor_id)
+        if instructor_data is None:
+            return jsonify({"error": "Instructor not found"}), 404
+
+        school_id = instructor_data.get("school_id")
+        if not school_id:
+            return jsonify({"error": "Instructor does not have a school_id"}), 400
 
-        progress_data = []
-        for doc in progress_docs:
-            progress_entry = doc.to_dict()
-            progress_entry["id"] = doc.id  # Include document ID
-            progress_data.append(progress_entry)
+        # The rollup is built the first time a school is viewed; after that it
+        # is kept up to date by /mark-progress
+        rollup = progress_store.school_rollup(school_id)
+        if rollup is None:
+            rollup = progress_store.rebuild_school_rollup(school_id)
 
-        return jsonify(progress_data), 200
+        return jsonify(school_progress_payload(school_id, rollup)), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -700,16 +1169,33 @@ def get_student_progress():
 @app.route("/users/<user_id>", methods=["GET"])
 def get_user(user_id):
     try:
-        users_collection = db.collection("users")
-        user_doc = users_collection.document(user_id).get()
-        if not user_doc.exists:
+        user_data = users.get(user_id)
+        if user_data is None:
             return jsonify({"error": "User not found"}), 404
 
-        user_data = user_doc.to_dict()
+        return jsonify(get_user_summary(user_id, user_data)), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API route to get the user data for many ids in one request
+@app.route("/users/batch", methods=["POST", "OPTIONS"])
+def get_users_batch():
+    if request.method == "OPTIONS":
+        return "", 200
+    try:
+        data = request.json or {}
+        user_ids = data.get("user_ids")
+
+        if not isinstance(user_ids, list) or not all(isinstance(user_id, str) for user_id in user_ids):
+            return jsonify({"error": "user_ids must be a list of strings"}), 400
+        if len(user_ids) > MAX_BATCH_USERS:
+            return jsonify({"error": f"At most {MAX_BATCH_USERS} user_ids can be requested at once"}), 400
+
+        profiles = users.get_many(user_ids)
         return jsonify({
-            "user_id": user_id,
-            "name": user_data.get("name", "Unknown"),
-            "email": user_data.get("email", "No email provided"),
+            user_id: get_user_summary(user_id, user_data)
+            for user_id, user_data in profiles.items()
         }), 200
 
     except Exception as e:
@@ -729,62 +1215,159 @@ def clock_in_out():
         if action not in ["in", "out"]:
             return jsonify({"error": "Invalid action"}), 400
 
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = verify_id_token(id_token)
         uid = decoded_token["uid"]
 
-        user_ref = db.collection("users").document(uid)
-        user_doc = user_ref.get()
+        limited = rate_limited("clock", uid)
+        if limited:
+            return limited
 
-        if not user_doc.exists:
+        user_data = users.get(uid)
+        if user_data is None:
             return jsonify({"error": "User not found"}), 404
 
-        user_data = user_doc.to_dict()
-
-        # Update clock status in users collection
-        is_clocked_in = action == "in"
-        user_ref.update({"isClockedIn": is_clocked_in})
+        # Users whose history is still a clockHistory entries array are
+        # converted once before their first session is written. The cached
+        # flag only skips the call; migrate_legacy checks it again itself.
+        if not user_data.get("clockHistoryMigrated"):
+            clock_store.migrate_legacy(uid)
 
-        # Prepare clock data with ISO string timestamp
-        clock_data = {
-            "action": action,
-            "timestamp": datetime.now().isoformat(),
-        }
-
-        # If clocking out, calculate duration from the last clock-in
-        if action == "out":
-            clock_doc_ref = db.collection("clockHistory").document(uid)
-            clock_doc = clock_doc_ref.get()
-            if clock_doc.exists:
-                entries = clock_doc.to_dict().get("entries", [])
-                last_clock_in = next((entry for entry in reversed(entries) if
-                                      entry["action"] == "in" and "clockOutTimestamp" not in entry), None)
-                if last_clock_in:
-                    # Parse the ISO string timestamp from last clock-in
-                    clock_in_time = datetime.fromisoformat(last_clock_in["timestamp"])
-                    # Ensure both datetimes are timezone-naive
-                    clock_in_time = clock_in_time.replace(tzinfo=None)
-                    current_time = datetime.now().replace(tzinfo=None)
-                    # Store clockInTimestamp as ISO string
-                    clock_data["clockInTimestamp"] = last_clock_in["timestamp"]
-                    duration = int((current_time - clock_in_time).total_seconds())
-                    clock_data["duration"] = duration
-
-        # Append to the clockHistory document's entries array
-        clock_doc_ref = db.collection("clockHistory").document(uid)
-        clock_doc_ref.set({
-            "entries": firestore.ArrayUnion([clock_data])
-        }, merge=True)
+        # Open or close the session in a single transaction
+        is_clocked_in, session = clock_store.clock(uid, action)
+        users.invalidate(uid)
 
         return jsonify({
             "message": f"Successfully clocked {action}",
             "user_id": uid,
             "name": user_data.get("name"),
             "timestamp": datetime.now().isoformat(),
-            "isClockedIn": is_clocked_in
+            "isClockedIn": is_clocked_in,
+            "session": session,
+        }), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+# API route to get the signed-in user's clock status and completed sessions
+@app.route("/clock/sessions", methods=["GET"])
+def get_clock_sessions():
+    try:
+        id_token = request.headers.get("Authorization", "").replace("Bearer ", "")
+        if not id_token:
+            return jsonify({"error": "No idToken provided"}), 401
+        decoded_token = verify_id_token(id_token)
+        uid = decoded_token["uid"]
+
+        # The open session is read fresh rather than from the user cache, as
+        # a clock-in or -out served by another worker only invalidates its own
+        user_ref = db.collection("users").document(uid)
+        user_doc = user_ref.get(field_paths=["openClockSession", "clockHistoryMigrated"])
+        if not user_doc.exists:
+            return jsonify({"error": "User not found"}), 404
+        if not user_doc.to_dict().get("clockHistoryMigrated") and clock_store.migrate_legacy(uid):
+            users.invalidate(uid)
+            user_doc = user_ref.get(field_paths=["openClockSession"])
+
+        limit = request.args.get("limit", default=50, type=int)
+        if limit < 1 or limit > MAX_CLOCK_SESSIONS_PAGE:
+            return jsonify({"error": f"limit must be between 1 and {MAX_CLOCK_SESSIONS_PAGE}"}), 400
+
+        sessions, next_cursor = clock_store.sessions(uid, limit=limit, cursor=request.args.get("cursor"))
+        open_session = user_doc.to_dict().get("openClockSession")
+        return jsonify({
+            "isClockedIn": open_session is not None,
+            "clock_in": open_session["clock_in"] if open_session else None,
+            "sessions": sessions,
+            "next_cursor": next_cursor,
         }), 200
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API route for admins to get clocked time totalled per user per day or week
+@app.route("/clock/reports", methods=["GET"])
+def get_clock_reports():
+    try:
+        id_token = request.headers.get("Authorization", "").replace("Bearer ", "")
+        if not id_token:
+            return jsonify({"error": "No idToken provided"}), 401
+        decoded_token = verify_id_token(id_token)
+        admin_uid = decoded_token["uid"]
+
+        # Verify admin role
+        admin_data = get_user_data(admin_uid)
+        if admin_data.get("role") != "admin":
+            return jsonify({"error": "Unauthorized: Admin access required"}), 403
+
+        period = request.args.get("period", "day")
+        if period not in ["day", "week"]:
+            return jsonify({"error": "period must be day or week"}), 400
+        limit = request.args.get("limit", default=50, type=int)
+        if limit < 1 or limit > MAX_CLOCK_SESSIONS_PAGE:
+            return jsonify({"error": f"limit must be between 1 and {MAX_CLOCK_SESSIONS_PAGE}"}), 400
+
+        totals, next_cursor = clock_store.totals(
+            period,
+            since=request.args.get("since"),
+            until=request.args.get("until"),
+            user_id=request.args.get("user_id"),
+            limit=limit,
+            cursor=request.args.get("cursor"),
+        )
+
+        # Only the users on this page are looked up
+        profiles = users.get_many([total["user_id"] for total in totals])
+        for total in totals:
+            total["name"] = profiles.get(total["user_id"], {}).get("name", "Unknown")
+
+        return jsonify({"totals": totals, "next_cursor": next_cursor}), 200
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API route for admins to page through the activity log, newest first
+@app.route("/logs", methods=["GET"])
+def get_logs():
+    try:
+        id_token = request.headers.get("Authorization", "").replace("Bearer ", "")
+        if not id_token:
+            return jsonify({"error": "No idToken provided"}), 401
+        decoded_token = verify_id_token(id_token)
+        admin_uid = decoded_token["uid"]
+
+        # Verify admin role
+        admin_data = get_user_data(admin_uid)
+        if admin_data.get("role") != "admin":
+            return jsonify({"error": "Unauthorized: Admin access required"}), 403
+
+        limit = request.args.get("limit", default=50, type=int)
+        if limit < 1 or limit > MAX_LOGS_PAGE:
+            return jsonify({"error": f"limit must be between 1 and {MAX_LOGS_PAGE}"}), 400
+
+        # A bare YYYY-MM-DD `until` includes the whole of that day
+        until = request.args.get("until")
+        if until and len(until) == 10:
+            until += "T23:59:59.999999"
+
+        events, next_cursor = audit_log.query(
+            limit=limit,
+            cursor=request.args.get("cursor"),
+            user_id=request.args.get("user_id"),
+            action=request.args.get("action"),
+            role=request.args.get("role"),
+            since=request.args.get("since"),
+            until=until,
+        )
+        return jsonify({"logs": events, "next_cursor": next_cursor}), 200
+
+    except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 
 if __name__ == "__main__":
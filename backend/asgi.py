@@ -0,0 +1,213 @@
+import asyncio
+from urllib.parse import parse_qs
+from asgiref.wsgi import WsgiToAsgi
+from app import (
+    app as flask_app,
+    users,
+    progress_store,
+    chunked,
+    list_code,
+    get_user_summary,
+    school_progress_payload,
+    FIRESTORE_CHUNK_SIZE,
+    MAX_BATCH_USERS,
+)
+from firebase_clients import get_async_db, STORAGE_BACKEND
+from progress_store import progress_items, merge_rollup
+import metrics
+import responses
+
+# Optional ASGI entry point for running the backend under uvicorn:
+#
+#   $ pip install -r requirements-async.txt
+#   $ uvicorn asgi:app --port 8080
+#
+# The I/O-heavy read routes below are served natively on the event loop
+# with the async Firestore client, so one worker can overlap many requests
+# that are waiting on Firestore or Storage. Every other route is handed to
+# the Flask app unchanged, running on a thread pool.
+
+
+# Helper function to send a JSON response
+async def send_json(send, payload, status=200):
+    body = flask_app.json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"access-control-allow-origin", b"*")],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+# Helper function to read the whole request body
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+# Helper function to look up an instructor's school, returning
+# (school_id, None) or (None, (error payload, status))
+async def get_instructor_school(instructor_id):
+    if not instructor_id:
+        return None, ({"error": "Missing user_id parameter"}, 400)
+    instructor_data = await users.get_async(instructor_id, get_async_db())
+    if instructor_data is None:
+        return None, ({"error": "Instructor not found"}, 404)
+    if not instructor_data.get("school_id"):
+        return None, ({"error": "Instructor does not have a school_id"}, 400)
+    return instructor_data["school_id"], None
+
+
+async def student_progress(scope, receive, send, args):
+    school_id, error = await get_instructor_school(args.get("user_id"))
+    if error:
+        return await send_json(send, *error)
+
+    async_db = get_async_db()
+    students_query = async_db.collection("users").where("school_id", "==", school_id).where("role", "==", "student")
+    students = {doc.id: doc.to_dict() async for doc in students_query.stream()}
+    if not students:
+        return await send_json(send, {"message": "No students found for this school"})
+
+    include_users = args.get("include_users", "").lower() in ("1", "true", "yes")
+
+    async def fetch(chunk):
+        refs = [async_db.collection("progress").document(user_id) for user_id in chunk]
+        return [doc async for doc in async_db.get_all(refs) if doc.exists]
+
+    # Every chunk is read concurrently and written out as soon as it arrives
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/json"), (b"access-control-allow-origin", b"*")],
+    })
+    await send({"type": "http.response.body", "body": b"[", "more_body": True})
+    first = True
+    for next_chunk in asyncio.as_completed([fetch(chunk) for chunk in chunked(list(students), FIRESTORE_CHUNK_SIZE)]):
+        for doc in await next_chunk:
+            progress_data = doc.to_dict()
+            progress_entry = {
+                "id": doc.id,
+                "user_id": progress_data.get("user_id", doc.id),
+                "items": progress_items(progress_data),
+            }
+            if include_users:
+                progress_entry.update(get_user_summary(doc.id, students.get(doc.id, {})))
+            body = ("" if first else ",") + flask_app.json.dumps(progress_entry)
+            await send({"type": "http.response.body", "body": body.encode("utf-8"), "more_body": True})
+            first = False
+    await send({"type": "http.response.body", "body": b"]"})
+
+
+async def school_progress(scope, receive, send, args):
+    school_id, error = await get_instructor_school(args.get("user_id"))
+    if error:
+        return await send_json(send, *error)
+
+    async_db = get_async_db()
+    index_doc = await async_db.collection("schoolProgress").document(school_id).get()
+    if index_doc.exists and index_doc.to_dict().get("ready"):
+        shard_refs = [
+            async_db.collection("schoolProgress").document(school_id).collection("shards").document(str(shard))
+            for shard in range(index_doc.to_dict()["shards"])
+        ]
+        rollup = merge_rollup(school_id, [doc.to_dict() async for doc in async_db.get_all(shard_refs) if doc.exists])
+    else:
+        # Building a missing rollup is rare and reuses the synchronous code
+        rollup = await asyncio.to_thread(progress_store.rebuild_school_rollup, school_id)
+    await send_json(send, school_progress_payload(school_id, rollup))
+
+
+async def get_code(scope, receive, send, args):
+    # Storage has no async client, so the listing runs on a thread through
+    # the same coalesced path as the Flask route
+    include_content = args.get("content", "true").lower() not in ("0", "false", "no")
+    await send_json(send, await asyncio.to_thread(list_code, include_content))
+
+
+async def users_batch(scope, receive, send, args):
+    try:
+        data = flask_app.json.loads(await read_body(receive) or b"{}")
+    except ValueError:
+        return await send_json(send, {"error": "Invalid JSON body"}, 400)
+    user_ids = data.get("user_ids") if isinstance(data, dict) else None
+
+    if not isinstance(user_ids, list) or not all(isinstance(user_id, str) for user_id in user_ids):
+        return await send_json(send, {"error": "user_ids must be a list of strings"}, 400)
+    if len(user_ids) > MAX_BATCH_USERS:
+        return await send_json(send, {"error": f"At most {MAX_BATCH_USERS} user_ids can be requested at once"}, 400)
+
+    profiles = await users.get_many_async(user_ids, get_async_db())
+    await send_json(send, {
+        user_id: get_user_summary(user_id, user_data)
+        for user_id, user_data in profiles.items()
+    })
+
+
+# Routes served natively on the event loop, by (method, path)
+ASYNC_ROUTES = {
+    ("GET", "/student-progress"): student_progress,
+    ("GET", "/school-progress"): school_progress,
+    ("GET", "/get-code"): get_code,
+    ("POST", "/users/batch"): users_batch,
+}
+
+
+# ASGI application: strips the /backend prefix used on Vercel, serves the
+# async routes and passes everything else to the Flask app
+class BackendASGI:
+    def __init__(self, wsgi_app, routes):
+        self.wsgi = WsgiToAsgi(wsgi_app)
+        self.routes = routes
+        self.url_map = wsgi_app.url_map.bind("")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.wsgi(scope, receive, send)
+
+        path = scope["path"]
+        if path == "/backend":
+            path = "/"
+        elif path.startswith("/backend/"):
+            path = path[len("/backend"):]
+        scope = {**scope, "path": path}
+
+        handler = self.routes.get((scope["method"], path))
+        if handler is None:
+            return await self.wsgi(scope, receive, send)
+
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        args = {key: values[0] for key, values in query.items()}
+
+        rule, _ = self.url_map.match(path, scope["method"], return_rule=True)
+        request, token = metrics.begin_request(rule.rule, scope["method"])
+        started = False
+
+        async def tracked_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                request.status = str(message["status"])
+            await send(message)
+
+        # Compression and ETags are applied as for the Flask routes
+        encoded_send = responses.asgi_send(tracked_send, scope, rule.endpoint)
+
+        try:
+            await handler(scope, receive, encoded_send, args)
+        except Exception as e:
+            # A streamed response that fails part way can only be cut short
+            if started:
+                raise
+            await send_json(tracked_send, {"error": str(e)}, 500)
+        finally:
+            metrics.end_request(request, token)
+
+
+# The async routes read through the async Firestore client, so with the local
+# storage backend everything is served by the Flask app
+app = BackendASGI(flask_app, ASYNC_ROUTES if STORAGE_BACKEND == "firebase" else {})
@@ -0,0 +1,208 @@
+import os
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime
+from firebase_clients import firestore
+
+# Firestore rejects write batches with more than 500 operations
+MAX_BATCH_WRITES = 500
+
+
+# Build a log event in the shape stored in the `logs` collection. Every
+# event has user_id, action, email, role and timestamp so it can be filtered
+# on any of them.
+def make_event(user_id, action, **fields):
+    event = {
+        "user_id": user_id,
+        "action": action,
+        "email": "unknown",
+        "role": "unknown",
+        "timestamp": datetime.now().isoformat(),
+    }
+    event.update(fields)
+    return event
+
+
+# Append-only activity log. Every event is its own small document in the
+# `logs` collection, so writing one never reads or rewrites earlier events.
+# Older per-user documents holding an `entries` array have no top-level
+# timestamp and are therefore skipped by query() until migrate_legacy()
+# splits them into events.
+class AuditLog:
+    def __init__(self, db, collection="logs"):
+        self.db = db
+        self.collection = collection
+
+    def log(self, user_id, action, **fields):
+        event = make_event(user_id, action, **fields)
+        self.db.collection(self.collection).document().set(event)
+        return event
+
+    # Write many prepared events with as few batch commits as possible
+    def log_many(self, events):
+        collection = self.db.collection(self.collection)
+        events = list(events)
+        for start in range(0, len(events), MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for event in events[start:start + MAX_BATCH_WRITES]:
+                batch.set(collection.document(), event)
+            batch.commit()
+
+    # Return (events, next_cursor), newest first. `since` and `until` are ISO
+    # timestamps and `cursor` is the id of the last event of the previous page.
+    def query(self, limit=50, cursor=None, user_id=None, action=None, role=None, since=None, until=None):
+        collection = self.db.collection(self.collection)
+        query = collection
+        if user_id:
+            query = query.where("user_id", "==", user_id)
+        if action:
+            query = query.where("action", "==", action)
+        if role:
+            query = query.where("role", "==", role)
+        if since:
+            query = query.where("timestamp", ">=", since)
+        if until:
+            query = query.where("timestamp", "<=", until)
+        query = query.order_by("timestamp", direction=firestore.Query.DESCENDING)
+
+        if cursor:
+            cursor_doc = collection.document(cursor).get()
+            if not cursor_doc.exists:
+                raise ValueError("Invalid cursor")
+            query = query.start_after(cursor_doc)
+
+        # Read one extra event to learn whether there is a next page
+        docs = list(query.limit(limit + 1).stream())
+        events = [{"id": doc.id, **doc.to_dict()} for doc in docs[:limit]]
+        next_cursor = events[-1]["id"] if len(docs) > limit else None
+        return events, next_cursor
+
+    # Split every legacy per-user document holding an `entries` array into
+    # one event document per entry and delete it. Events get deterministic
+    # ids, so a migration interrupted part way can simply be run again.
+    # Returns the number of events written.
+    def migrate_legacy(self):
+        collection = self.db.collection(self.collection)
+        written = 0
+        for legacy_doc in collection.where("entries", "!=", []).stream():
+            writes = []
+            for index, entry in enumerate(legacy_doc.to_dict().get("entries", [])):
+                event = make_event(legacy_doc.id, entry.get("action", "unknown"))
+                event.update(entry)
+                writes.append((collection.document(f"{legacy_doc.id}-{index}"), event))
+            for start in range(0, len(writes), MAX_BATCH_WRITES):
+                batch = self.db.batch()
+                for ref, event in writes[start:start + MAX_BATCH_WRITES]:
+                    batch.set(ref, event)
+                batch.commit()
+            legacy_doc.reference.delete()
+            written += len(writes)
+        return written
+
+
+# AuditLog that takes writes off the request path. log() only enqueues the
+# event; a worker thread commits queued events in WriteBatches. When the
+# queue is full, log() waits up to `put_timeout` seconds and then writes the
+# event itself, so a stalled worker slows requests down instead of losing
+# events.
+class QueuedAuditLog(AuditLog):
+    def __init__(self, db, collection="logs", max_queue=10000, batch_size=200,
+                 flush_interval=0.5, put_timeout=1.0, max_retries=3):
+        super().__init__(db, collection)
+        self.batch_size = min(batch_size, MAX_BATCH_WRITES)
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._stopping = threading.Event()
+
+    # Start the worker lazily so it is created in the process that uses it,
+    # not in a gunicorn master that later forks
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def log(self, user_id, action, **fields):
+        event = make_event(user_id, action, **fields)
+        if self._stopping.is_set():
+            self._commit([event])
+            return event
+        self._ensure_worker()
+        try:
+            self._queue.put(event, timeout=self.put_timeout)
+        except queue.Full:
+            self._commit([event])
+        return event
+
+    def _next_batch(self):
+        try:
+            events = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(events) < self.batch_size:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def _commit(self, events):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.log_many(events)
+                return
+            except Exception as e:
+                print(f"Audit log flush error (attempt {attempt}): {str(e)}")
+                if attempt < self.max_retries:
+                    time.sleep(0.1 * 2 ** attempt)
+        self.dropped += len(events)
+
+    def _run(self):
+        while not self._stopping.is_set() or not self._queue.empty():
+            events = self._next_batch()
+            if events:
+                self._commit(events)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    # Flush everything still queued and stop the worker. Called on shutdown;
+    # events logged afterwards are written synchronously.
+    def drain(self, timeout=10):
+        self._stopping.set()
+        worker = self._worker
+        if worker is not None and self._worker_pid == os.getpid() and worker.is_alive():
+            worker.join(timeout)
+        while not self._queue.empty():
+            events = self._next_batch()
+            if events:
+                self._commit(events)
+
+
+# Pick the audit log implementation for this process. AUDIT_LOG_MODE can be
+# "sync" or "async"; serverless deployments (Vercel) freeze background
+# threads between requests, so they default to synchronous writes.
+def create_audit_log(db):
+    mode = os.environ.get("AUDIT_LOG_MODE") or ("sync" if os.environ.get("VERCEL") else "async")
+    if mode == "async":
+        audit_log = QueuedAuditLog(
+            db,
+            max_queue=int(os.environ.get("AUDIT_LOG_QUEUE_SIZE", "10000")),
+            batch_size=int(os.environ.get("AUDIT_LOG_BATCH_SIZE", "200")),
+        )
+        atexit.register(audit_log.drain)
+        return audit_log
+    return AuditLog(db)
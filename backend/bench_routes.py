@@ -0,0 +1,315 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from functools import wraps
+from pathlib import Path
+
+# Load-test the hot routes through the Flask test client, with no network.
+# Firestore and Storage are the local backends (memory_store.py and
+# local_storage.py) with a fixed latency added to every call, and Auth is a
+# fake that accepts "bench-<uid>" tokens after its own delay. Each scenario
+# runs at several concurrency levels and reports latency percentiles and
+# requests per second. Results can be saved as a JSON baseline and compared
+# against a later run to catch regressions between commits. The memory store
+# runs transactions one at a time, so transactional routes (mark-progress,
+# clock) do not scale with concurrency here the way they would on Firestore;
+# compare them between runs rather than reading them as production numbers.
+#
+#   $ python bench_routes.py --save baseline.json
+#   $ python bench_routes.py --compare baseline.json --fail-over 20
+#   $ python bench_routes.py --scenarios get-code,clock --concurrency 1,32 --firestore-ms 50
+
+BACKEND_DIR = Path(__file__).resolve().parent
+SCENARIOS = ["login", "check-role", "mark-progress", "student-progress", "get-code", "get-pdfs", "clock"]
+COMPARED_STATS = ["p50_ms", "p95_ms", "p99_ms", "rps"]
+# p99 of a few hundred requests is too noisy to fail a run on
+GATED_STATS = ["p95_ms", "rps"]
+
+# The storage calls that are a round trip on Cloud Storage. LocalBlob.reload
+# runs whenever a blob object is built, which is free on the real client.
+STORAGE_LATENCY_METHODS = {
+    "local_storage:LocalBucket": ["get_blob", "list_blobs"],
+    "local_storage:LocalBlob": [
+        "download_as_text", "download_as_bytes", "upload_from_file", "upload_from_string",
+        "exists", "delete", "patch",
+    ],
+}
+
+
+class FakeAuth:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def verify_id_token(self, id_token):
+        time.sleep(self.latency)
+        self.calls += 1
+        if not id_token.startswith("bench-"):
+            raise ValueError("Invalid token")
+        return {"uid": id_token[len("bench-"):], "exp": time.time() + 3600}
+
+
+_injecting = threading.local()
+
+
+# Helper function to add `latency` seconds to a client method. Calls made
+# inside another delayed call are not delayed again.
+def delayed(method, latency):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        if getattr(_injecting, "active", False):
+            return method(*args, **kwargs)
+        _injecting.active = True
+        try:
+            time.sleep(latency)
+            return method(*args, **kwargs)
+        finally:
+            _injecting.active = False
+    return wrapper
+
+
+def inject_latency(spec, latency):
+    import importlib
+    for target, names in spec.items():
+        module_name, class_name = target.split(":")
+        cls = getattr(importlib.import_module(module_name), class_name)
+        for name in names:
+            setattr(cls, name, delayed(getattr(cls, name), latency))
+
+
+def token(uid):
+    return f"bench-{uid}"
+
+
+# Build the app against the local backends and fill them with one school
+def setup(args):
+    storage_dir = tempfile.mkdtemp(prefix="bench-storage-")
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["LOCAL_STORAGE_DIR"] = storage_dir
+    # Scenarios repeat writes for the same user far faster than a real client
+    os.environ.setdefault("WRITE_RATE_LIMIT", "0")
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    import metrics
+    import firebase_clients
+    fake_auth = FakeAuth(args.auth_ms / 1000)
+    firebase_clients.override("auth", fake_auth)
+
+    import app as backend
+    db, bucket = firebase_clients.get_db(), firebase_clients.get_bucket()
+
+    db.collection("users").document("admin").set({"role": "admin", "name": "Admin", "email": "admin@example.com"})
+    db.collection("users").document("instructor").set({
+        "role": "instructor", "name": "Instructor", "email": "instructor@example.com", "school_id": "school",
+    })
+    for index in range(args.students):
+        uid = f"student{index}"
+        db.collection("users").document(uid).set({
+            "role": "student", "name": f"Student {index}", "email": f"{uid}@example.com",
+            "school_id": "school", "school_name": "Bench School", "clockHistoryMigrated": True,
+        })
+        backend.progress_store.mark(uid, [
+            {
+                "material_id": f"pdf{item}", "type": "pdf", "title": f"PDF {item}",
+                "accessed_at": "2024-01-01T00:00:00", "completed": item % 2 == 0,
+            }
+            for item in range(args.progress_items)
+        ], student=backend.get_rollup_student(uid))
+
+    code = "void setup() {\n  Serial.begin(9600);\n}\n\nvoid loop() {\n}\n" * 40
+    for index in range(args.code_files):
+        bucket.blob(f"code/example{index}.ino").upload_from_string(code)
+    for index in range(args.pdfs):
+        bucket.blob(f"pdfs/guide{index}.pdf").upload_from_string(b"%PDF-1.4\n" + b"0" * 4096)
+
+    inject_latency(metrics.LOCAL_FIRESTORE_METHODS, args.firestore_ms / 1000)
+    inject_latency(STORAGE_LATENCY_METHODS, args.storage_ms / 1000)
+    return backend, storage_dir
+
+
+# One request of each scenario. `worker` and `iteration` pick the student so
+# concurrent workers do not all hit the same document.
+def send(client, scenario, worker, iteration, students):
+    uid = f"student{(worker * 7919 + iteration) % students}"
+    if scenario == "login":
+        return client.post("/login", json={"idToken": token(uid)})
+    if scenario == "check-role":
+        return client.post("/check-role", json={"idToken": token(uid)})
+    if scenario == "mark-progress":
+        return client.post("/mark-progress", json={
+            "user_id": uid, "material_id": f"code{iteration % 10}", "type": "code", "title": "Example",
+            "accessed_at": "2024-01-02T00:00:00", "completed": iteration % 3 == 0,
+        })
+    if scenario == "student-progress":
+        return client.get("/student-progress?user_id=instructor")
+    if scenario == "get-code":
+        return client.get("/get-code")
+    if scenario == "get-pdfs":
+        return client.get("/get-pdfs")
+    if scenario == "clock":
+        # Each worker clocks its own student in and out in turn
+        uid = f"student{worker % students}"
+        return client.post("/clock", json={"idToken": token(uid), "action": "in" if iteration % 2 == 0 else "out"})
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+# Run `requests` requests of one scenario split across `concurrency` threads
+def run_scenario(backend, scenario, concurrency, requests, students):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    per_worker = [requests // concurrency + (1 if worker < requests % concurrency else 0) for worker in range(concurrency)]
+
+    def work(worker):
+        client = backend.app.test_client()
+        local = []
+        for iteration in range(per_worker[worker]):
+            started = time.perf_counter()
+            response = send(client, scenario, worker, iteration, students)
+            response.get_data()
+            response.close()
+            local.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                with lock:
+                    errors.append(response.status_code)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Helper function to print how each result moved against the baseline and
+# return the regressions larger than `fail_over` percent
+def compare(results, baseline, fail_over):
+    regressions = []
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'} (% change; + is slower for latency, faster for rps)")
+    for scenario, levels in results.items():
+        for level, stats in levels.items():
+            before = baseline["results"].get(scenario, {}).get(level)
+            if before is None:
+                continue
+            changes = []
+            for key in COMPARED_STATS:
+                change = (stats[key] - before[key]) * 100 / before[key] if before[key] else 0
+                changes.append(f"{key} {change:+.1f}%")
+                worse = -change if key == "rps" else change
+                if fail_over is not None and key in GATED_STATS and worse > fail_over:
+                    regressions.append(f"{scenario} c={level} {key} {change:+.1f}%")
+            print(f"  {scenario:<17} c={level:<4} " + "  ".join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the backend's hot routes against fake Firebase clients")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario and concurrency level")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests before each scenario")
+    parser.add_argument("--firestore-ms", type=float, default=20)
+    parser.add_argument("--storage-ms", type=float, default=40)
+    parser.add_argument("--auth-ms", type=float, default=5)
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--progress-items", type=int, default=20)
+    parser.add_argument("--code-files", type=int, default=20)
+    parser.add_argument("--pdfs", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against a JSON file written by --save")
+    parser.add_argument("--fail-over", type=float, help="exit with status 1 if p95 or rps is this many percent worse than the baseline")
+    args = parser.parse_args()
+
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]
+    unknown = [scenario for scenario in scenarios if scenario not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    backend, storage_dir = setup(args)
+    try:
+        results = {}
+        for scenario in scenarios:
+            run_scenario(backend, scenario, 1, args.warmup, args.students)
+            results[scenario] = {}
+            for level in levels:
+                results[scenario][str(level)] = run_scenario(backend, scenario, level, args.requests, args.students)
+    finally:
+        drain = getattr(backend.audit_log, "drain", None)
+        if drain is not None:
+            drain()
+        shutil.rmtree(storage_dir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "config": {
+            key: getattr(args, key)
+            for key in ["requests", "warmup", "firestore_ms", "storage_ms", "auth_ms", "students", "progress_items", "code_files", "pdfs"]
+        },
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w") as out:
+            json.dump(report, out, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{args.requests} requests per level, latency in ms "
+              f"(firestore {args.firestore_ms} ms, storage {args.storage_ms} ms, auth {args.auth_ms} ms per call)")
+        print(f"  {'scenario':<17} {'conc':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8} {'errors':>6}")
+        for scenario, by_level in results.items():
+            for level, stats in by_level.items():
+                print(f"  {scenario:<17} {level:>4} {stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8} {stats['rps']:>8} {stats['errors']:>6}")
+
+    if args.compare:
+        with open(args.compare) as source:
+            baseline = json.load(source)
+        if baseline.get("config") != report["config"]:
+            print("\nWarning: the baseline was recorded with different settings")
+        regressions = compare(results, baseline, args.fail_over)
+        if regressions:
+            print("\nRegressions over threshold:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+# Measure cold-start cost the way a fresh serverless instance pays it. Each
+# run is a new Python process that imports the app (through the Vercel
+# entry point with --entry api), serves the first health check, and then
+# builds the Firebase clients. No network calls are made, but credentials
+# must be configured as for the app itself.
+#
+#   $ python bench_startup.py --runs 10
+#   $ python bench_startup.py --entry api --json > startup.json
+
+BACKEND_DIR = Path(__file__).resolve().parent
+ROOT = BACKEND_DIR.parent
+
+
+# Run inside each child process and print the timings as JSON
+def measure(entry):
+    started = time.perf_counter()
+    if entry == "api":
+        sys.path.insert(0, str(ROOT / "api"))
+        from index import app
+    else:
+        sys.path.insert(0, str(BACKEND_DIR))
+        from app import app
+    imported = time.perf_counter()
+
+    path = "/backend/" if entry == "api" else "/"
+    response = app.test_client().get(path)
+    first_request = time.perf_counter()
+    loaded_before_clients = len([name for name in sys.modules if name.startswith(("google.cloud", "grpc"))])
+
+    from firebase_clients import get_db, get_bucket, get_auth
+    get_db()
+    get_bucket()
+    get_auth()
+    clients = time.perf_counter()
+
+    loaded = [name for name in sys.modules if name.startswith(("google.cloud", "grpc"))]
+    print(json.dumps({
+        "import_ms": (imported - started) * 1000,
+        "first_request_ms": (first_request - imported) * 1000,
+        "first_request_status": response.status_code,
+        "client_init_ms": (clients - first_request) * 1000,
+        "google_modules_before_clients": loaded_before_clients,
+        "google_modules_after_clients": len(loaded),
+    }))
+
+
+def summarize(samples, key):
+    values = [sample[key] for sample in samples]
+    return {
+        "median": round(statistics.median(values), 1),
+        "min": round(min(values), 1),
+        "max": round(max(values), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark backend cold-start time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--entry", choices=["app", "api"], default="app")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure(args.entry)
+        return
+
+    samples = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", "--entry", args.entry],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    summary = {
+        "entry": args.entry,
+        "runs": args.runs,
+        "first_request_status": samples[-1]["first_request_status"],
+        "google_modules_before_clients": samples[-1]["google_modules_before_clients"],
+        "import_ms": summarize(samples, "import_ms"),
+        "first_request_ms": summarize(samples, "first_request_ms"),
+        "client_init_ms": summarize(samples, "client_init_ms"),
+    }
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(f"{args.runs} cold starts via {args.entry} (median / min / max ms)")
+    for key in ["import_ms", "first_request_ms", "client_init_ms"]:
+        stats = summary[key]
+        print(f"  {key:<18} {stats['median']:>8} {stats['min']:>8} {stats['max']:>8}")
+    print(f"  Google Cloud modules loaded before first client: {summary['google_modules_before_clients']}")
+
+
+if __name__ == "__main__":
+    main()
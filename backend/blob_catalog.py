@@ -0,0 +1,108 @@
+import time
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+
+# Cached listing of the blobs under one Storage prefix. The listing is reused
+# for `ttl` seconds or until invalidate() is called after a write, and signed
+# URLs are reused until `url_refresh_margin` seconds before they expire.
+class BlobCatalog:
+    def __init__(self, bucket, prefix, predicate=None, ttl=300, url_ttl=3600, url_refresh_margin=600):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.predicate = predicate or (lambda name: True)
+        self.ttl = ttl
+        self.url_ttl = url_ttl
+        self.url_refresh_margin = url_refresh_margin
+        self.listings = 0
+        self._blobs = None
+        self._listed_at = 0
+        self._signed_urls = {}
+        self._lock = threading.Lock()
+
+    # Return the matching blobs, listing the bucket only when the cache is stale
+    def blobs(self):
+        with self._lock:
+            if self._blobs is None or time.monotonic() - self._listed_at >= self.ttl:
+                self._blobs = [
+                    blob for blob in self.bucket.list_blobs(prefix=self.prefix)
+                    if self.predicate(blob.name)
+                ]
+                self._listed_at = time.monotonic()
+                self.listings += 1
+                live = {(blob.name, blob.generation) for blob in self._blobs}
+                self._signed_urls = {key: value for key, value in self._signed_urls.items() if key in live}
+            return list(self._blobs)
+
+    def invalidate(self):
+        with self._lock:
+            self._blobs = None
+
+    def signed_url(self, blob):
+        key = (blob.name, blob.generation)
+        now = time.time()
+        with self._lock:
+            cached = self._signed_urls.get(key)
+            if cached is not None and cached[0] - now > self.url_refresh_margin:
+                return cached[1]
+        url = blob.generate_signed_url(expiration=timedelta(seconds=self.url_ttl), method="GET")
+        with self._lock:
+            self._signed_urls[key] = (now + self.url_ttl, url)
+        return url
+
+
+# Size-bounded LRU of downloaded blob contents keyed by (name, generation),
+# so a re-uploaded blob is never served from a stale entry
+class BlobContentCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, blob):
+        key = (blob.name, blob.generation)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, blob, text):
+        key = (blob.name, blob.generation)
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[0]
+            self._entries[key] = (size, text)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (evicted_size, _) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    # Return {blob name: text}, downloading every cache miss concurrently on executor
+    def fetch_many(self, blobs, executor):
+        contents = {}
+        missing = []
+        for blob in blobs:
+            text = self.get(blob)
+            if text is None:
+                missing.append(blob)
+            else:
+                contents[blob.name] = text
+
+        futures = {executor.submit(blob.download_as_text): blob for blob in missing}
+        for future, blob in futures.items():
+            text = future.result()
+            self.put(blob, text)
+            contents[blob.name] = text
+        return contents
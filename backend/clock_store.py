@@ -0,0 +1,242 @@
+from datetime import date, datetime, timedelta
+from firebase_clients import firestore
+from audit_log import MAX_BATCH_WRITES
+
+
+# Helper function to build a completed session record
+def make_session(user_id, clock_in, clock_out):
+    clock_in_time = datetime.fromisoformat(clock_in).replace(tzinfo=None)
+    clock_out_time = datetime.fromisoformat(clock_out).replace(tzinfo=None)
+    return {
+        "user_id": user_id,
+        "clock_in": clock_in,
+        "clock_out": clock_out,
+        "date": clock_in[:10],
+        "duration": int((clock_out_time - clock_in_time).total_seconds()),
+    }
+
+
+# Helper function to get the Monday of the week a YYYY-MM-DD date falls in
+def week_start(day):
+    day = date.fromisoformat(day)
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+
+# Helper function to get the (period, start) keys a session is totalled
+# under. Sessions count towards the day, and week, they started in.
+def total_periods(day):
+    return [("day", day), ("week", week_start(day))]
+
+
+# Clock-in/out sessions. The open session of a user is kept on their user
+# document as openClockSession, next to isClockedIn, so clocking out never
+# has to search history. Each completed session is its own document in
+# clockSessions. Users who clocked in before sessions were kept have their
+# clockHistory/<uid> entries array converted once, on first use.
+#
+# Clocked time is also totalled per user per day and per week in
+# clockTotals/<period>_<start>_<uid>, incremented by each clock-out, so
+# reports read one document per user and period instead of every session.
+# Totals of migrated legacy sessions are kept apart in legacy_seconds and
+# legacy_sessions, which are set rather than incremented so a repeated
+# migration cannot count them twice.
+class ClockStore:
+    def __init__(self, db, collection="clockSessions", totals_collection="clockTotals"):
+        self.db = db
+        self.collection = collection
+        self.totals_collection = totals_collection
+
+    def total_ref(self, period, start, user_id):
+        return self.db.collection(self.totals_collection).document(f"{period}_{start}_{user_id}")
+
+    # Clock the user in or out in one transaction and return
+    # (is_clocked_in, session). `session` is the open session after clocking
+    # in, the completed one after clocking out, or None when clocking out
+    # with no open session. Clocking in while already clocked in keeps the
+    # session that is already open.
+    def clock(self, user_id, action, now=None):
+        user_ref = self.db.collection("users").document(user_id)
+        session_ref = self.db.collection(self.collection).document()
+        now = now or datetime.now().isoformat()
+
+        @firestore.transactional
+        def apply(transaction):
+            snapshot = user_ref.get(field_paths=["openClockSession"], transaction=transaction)
+            if not snapshot.exists:
+                raise KeyError(user_id)
+            open_session = snapshot.to_dict().get("openClockSession")
+
+            if action == "in":
+                if open_session is None:
+                    open_session = {"clock_in": now}
+                    transaction.update(user_ref, {"isClockedIn": True, "openClockSession": open_session})
+                return True, open_session
+
+            transaction.update(user_ref, {"isClockedIn": False, "openClockSession": firestore.DELETE_FIELD})
+            if open_session is None:
+                return False, None
+            session = make_session(user_id, open_session["clock_in"], now)
+            transaction.set(session_ref, session)
+            for period, start in total_periods(session["date"]):
+                transaction.set(self.total_ref(period, start, user_id), {
+                    "user_id": user_id,
+                    "period": period,
+                    "start": start,
+                    "seconds": firestore.Increment(session["duration"]),
+                    "sessions": firestore.Increment(1),
+                }, merge=True)
+            return False, {"id": session_ref.id, **session}
+
+        return apply(self.db.transaction())
+
+    # Return (sessions, next_cursor) for one user, newest first. `cursor` is
+    # the id of the last session of the previous page.
+    def sessions(self, user_id, limit=50, cursor=None):
+        collection = self.db.collection(self.collection)
+        query = collection.where("user_id", "==", user_id).order_by("clock_in", direction=firestore.Query.DESCENDING)
+        if cursor:
+            cursor_doc = collection.document(cursor).get()
+            if not cursor_doc.exists:
+                raise ValueError("Invalid cursor")
+            query = query.start_after(cursor_doc)
+
+        docs = list(query.limit(limit + 1).stream())
+        sessions = [{"id": doc.id, **doc.to_dict()} for doc in docs[:limit]]
+        next_cursor = sessions[-1]["id"] if len(docs) > limit else None
+        return sessions, next_cursor
+
+    # Convert a user's legacy clockHistory/<uid> entries into session records
+    # and, if their last clock-in was never matched, into an open session.
+    # Migrated sessions get deterministic ids so running this twice is safe,
+    # and the legacy document is left in place. The clockHistoryMigrated flag
+    # is read fresh, never from a cache, and set in the same transaction that
+    # reopens the legacy session, so a late or concurrent migration cannot
+    # reopen a session the user has since clocked out of. Returns whether
+    # this call migrated the user.
+    def migrate_legacy(self, user_id):
+        user_ref = self.db.collection("users").document(user_id)
+        snapshot = user_ref.get(field_paths=["clockHistoryMigrated"])
+        if not snapshot.exists or snapshot.to_dict().get("clockHistoryMigrated"):
+            return False
+
+        history_doc = self.db.collection("clockHistory").document(user_id).get()
+        entries = history_doc.to_dict().get("entries", []) if history_doc.exists else []
+
+        sessions = {}
+        open_clock_in = None
+        for index, entry in enumerate(entries):
+            if entry.get("action") == "in":
+                open_clock_in = entry["timestamp"]
+            elif entry.get("action") == "out":
+                clock_in = entry.get("clockInTimestamp") or open_clock_in
+                open_clock_in = None
+                if clock_in:
+                    sessions[f"{user_id}-legacy-{index}"] = make_session(user_id, clock_in, entry["timestamp"])
+
+        legacy_totals = {}
+        for session in sessions.values():
+            for key in total_periods(session["date"]):
+                totals = legacy_totals.setdefault(key, {"legacy_seconds": 0, "legacy_sessions": 0})
+                totals["legacy_seconds"] += session["duration"]
+                totals["legacy_sessions"] += 1
+
+        collection = self.db.collection(self.collection)
+        writes = [(collection.document(session_id), session, False) for session_id, session in sessions.items()]
+        writes += [
+            (self.total_ref(period, start, user_id), {"user_id": user_id, "period": period, "start": start, **totals}, True)
+            for (period, start), totals in legacy_totals.items()
+        ]
+        for offset in range(0, len(writes), MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for ref, data, merge in writes[offset:offset + MAX_BATCH_WRITES]:
+                batch.set(ref, data, merge=merge)
+            batch.commit()
+
+        # The user is only flagged once every session has been written. An
+        # open session already on the user, or a session that has already
+        # closed the legacy clock-in, is never replaced.
+        @firestore.transactional
+        def flag(transaction):
+            snapshot = user_ref.get(field_paths=["clockHistoryMigrated", "openClockSession"], transaction=transaction)
+            if not snapshot.exists:
+                raise KeyError(user_id)
+            user_data = snapshot.to_dict()
+            if user_data.get("clockHistoryMigrated"):
+                return False
+
+            user_changes = {"clockHistoryMigrated": True}
+            if open_clock_in is not None and user_data.get("openClockSession") is None:
+                closed = collection.where("user_id", "==", user_id).where("clock_in", "==", open_clock_in).limit(1)
+                if not list(closed.stream(transaction=transaction)):
+                    user_changes["openClockSession"] = {"clock_in": open_clock_in}
+                    user_changes["isClockedIn"] = True
+            transaction.update(user_ref, user_changes)
+            return True
+
+        return flag(self.db.transaction())
+
+    # Return (totals, next_cursor) for one period ("day" or "week"), newest
+    # first. `since` and `until` are YYYY-MM-DD bounds on the period start and
+    # `cursor` is the id of the last total of the previous page.
+    def totals(self, period="day", since=None, until=None, user_id=None, limit=50, cursor=None):
+        collection = self.db.collection(self.totals_collection)
+        query = collection.where("period", "==", period)
+        if user_id:
+            query = query.where("user_id", "==", user_id)
+        if since:
+            query = query.where("start", ">=", since)
+        if until:
+            query = query.where("start", "<=", until)
+        query = query.order_by("start", direction=firestore.Query.DESCENDING)
+
+        if cursor:
+            cursor_doc = collection.document(cursor).get()
+            if not cursor_doc.exists:
+                raise ValueError("Invalid cursor")
+            query = query.start_after(cursor_doc)
+
+        docs = list(query.limit(limit + 1).stream())
+        totals = []
+        for doc in docs[:limit]:
+            data = doc.to_dict()
+            totals.append({
+                "id": doc.id,
+                "user_id": data["user_id"],
+                "period": data["period"],
+                "start": data["start"],
+                "seconds": data.get("seconds", 0) + data.get("legacy_seconds", 0),
+                "sessions": data.get("sessions", 0) + data.get("legacy_sessions", 0),
+            })
+        next_cursor = totals[-1]["id"] if len(docs) > limit else None
+        return totals, next_cursor
+
+    # Recompute every total from the session records, replacing what is
+    # stored. Used to backfill and to repair drift.
+    def rebuild_totals(self):
+        totals = {}
+        for session_doc in self.db.collection(self.collection).stream():
+            session = session_doc.to_dict()
+            for period, start in total_periods(session["date"]):
+                total = totals.setdefault((period, start, session["user_id"]), {
+                    "user_id": session["user_id"],
+                    "period": period,
+                    "start": start,
+                    "seconds": 0,
+                    "sessions": 0,
+                })
+                total["seconds"] += session["duration"]
+                total["sessions"] += 1
+
+        stale = [doc.reference for doc in self.db.collection(self.totals_collection).stream()
+                 if tuple(doc.id.split("_", 2)) not in totals]
+        writes = [(self.total_ref(*key), total) for key, total in totals.items()]
+        writes += [(ref, None) for ref in stale]
+        for offset in range(0, len(writes), MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for ref, total in writes[offset:offset + MAX_BATCH_WRITES]:
+                if total is None:
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, total)
+            batch.commit()
+        return len(totals)
@@ -0,0 +1,659 @@
+import os
+import sys
+import json
+import time
+import atexit
+import ctypes
+import shutil
+import signal
+import hashlib
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Minimal Arduino core for running sketches on the server. Serial writes to
+# stdout, with println() ending lines in "\n" rather than "\r\n" so output
+# compares cleanly with the problems' expected output, pins read LOW, and delay() advances a virtual clock instead of
+# sleeping, so millis() and random() are deterministic and a sketch always
+# prints the same output. That is what makes results safe to cache.
+ARDUINO_HEADER = r"""
+#pragma once
+#include <cstdio>
+#include <cstdlib>
+#include <cstdint>
+#include <cstring>
+#include <cmath>
+#include <string>
+#include <algorithm>
+
+typedef bool boolean;
+typedef uint8_t byte;
+
+#define HIGH 1
+#define LOW 0
+#define INPUT 0
+#define OUTPUT 1
+#define INPUT_PULLUP 2
+#define LED_BUILTIN 13
+#define A0 14
+#define A1 15
+#define A2 16
+#define A3 17
+#define A4 18
+#define A5 19
+#define BIN 2
+#define OCT 8
+#define DEC 10
+#define HEX 16
+#define PI 3.1415926535897932384626433832795
+
+inline unsigned long __virtual_micros = 0;
+
+inline unsigned long millis() { return __virtual_micros / 1000; }
+inline unsigned long micros() { return __virtual_micros; }
+inline void delay(unsigned long ms) { __virtual_micros += ms * 1000; }
+inline void delayMicroseconds(unsigned int us) { __virtual_micros += us; }
+inline void pinMode(int, int) {}
+inline void digitalWrite(int, int) {}
+inline int digitalRead(int) { return LOW; }
+inline int analogRead(int) { return 0; }
+inline void analogWrite(int, int) {}
+inline void randomSeed(unsigned long seed) { srand(seed); }
+inline long random(long max) { return max > 0 ? rand() % max : 0; }
+inline long random(long min, long max) { return max > min ? min + rand() % (max - min) : min; }
+inline long map(long x, long in_min, long in_max, long out_min, long out_max) {
+  return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min;
+}
+template <typename T> inline T constrain(T x, T low, T high) { return x < low ? low : (x > high ? high : x); }
+template <typename T> inline T sq(T x) { return x * x; }
+using std::min;
+using std::max;
+using std::abs;
+
+inline std::string __number_to_string(unsigned long n, int base) {
+  if (base < 2) base = 10;
+  if (n == 0) return "0";
+  std::string digits;
+  while (n > 0) {
+    int digit = n % base;
+    digits.insert(digits.begin(), (char)(digit < 10 ? '0' + digit : 'A' + digit - 10));
+    n /= base;
+  }
+  return digits;
+}
+
+inline std::string __float_to_string(double value, int decimals) {
+  char buffer[64];
+  snprintf(buffer, sizeof(buffer), "%.*f", decimals, value);
+  return buffer;
+}
+
+class String : public std::string {
+ public:
+  String() {}
+  String(const char *s) : std::string(s ? s : "") {}
+  String(const std::string &s) : std::string(s) {}
+  String(char c) : std::string(1, c) {}
+  String(int n, int base = DEC) : std::string(base == DEC ? std::to_string(n) : __number_to_string((unsigned int)n, base)) {}
+  String(unsigned int n, int base = DEC) : std::string(__number_to_string(n, base)) {}
+  String(long n, int base = DEC) : std::string(base == DEC ? std::to_string(n) : __number_to_string((unsigned long)n, base)) {}
+  String(unsigned long n, int base = DEC) : std::string(__number_to_string(n, base)) {}
+  String(double n, int decimals = 2) : std::string(__float_to_string(n, decimals)) {}
+  unsigned int length() const { return size(); }
+  char charAt(unsigned int i) const { return i < size() ? (*this)[i] : 0; }
+  int indexOf(const String &s) const { size_t i = find(s); return i == npos ? -1 : (int)i; }
+  String substring(unsigned int from) const { return from < size() ? String(substr(from)) : String(); }
+  String substring(unsigned int from, unsigned int to) const { return from < size() ? String(substr(from, to - from)) : String(); }
+  long toInt() const { return atol(c_str()); }
+  double toFloat() const { return atof(c_str()); }
+  void toUpperCase() { for (auto &c : *this) c = toupper(c); }
+  void toLowerCase() { for (auto &c : *this) c = tolower(c); }
+  void trim() { erase(0, find_first_not_of(" \t\r\n")); erase(find_last_not_of(" \t\r\n") + 1); }
+  bool equals(const String &s) const { return *this == s; }
+  String &operator+=(const String &s) { append(s); return *this; }
+  String &operator+=(const char *s) { append(s); return *this; }
+  String &operator+=(char c) { push_back(c); return *this; }
+  template <typename T> String &operator+=(T n) { append(String(n)); return *this; }
+};
+
+inline String operator+(const String &a, const String &b) { String s(a); s.append(b); return s; }
+inline String operator+(const String &a, const char *b) { String s(a); s.append(b); return s; }
+inline String operator+(const char *a, const String &b) { String s(a); s.append(b); return s; }
+template <typename T> inline String operator+(const String &a, T b) { return a + String(b); }
+
+class SerialPort {
+ public:
+  void begin(long) {}
+  void end() {}
+  operator bool() const { return true; }
+  int available() { return 0; }
+  int read() { return -1; }
+  int peek() { return -1; }
+  void flush() { fflush(stdout); }
+  size_t write(uint8_t c) { putchar(c); return 1; }
+  size_t print(const char *s) { return fputs(s, stdout) >= 0 ? strlen(s) : 0; }
+  size_t print(const std::string &s) { return print(s.c_str()); }
+  size_t print(char c) { return write(c); }
+  size_t print(bool b) { return print(b ? "1" : "0"); }
+  size_t print(int n, int base = DEC) { return print(String(n, base)); }
+  size_t print(unsigned int n, int base = DEC) { return print(String(n, base)); }
+  size_t print(long n, int base = DEC) { return print(String(n, base)); }
+  size_t print(unsigned long n, int base = DEC) { return print(String(n, base)); }
+  size_t print(unsigned char n, int base = DEC) { return print(String((unsigned int)n, base)); }
+  size_t print(double n, int decimals = 2) { return print(String(n, decimals)); }
+  size_t println() { return print("\n"); }
+  template <typename T> size_t println(T value) { size_t n = print(value); return n + println(); }
+  template <typename T> size_t println(T value, int format) { size_t n = print(value, format); return n + println(); }
+};
+
+inline SerialPort Serial;
+
+void setup();
+void loop();
+"""
+
+ARDUINO_MAIN = r"""
+#include "Arduino.h"
+
+int main() {
+  setup();
+  for (long i = 0; i < LOOP_ITERATIONS; i++) {
+    loop();
+  }
+  fflush(stdout);
+  return 0;
+}
+"""
+
+CLONE_NEWNS = 0x00020000
+CLONE_NEWUTS = 0x04000000
+CLONE_NEWIPC = 0x08000000
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWPID = 0x20000000
+CLONE_NEWNET = 0x40000000
+
+MS_RDONLY = 0x1
+MS_NOSUID = 0x2
+MS_NODEV = 0x4
+MS_NOEXEC = 0x8
+MS_REMOUNT = 0x20
+MS_NOATIME = 0x400
+MS_NODIRATIME = 0x800
+MS_BIND = 0x1000
+MS_REC = 0x4000
+MS_PRIVATE = 0x40000
+MS_RELATIME = 0x200000
+
+# Everything a submission can see. The toolchain is mounted read-only from
+# these host paths (symlinks, as on merged-/usr systems, are recreated), the
+# job directory at /job, the prebuilt Arduino core read-only at /core and a
+# small tmpfs at /tmp for the compiler. There is no /etc, /proc, /home or
+# backend directory, so neither the service account key nor any process's
+# environment is reachable.
+SANDBOX_PATHS = [
+    "/bin", "/lib", "/lib32", "/lib64", "/libx32",
+    "/usr/bin", "/usr/include", "/usr/lib", "/usr/lib32", "/usr/lib64", "/usr/libexec", "/usr/libx32",
+]
+SANDBOX_DEVICES = ["/dev/null", "/dev/zero", "/dev/random", "/dev/urandom"]
+SANDBOX_TMP_SIZE = "64m"
+
+# Submissions run as nobody. When the server is not root it cannot switch
+# users, so its own uid is mapped to nobody in a new user namespace instead.
+SANDBOX_UID = 65534
+
+# State of the current worker process, set up by init_worker
+_worker = {}
+
+
+# Helper function to normalize submitted code so that edits which do not
+# change the program (line endings, trailing spaces, trailing blank lines)
+# hit the same cache entry. Line numbers are kept so compiler errors still
+# point at the right line.
+def normalize_code(code):
+    lines = [line.rstrip() for line in code.replace("\r\n", "\n").replace("\r", "\n").split("\n")]
+    return "\n".join(lines).rstrip("\n") + "\n"
+
+
+# Helper function to trim program output the way the IDE compares it
+def normalize_output(output):
+    return output.rstrip()
+
+
+# Apply the limits of a job, given as {"cpu_seconds", "memory_bytes",
+# "file_bytes", "no_processes"}, to the current process
+def set_limits(limits):
+    import resource
+    resource.setrlimit(resource.RLIMIT_CPU, (limits["cpu_seconds"], limits["cpu_seconds"]))
+    resource.setrlimit(resource.RLIMIT_AS, (limits["memory_bytes"], limits["memory_bytes"]))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (limits["file_bytes"], limits["file_bytes"]))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    if limits["no_processes"]:
+        resource.setrlimit(resource.RLIMIT_NPROC, (0, 0))
+
+
+def check_libc(result, action):
+    if result != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"{action}: {os.strerror(errno)}")
+
+
+# Helper function to bind-mount a host path into the sandbox, read-only unless
+# `writable`. A read-only remount must keep the flags the host mount already
+# has, or a user namespace refuses it.
+def bind_mount(libc, source, target, writable):
+    check_libc(libc.mount(source.encode(), target.encode(), None, MS_BIND | MS_REC, None), f"mount {source}")
+    if writable:
+        return
+    host_flags = os.statvfs(source).f_flag
+    flags = MS_REMOUNT | MS_BIND | MS_RDONLY | MS_NOSUID | MS_NODEV
+    for host_flag, mount_flag in [(os.ST_NOEXEC, MS_NOEXEC), (os.ST_NOATIME, MS_NOATIME),
+                                  (os.ST_NODIRATIME, MS_NODIRATIME), (os.ST_RELATIME, MS_RELATIME)]:
+        if host_flag & host_flags:
+            flags |= mount_flag
+    check_libc(libc.mount(None, target.encode(), None, flags, None), f"remount {source}")
+
+
+# Build the empty directory tree that the sandbox's mounts go on
+def prepare_sandbox_root(root):
+    os.makedirs(root)
+    for path in SANDBOX_PATHS:
+        if os.path.islink(path):
+            os.makedirs(os.path.dirname(root + path), exist_ok=True)
+            os.symlink(os.readlink(path), root + path)
+        elif os.path.isdir(path):
+            os.makedirs(root + path, exist_ok=True)
+    os.makedirs(root + "/dev")
+    for device in SANDBOX_DEVICES:
+        open(root + device, "w").close()
+    for directory in ["/tmp", "/job", "/core"]:
+        os.makedirs(root + directory)
+
+
+# Command line that runs `argv` inside the sandbox through this file's
+# launcher (see run_sandboxed), with `limits` applied to it
+def sandbox_command(argv, limits, env):
+    config = {
+        "root": _worker["sandbox_root"],
+        "mounts": [
+            *[[path, path, False] for path in SANDBOX_PATHS if os.path.isdir(path) and not os.path.islink(path)],
+            *[[device, device, True] for device in SANDBOX_DEVICES],
+            [_worker["core_dir"], "/core", False],
+            [_worker["job_dir"], "/job", True],
+        ],
+        "limits": limits,
+        "env": env,
+    }
+    return [sys.executable, "-I", os.path.abspath(__file__), "--sandbox", json.dumps(config), *argv]
+
+
+# Sandbox launcher, run as its own process for each compile and each run:
+#
+# 1. Enter new mount, PID, network, IPC and UTS namespaces (and a user
+#    namespace when not root) and mount the sandbox's view of the files.
+# 2. Fork the namespace's init process, which forks the job itself. The job
+#    is not init because init ignores signals such as SIGXFSZ.
+# 3. The job chroots into the sandbox, becomes nobody, which drops every
+#    capability so the chroot cannot be escaped, applies its limits and
+#    execs the command.
+# 4. The launcher reports the job's exit code, or dies by the same signal.
+#
+# Each launcher is started in a new session, so the runner can kill the
+# launcher and the job together with killpg.
+def run_sandboxed(config, argv):
+    import resource
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    libc = ctypes.CDLL(None, use_errno=True)
+    uid, gid = os.getuid(), os.getgid()
+    root = config["root"]
+
+    flags = CLONE_NEWNS | CLONE_NEWPID | CLONE_NEWNET | CLONE_NEWIPC | CLONE_NEWUTS
+    if uid != 0:
+        flags |= CLONE_NEWUSER
+    check_libc(libc.unshare(flags), "unshare")
+    if uid != 0:
+        for name, content in [("setgroups", "deny"), ("uid_map", f"{SANDBOX_UID} {uid} 1"), ("gid_map", f"{SANDBOX_UID} {gid} 1")]:
+            with open(f"/proc/self/{name}", "w") as out:
+                out.write(content)
+
+    check_libc(libc.mount(b"none", b"/", None, MS_REC | MS_PRIVATE, None), "make mounts private")
+    for source, target, writable in config["mounts"]:
+        bind_mount(libc, source, root + target, writable)
+    check_libc(libc.mount(b"tmpfs", (root + "/tmp").encode(), b"tmpfs", MS_NOSUID | MS_NODEV,
+                          f"size={SANDBOX_TMP_SIZE},mode=1777".encode()), "mount /tmp")
+
+    status_read, status_write = os.pipe()
+    init = os.fork()
+    if init == 0:
+        os.close(status_read)
+        job = os.fork()
+        if job == 0:
+            try:
+                os.chroot(root)
+                os.chdir("/job")
+                if uid == 0:
+                    os.setgroups([])
+                    os.setgid(SANDBOX_UID)
+                    os.setuid(SANDBOX_UID)
+                set_limits(config["limits"])
+                # Python ignores these, and ignored signals survive exec
+                for signum in [signal.SIGPIPE, signal.SIGXFSZ]:
+                    signal.signal(signum, signal.SIG_DFL)
+                os.execvpe(argv[0], argv, config["env"])
+            except BaseException as e:
+                os.write(2, f"Could not start {argv[0]}: {e}\n".encode())
+            os._exit(127)
+        _, status = os.waitpid(job, 0)
+        os.write(status_write, str(status).encode())
+        os._exit(0)
+
+    os.close(status_write)
+    os.waitpid(init, 0)
+    reported = os.read(status_read, 32)
+    if not reported:
+        os._exit(127)
+    status = int(reported)
+    if os.WIFSIGNALED(status):
+        signal.signal(os.WTERMSIG(status), signal.SIG_DFL)
+        os.kill(os.getpid(), os.WTERMSIG(status))
+    os._exit(os.waitstatus_to_exitcode(status) if os.WIFEXITED(status) else 127)
+
+
+# Helper function to start `argv` for a job, in the sandbox unless the
+# runner is allowed to run unsandboxed, in a session of its own
+def start_job(argv, limits, env, cwd, **kwargs):
+    if _worker["sandboxed"]:
+        return subprocess.Popen(sandbox_command(argv, limits, env), cwd=cwd, env={}, start_new_session=True, **kwargs)
+    return subprocess.Popen(argv, cwd=cwd, env=env, preexec_fn=lambda: set_limits(limits), start_new_session=True, **kwargs)
+
+
+# Helper function to kill a job's launcher and everything it started
+def kill_job(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+# Runs once in each worker process when the pool starts: write the Arduino
+# core into the worker's own directory and compile the entry point, so each
+# submission only compiles and links the sketch itself
+def init_worker(settings):
+    # The worker inherits the server's environment, service account included;
+    # nothing it runs needs any of it
+    path = os.environ.get("PATH", "/usr/bin:/bin")
+    os.environ.clear()
+    os.environ["PATH"] = path
+
+    work_dir = tempfile.mkdtemp(prefix="code-runner-")
+    atexit.register(shutil.rmtree, work_dir, True)
+    core_dir = os.path.join(work_dir, "core")
+    os.mkdir(core_dir)
+    os.chmod(core_dir, 0o755)
+    with open(os.path.join(core_dir, "Arduino.h"), "w") as out:
+        out.write(ARDUINO_HEADER)
+    with open(os.path.join(core_dir, "main.cpp"), "w") as out:
+        out.write(ARDUINO_MAIN)
+    job_dir = os.path.join(work_dir, "job")
+    os.mkdir(job_dir)
+    sandbox_root = os.path.join(work_dir, "root")
+    prepare_sandbox_root(sandbox_root)
+    _worker.update(settings=settings, core_dir=core_dir, job_dir=job_dir, sandbox_root=sandbox_root, sandboxed=True, ready_error=None)
+
+    try:
+        check = start_job(["true"], job_limits(settings, settings["compile_timeout"], False), {"PATH": "/usr/bin:/bin"}, job_dir,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        sandboxed = check.wait(timeout=settings["compile_timeout"]) == 0
+    except (OSError, subprocess.SubprocessError):
+        sandboxed = False
+    _worker["sandboxed"] = sandboxed
+
+    compiled = subprocess.run(
+        [settings["compiler"], "-std=c++17", "-O1", f"-DLOOP_ITERATIONS={settings['loop_iterations']}",
+         "-c", "main.cpp", "-o", "main.o"],
+        cwd=core_dir, capture_output=True, text=True, timeout=settings["compile_timeout"],
+    )
+    if compiled.returncode != 0:
+        _worker["ready_error"] = f"Could not build the Arduino core: {compiled.stderr.strip()}"
+
+
+def warm_worker():
+    return os.getpid()
+
+
+def job_limits(settings, cpu_seconds, running):
+    return {
+        "cpu_seconds": cpu_seconds,
+        "memory_bytes": settings["memory_bytes"] if running else 1024 * 1024 * 1024,
+        "file_bytes": settings["max_output_bytes"] if running else 64 * 1024 * 1024,
+        "no_processes": running,
+    }
+
+
+# Helper function to build the result returned for every submission
+def make_result(output="", error=None, exit_code=None, timed_out=False, duration_ms=0):
+    return {
+        "output": output,
+        "error": error,
+        "exit_code": exit_code,
+        "timed_out": timed_out,
+        "duration_ms": duration_ms,
+    }
+
+
+# Compile and run one sketch inside a worker process. Both steps run in the
+# sandbox, as the compiler reads whatever files the code names and the
+# program can do anything the sandbox allows.
+def run_job(code):
+    settings = _worker["settings"]
+    if _worker["ready_error"]:
+        return make_result(error=_worker["ready_error"])
+    if not _worker["sandboxed"] and not settings["allow_unsandboxed"]:
+        return make_result(error="Code execution is unavailable: the server cannot sandbox submissions")
+
+    job_dir = _worker["job_dir"]
+    shutil.rmtree(job_dir, ignore_errors=True)
+    os.mkdir(job_dir)
+    if _worker["sandboxed"] and os.getuid() == 0:
+        os.chown(job_dir, SANDBOX_UID, SANDBOX_UID)
+    with open(os.path.join(job_dir, "sketch.cpp"), "w") as out:
+        out.write('#include "Arduino.h"\n#line 1 "sketch.ino"\n' + code)
+
+    core_dir = "/core" if _worker["sandboxed"] else _worker["core_dir"]
+    env = {"PATH": "/usr/bin:/bin" if _worker["sandboxed"] else os.environ["PATH"]}
+    compiler = start_job(
+        [settings["compiler"], "-std=c++17", "-O1", "-I", core_dir, "sketch.cpp", os.path.join(core_dir, "main.o"), "-o", "sketch"],
+        job_limits(settings, settings["compile_timeout"], False), env, job_dir,
+        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+    )
+    try:
+        compile_output, _ = compiler.communicate(timeout=settings["compile_timeout"])
+    except subprocess.TimeoutExpired:
+        kill_job(compiler)
+        compiler.communicate()
+        return make_result(error="Compilation timed out")
+    if compiler.returncode != 0:
+        for prefix in [job_dir + "/", _worker["core_dir"] + "/", "/job/", "/core/"]:
+            compile_output = compile_output.replace(prefix, "")
+        return make_result(error=compile_output.strip(), exit_code=compiler.returncode)
+
+    output_path = os.path.join(job_dir, "output.txt")
+    started = time.perf_counter()
+    timed_out = False
+    with open(output_path, "wb") as output_file:
+        process = start_job(
+            ["./sketch"], job_limits(settings, settings["run_timeout"] + 1, True), {}, job_dir,
+            stdin=subprocess.DEVNULL, stdout=output_file, stderr=subprocess.STDOUT,
+        )
+        try:
+            exit_code = process.wait(timeout=settings["run_timeout"])
+        except subprocess.TimeoutExpired:
+            exit_code = None
+            timed_out = True
+        # Kill anything the sketch left running, in its own process group
+        kill_job(process)
+        if exit_code is None:
+            exit_code = process.wait()
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    with open(output_path, "rb") as output_file:
+        output = output_file.read(settings["max_output_bytes"]).decode("utf-8", errors="replace")
+    error = None
+    if timed_out:
+        error = f"Time limit exceeded ({settings['run_timeout']} s)"
+    elif exit_code == -signal.SIGXFSZ:
+        error = f"Output limit exceeded ({settings['max_output_bytes'] // 1024} KB)"
+    elif exit_code < 0:
+        error = f"Program was stopped by {signal.Signals(-exit_code).name}"
+    elif exit_code != 0:
+        error = f"Program exited with code {exit_code}"
+    return make_result(output, error, exit_code, timed_out, duration_ms)
+
+
+# Size-bounded LRU of run results keyed by a hash of the normalized code
+class ResultCache:
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(result)
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = dict(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+# Runs Arduino sketches on a pool of worker processes. Each run is compiled
+# with g++ against the core above and executed in the sandbox, as nobody and
+# with CPU, memory and output limits, no child processes and no network. Results are cached by a hash
+# of the normalized code, and identical submissions that arrive while one is
+# already running share its result instead of compiling it again. The pool
+# is started by start(), normally right after the server forks its workers
+# (see gunicorn.conf.py), or on first use.
+class CodeRunner:
+    def __init__(self, workers=4, cache_size=1024, run_timeout=2, compile_timeout=20, memory_mb=256,
+                 max_output_kb=64, loop_iterations=1, compiler="g++", allow_unsandboxed=False):
+        self.workers = workers
+        self.settings = {
+            "compiler": compiler,
+            "run_timeout": run_timeout,
+            "compile_timeout": compile_timeout,
+            "memory_bytes": memory_mb * 1024 * 1024,
+            "max_output_bytes": max_output_kb * 1024,
+            "loop_iterations": loop_iterations,
+            "allow_unsandboxed": allow_unsandboxed,
+        }
+        self.cache = ResultCache(cache_size)
+        self._executor = None
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def key(self, code):
+        settings = ",".join(f"{name}={value}" for name, value in sorted(self.settings.items()))
+        return hashlib.sha256(f"{settings}\0{normalize_code(code)}".encode("utf-8")).hexdigest()
+
+    # Start the worker processes and have each build its Arduino core now
+    # rather than on the first submission
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=init_worker,
+                    initargs=(self.settings,),
+                )
+                for _ in range(self.workers):
+                    self._executor.submit(warm_worker)
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    # Return the result for `code`, with `cached` telling whether it was
+    # served without running the code again
+    def run(self, code):
+        key = self.key(code)
+        result = self.cache.get(key)
+        if result is not None:
+            return {**result, "cached": True}
+
+        # The first submission of some code claims it in the same critical
+        # section as the check, so identical submissions never both run it
+        with self._lock:
+            shared = self._in_flight.get(key)
+            owner = shared is None
+            if owner:
+                shared = self._in_flight[key] = Future()
+        if not owner:
+            return {**shared.result(), "cached": True}
+
+        try:
+            job = self.start().submit(run_job, normalize_code(code))
+            result = job.result(timeout=self.settings["compile_timeout"] + self.settings["run_timeout"] + 30)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next submission
+            self.shutdown()
+            error = RuntimeError("Code runner restarted, please try again")
+            shared.set_exception(error)
+            raise error
+        except BaseException as e:
+            shared.set_exception(e)
+            raise
+        else:
+            shared.set_result(result)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+        # Only runs that compiled, or failed to compile, are cached: timeouts
+        # can be caused by load and sandbox errors by the host
+        if result["exit_code"] is not None and not result["timed_out"]:
+            self.cache.put(key, result)
+        return {**result, "cached": False}
+
+
+# Cached copy of the coding problems, which the IDE keeps as a `problems`
+# array on codingProblems/arduino, for grading submissions
+class ProblemCatalog:
+    def __init__(self, db, collection="codingProblems", document="arduino", ttl=60):
+        self.db = db
+        self.collection = collection
+        self.document = document
+        self.ttl = ttl
+        self._problems = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def get(self, problem_id):
+        with self._lock:
+            if self._problems is None or time.monotonic() - self._loaded_at >= self.ttl:
+                problems_doc = self.db.collection(self.collection).document(self.document).get()
+                problems = problems_doc.to_dict().get("problems", []) if problems_doc.exists else []
+                self._problems = {problem.get("id"): problem for problem in problems}
+                self._loaded_at = time.monotonic()
+            return self._problems.get(problem_id)
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ["--sandbox"]:
+    run_sandboxed(json.loads(sys.argv[2]), sys.argv[3:])
@@ -0,0 +1,140 @@
+import os
+import json
+import importlib
+import threading
+import metrics
+
+STORAGE_BUCKET = os.environ.get("FIREBASE_STORAGE_BUCKET", "cansat-education-tool.firebasestorage.app")
+
+# "firebase" talks to the live project. "local" keeps Firestore data in
+# process (memory_store.py, optionally seeded from MEMORY_STORE_SEED) and
+# blobs under LOCAL_STORAGE_DIR (local_storage.py), for load tests and
+# offline runs. Auth is always Firebase.
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "firebase")
+if STORAGE_BACKEND not in ("firebase", "local"):
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+_clients = {}
+_lock = threading.RLock()
+
+
+# Helper function to build a client once, on first use. The lock is
+# re-entrant because building the Firestore and Storage clients first
+# initializes the Firebase app.
+def _get(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def _initialize_app():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    if firebase_admin._apps:
+        return firebase_admin.get_app()
+    service_account_json = os.environ.get("FIREBASE_SERVICE_ACCOUNT_JSON")
+    service_account_path = os.environ.get("FIREBASE_SERVICE_ACCOUNT_PATH", "key.json")
+    cred = credentials.Certificate(json.loads(service_account_json)) if service_account_json else credentials.Certificate(service_account_path)
+    return firebase_admin.initialize_app(cred, {"storageBucket": STORAGE_BUCKET})
+
+
+def get_app():
+    return _get("app", _initialize_app)
+
+
+def get_db():
+    def build():
+        if STORAGE_BACKEND == "local":
+            from memory_store import MemoryClient
+            metrics.instrument_firestore(local=True)
+            client = MemoryClient()
+            if os.environ.get("MEMORY_STORE_SEED"):
+                client.load_file(os.environ["MEMORY_STORE_SEED"])
+            return client
+        from firebase_admin import firestore
+        metrics.instrument_firestore()
+        return firestore.client(get_app())
+    return _get("db", build)
+
+
+def get_bucket():
+    def build():
+        if STORAGE_BACKEND == "local":
+            from local_storage import LocalBucket
+            metrics.instrument_storage(local=True)
+            return LocalBucket(os.environ.get("LOCAL_STORAGE_DIR", "local_storage"), os.environ.get("LOCAL_STORAGE_URL"))
+        from firebase_admin import storage
+        metrics.instrument_storage()
+        return storage.bucket(app=get_app())
+    return _get("bucket", build)
+
+
+# Module providing the Firestore sentinels, transactional and Query for the
+# selected backend
+def get_firestore_module():
+    if STORAGE_BACKEND == "local":
+        return _get("firestore", lambda: importlib.import_module("memory_store"))
+    return _get("firestore", lambda: importlib.import_module("firebase_admin.firestore"))
+
+
+def get_field_path():
+    if STORAGE_BACKEND == "local":
+        return get_firestore_module().FieldPath
+    return _get("field_path", lambda: importlib.import_module("google.cloud.firestore_v1.field_path").FieldPath)
+
+
+# The async client is bound to the event loop it was created on, so each
+# loop gets its own
+def get_async_db():
+    import asyncio
+
+    if STORAGE_BACKEND != "firebase":
+        raise RuntimeError("The async Firestore client needs STORAGE_BACKEND=firebase")
+
+    def build():
+        from firebase_admin import firestore_async
+        return firestore_async.client(get_app())
+    return _get(("async_db", id(asyncio.get_running_loop())), build)
+
+
+def get_auth():
+    def build():
+        get_app()
+        module = importlib.import_module("firebase_admin.auth")
+        metrics.instrument_auth(module)
+        return module
+    return _get("auth", build)
+
+
+# Use `client` for `name` ("db", "bucket" or "auth") instead of building it,
+# e.g. to run benchmarks against fakes. Must be called before first use.
+def override(name, client):
+    with _lock:
+        _clients[name] = client
+
+
+# Stand-in for a client or module that is only built or imported when it is
+# first used, so importing the app stays cheap and a cold start that only
+# serves the health check never loads the Google Cloud libraries.
+class LazyProxy:
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._factory()(*args, **kwargs)
+
+
+db = LazyProxy(get_db)
+bucket = LazyProxy(get_bucket)
+auth = LazyProxy(get_auth)
+firestore = LazyProxy(get_firestore_module)
+FieldPath = LazyProxy(get_field_path)
@@ -0,0 +1,21 @@
+# Loaded automatically when gunicorn is started from the backend directory
+
+
+# Start each worker's code runner pool as soon as it forks, so the first
+# /run-code requests are served by warm processes
+def post_fork(server, worker):
+    from app import code_runner
+
+    code_runner.start()
+
+
+# Stop the code runner and flush queued audit log events before a worker
+# exits so restarts and deploys do not lose them
+def worker_exit(server, worker):
+    from app import audit_log, code_runner
+
+    code_runner.shutdown()
+
+    drain = getattr(audit_log, "drain", None)
+    if drain is not None:
+        drain()
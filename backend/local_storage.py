@@ -0,0 +1,165 @@
+import os
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from urllib.parse import quote
+from datetime import datetime, timezone
+
+# Cloud Storage stand-in that keeps blobs as files under one directory,
+# selected with STORAGE_BACKEND=local (see firebase_clients.py). It covers
+# what the backend uses: listing by prefix, get_blob/blob, downloads,
+# streamed uploads through blob.open("wb"), custom metadata, signed and
+# public URLs and deletes. Metadata lives next to the files in
+# .metadata/<blob name>.json, and a blob's generation is its file's
+# modification time in nanoseconds, so caches keyed by (name, generation)
+# see every rewrite. URLs point at LOCAL_STORAGE_URL when it is set, such as
+# a static file server over the directory, and at file:// paths otherwise.
+
+METADATA_DIR = ".metadata"
+
+
+class LocalBucket:
+    def __init__(self, root, base_url=None):
+        self.root = Path(root).resolve()
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.name = self.root.name
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, blob_name):
+        path = (self.root / blob_name).resolve()
+        if self.root not in path.parents:
+            raise ValueError(f"Invalid blob name: {blob_name}")
+        return path
+
+    def metadata_path(self, blob_name):
+        return self.path(f"{METADATA_DIR}/{blob_name}.json")
+
+    def url(self, blob_name):
+        if self.base_url:
+            return f"{self.base_url}/{quote(blob_name)}"
+        return self.path(blob_name).as_uri()
+
+    def blob(self, blob_name):
+        return LocalBlob(self, blob_name)
+
+    def get_blob(self, blob_name):
+        blob = LocalBlob(self, blob_name)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix=None):
+        blobs = []
+        for path in sorted(self.root.rglob("*")):
+            name = path.relative_to(self.root).as_posix()
+            if not path.is_file() or name.startswith(METADATA_DIR + "/") or ".upload-" in path.name:
+                continue
+            if prefix is None or name.startswith(prefix):
+                blobs.append(LocalBlob(self, name))
+        return blobs
+
+
+class LocalBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.metadata = None
+        self.content_type = None
+        self.reload()
+
+    # Load the stored size, generation and metadata
+    def reload(self):
+        path = self.bucket.path(self.name)
+        if not path.is_file():
+            self.size = None
+            self.generation = None
+            self.updated = None
+            return
+        stat = path.stat()
+        self.size = stat.st_size
+        self.generation = stat.st_mtime_ns
+        self.updated = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+        metadata_path = self.bucket.metadata_path(self.name)
+        if metadata_path.is_file():
+            stored = json.loads(metadata_path.read_text(encoding="utf-8"))
+            self.metadata = stored.get("metadata")
+            self.content_type = stored.get("content_type")
+
+    @property
+    def public_url(self):
+        return self.bucket.url(self.name)
+
+    def exists(self):
+        return self.bucket.path(self.name).is_file()
+
+    def generate_signed_url(self, expiration=None, method="GET", **kwargs):
+        return self.public_url
+
+    def make_public(self):
+        pass
+
+    # Save metadata and content type
+    def patch(self):
+        metadata_path = self.bucket.metadata_path(self.name)
+        metadata_path.parent.mkdir(parents=True, exist_ok=True)
+        metadata_path.write_text(json.dumps({"metadata": self.metadata, "content_type": self.content_type}), encoding="utf-8")
+
+    def download_as_bytes(self):
+        return self.bucket.path(self.name).read_bytes()
+
+    def download_as_text(self, encoding="utf-8"):
+        return self.download_as_bytes().decode(encoding)
+
+    def upload_from_string(self, data, content_type=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self.open("wb", content_type=content_type) as out:
+            out.write(data)
+
+    def upload_from_file(self, file_obj, content_type=None, **kwargs):
+        with self.open("wb", content_type=content_type) as out:
+            shutil.copyfileobj(file_obj, out)
+
+    def open(self, mode="r", chunk_size=None, content_type=None, **kwargs):
+        if "w" in mode:
+            return LocalBlobWriter(self, content_type)
+        if "b" in mode:
+            return self.bucket.path(self.name).open("rb")
+        return self.bucket.path(self.name).open("r", encoding=kwargs.get("encoding", "utf-8"))
+
+    def delete(self):
+        path = self.bucket.path(self.name)
+        if not path.is_file():
+            raise FileNotFoundError(self.name)
+        path.unlink()
+        self.bucket.metadata_path(self.name).unlink(missing_ok=True)
+        self.reload()
+
+
+# Writes to a temporary file that only replaces the blob when the `with`
+# block finishes cleanly, like a resumable upload session that is cancelled
+# if the writer is abandoned
+class LocalBlobWriter:
+    def __init__(self, blob, content_type):
+        self.blob = blob
+        self.content_type = content_type
+        path = blob.bucket.path(blob.name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, self.temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".upload-{path.name}.")
+        self.file = os.fdopen(descriptor, "wb")
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.file.close()
+        if exc_type is not None:
+            os.unlink(self.temp_path)
+            return False
+        os.replace(self.temp_path, self.blob.bucket.path(self.blob.name))
+        self.blob.content_type = self.content_type or self.blob.content_type
+        self.blob.patch()
+        self.blob.reload()
+        return False
@@ -0,0 +1,516 @@
+import re
+import copy
+import json
+import uuid
+import threading
+from datetime import datetime, timezone
+
+# In-process stand-in for the subset of the Firestore client the backend
+# uses: documents and collections, queries with where/order_by/limit/
+# start_after/select, get_all, write batches and transactions, and the
+# Increment, DELETE_FIELD and SERVER_TIMESTAMP sentinels. It is selected with
+# STORAGE_BACKEND=local (see firebase_clients.py) for load tests and offline
+# runs, and exposes the same names as firebase_admin.firestore so the rest of
+# the code does not know which one it is talking to.
+#
+# Every read and write holds one process-wide lock, and a transaction holds
+# it for its whole duration, so transactions are serializable and never
+# retried. Data lives only as long as the process unless it is loaded from,
+# or dumped to, a JSON file of {"collection/document": fields}.
+
+SIMPLE_FIELD = re.compile(r"^[_a-zA-Z][_a-zA-Z0-9]*$")
+
+
+class NotFound(Exception):
+    pass
+
+
+class Sentinel:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"Sentinel({self.name})"
+
+
+DELETE_FIELD = Sentinel("DELETE_FIELD")
+SERVER_TIMESTAMP = Sentinel("SERVER_TIMESTAMP")
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+class FieldPath:
+    def __init__(self, *parts):
+        self.parts = parts
+
+    @staticmethod
+    def document_id():
+        return "__name__"
+
+    def to_api_repr(self):
+        return ".".join(
+            part if SIMPLE_FIELD.match(part) else "`" + part.replace("\\", "\\\\").replace("`", "\\`") + "`"
+            for part in self.parts
+        )
+
+
+# Helper function to split a dotted field path, honouring `quoted` segments
+def split_field_path(path):
+    parts = []
+    current = ""
+    quoted = False
+    escaped = False
+    for char in path:
+        if escaped:
+            current += char
+            escaped = False
+        elif char == "\\" and quoted:
+            escaped = True
+        elif char == "`":
+            quoted = not quoted
+        elif char == "." and not quoted:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    parts.append(current)
+    return parts
+
+
+# Helper function to read a field path out of a document, returning
+# (found, value)
+def get_field(data, path):
+    if path == "__name__":
+        return False, None
+    value = data
+    for part in split_field_path(path):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+
+# Helper function to resolve a sentinel against the value it replaces
+def resolve(value, current, found):
+    if value is SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, Increment):
+        if found and isinstance(current, (int, float)) and not isinstance(current, bool):
+            return current + value.value
+        return value.value
+    if isinstance(value, dict):
+        return {key: resolve(item, None, False) for key, item in value.items() if item is not DELETE_FIELD}
+    return copy.deepcopy(value)
+
+
+# Helper function to write one value at a field path, creating parent maps
+def set_field(data, parts, value):
+    for part in parts[:-1]:
+        if not isinstance(data.get(part), dict):
+            data[part] = {}
+        data = data[part]
+    if value is DELETE_FIELD:
+        data.pop(parts[-1], None)
+    else:
+        data[parts[-1]] = resolve(value, data.get(parts[-1]), parts[-1] in data)
+
+
+# Helper function to merge `changes` into `data` map by map, like
+# set(..., merge=True)
+def merge_fields(data, changes):
+    for key, value in changes.items():
+        if isinstance(value, dict) and value:
+            if not isinstance(data.get(key), dict):
+                data[key] = {}
+            merge_fields(data[key], value)
+        else:
+            set_field(data, [key], value)
+
+
+# Helper function to keep only the given field paths of a document
+def project(data, field_paths):
+    projected = {}
+    for path in field_paths:
+        found, value = get_field(data, path)
+        if found:
+            set_field(projected, split_field_path(path), value)
+    return projected
+
+
+# Firestore orders values of different types by type first
+def type_rank(value):
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, list):
+        return 8
+    return 9
+
+
+def compare(a, b):
+    rank_a, rank_b = type_rank(a), type_rank(b)
+    if rank_a != rank_b:
+        return -1 if rank_a < rank_b else 1
+    if rank_a == 8:
+        for item_a, item_b in zip(a, b):
+            result = compare(item_a, item_b)
+            if result:
+                return result
+        return compare(len(a), len(b))
+    if rank_a == 9 or a == b:
+        return 0
+    return -1 if a < b else 1
+
+
+def matches(value, op, operand):
+    if op == "==":
+        return compare(value, operand) == 0
+    if op == "!=":
+        return compare(value, operand) != 0
+    if op == "<":
+        return type_rank(value) == type_rank(operand) and compare(value, operand) < 0
+    if op == "<=":
+        return type_rank(value) == type_rank(operand) and compare(value, operand) <= 0
+    if op == ">":
+        return type_rank(value) == type_rank(operand) and compare(value, operand) > 0
+    if op == ">=":
+        return type_rank(value) == type_rank(operand) and compare(value, operand) >= 0
+    if op == "in":
+        return any(compare(value, item) == 0 for item in operand)
+    if op == "not-in":
+        return all(compare(value, item) != 0 for item in operand)
+    if op == "array_contains":
+        return isinstance(value, list) and any(compare(item, operand) == 0 for item in value)
+    if op == "array_contains_any":
+        return isinstance(value, list) and any(compare(item, wanted) == 0 for item in value for wanted in operand)
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path):
+        found, value = get_field(self._data or {}, field_path)
+        if not found:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, name):
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None):
+        return self._client._snapshot(self, field_paths)
+
+    def create(self, document_data):
+        self._client._commit([("create", self, document_data, False)])
+
+    def set(self, document_data, merge=False):
+        self._client._commit([("set", self, document_data, merge)])
+
+    def update(self, field_updates):
+        self._client._commit([("update", self, field_updates, False)])
+
+    def delete(self):
+        self._client._commit([("delete", self, None, False)])
+
+
+class Query:
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+    def __init__(self, client, path, filters=(), orders=(), limit=None, cursor=None, fields=None):
+        self._client = client
+        self._path = path
+        self._filters = filters
+        self._orders = orders
+        self._limit = limit
+        self._cursor = cursor
+        self._fields = fields
+
+    def _copy(self, **changes):
+        state = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit": self._limit,
+            "cursor": self._cursor,
+            "fields": self._fields,
+        }
+        state.update(changes)
+        return Query(self._client, self._path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    # Sort order: the explicit order_by fields, then the fields of any
+    # inequality filter, then the document id, as Firestore does
+    def _sort_fields(self):
+        orders = list(self._orders)
+        ordered = {field for field, _ in orders}
+        for field, op, _ in self._filters:
+            if op in ("<", "<=", ">", ">=", "!=", "not-in") and field not in ordered:
+                orders.append((field, self.ASCENDING))
+                ordered.add(field)
+        if "__name__" not in ordered:
+            orders.append(("__name__", orders[-1][1] if orders else self.ASCENDING))
+        return orders
+
+    def _matches(self, reference, data, field, op, value):
+        if field == "__name__":
+            if op in ("in", "not-in"):
+                value = [self._client.document_path(self._path, item) for item in value]
+            else:
+                value = self._client.document_path(self._path, value)
+            return matches(reference.path, op, value)
+        found, field_value = get_field(data, field)
+        return found and matches(field_value, op, value)
+
+    def _key(self, reference, data, orders):
+        return [reference.path if field == "__name__" else get_field(data, field)[1] for field, _ in orders]
+
+    def _after(self, key, cursor_key, orders):
+        for value, cursor_value, (_, direction) in zip(key, cursor_key, orders):
+            result = compare(value, cursor_value)
+            if result:
+                return (result > 0) == (direction == self.ASCENDING)
+        return False
+
+    def stream(self, transaction=None):
+        return iter(self.get(transaction=transaction))
+
+    def get(self, transaction=None):
+        orders = self._sort_fields()
+        with self._client._lock:
+            rows = []
+            for reference, data in self._client._documents(self._path):
+                # Documents missing a filtered or ordered field are left out
+                if all(self._matches(reference, data, *condition) for condition in self._filters) and \
+                        all(field == "__name__" or get_field(data, field)[0] for field, _ in orders):
+                    rows.append((reference, data))
+
+            for index in range(len(orders) - 1, -1, -1):
+                field, direction = orders[index]
+                rows.sort(
+                    key=lambda row: SortKey(self._key(row[0], row[1], [orders[index]])[0]),
+                    reverse=direction == self.DESCENDING,
+                )
+
+            if self._cursor is not None:
+                if isinstance(self._cursor, DocumentSnapshot):
+                    cursor_key = self._key(self._cursor.reference, self._cursor._data or {}, orders)
+                    cursor_orders = orders
+                else:
+                    cursor_orders = [order for order in orders if order[0] in self._cursor]
+                    cursor_key = [
+                        self._client.document_path(self._path, self._cursor[field]) if field == "__name__" else self._cursor[field]
+                        for field, _ in cursor_orders
+                    ]
+                rows = [row for row in rows if self._after(self._key(row[0], row[1], cursor_orders), cursor_key, cursor_orders)]
+
+            if self._limit is not None:
+                rows = rows[:self._limit]
+            return [
+                DocumentSnapshot(reference, project(data, self._fields) if self._fields is not None else copy.deepcopy(data))
+                for reference, data in rows
+            ]
+
+
+class SortKey:
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return compare(self.value, other.value) < 0
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, f"{self._path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, document_data, document_id=None):
+        reference = self.document(document_id)
+        reference.create(document_data)
+        return datetime.now(timezone.utc), reference
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def create(self, reference, document_data):
+        self._writes.append(("create", reference, document_data, False))
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(("set", reference, document_data, merge))
+
+    def update(self, reference, field_updates):
+        self._writes.append(("update", reference, field_updates, False))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference, None, False))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        self._client._commit(writes)
+        return writes
+
+
+class Transaction(WriteBatch):
+    pass
+
+
+# Run `to_wrap(transaction, ...)` holding the store lock and commit its
+# writes if it returns, or drop them if it raises
+def transactional(to_wrap):
+    def wrapper(transaction, *args, **kwargs):
+        with transaction._client._lock:
+            try:
+                result = to_wrap(transaction, *args, **kwargs)
+            except Exception:
+                transaction._writes = []
+                raise
+            transaction.commit()
+        return result
+    return wrapper
+
+
+class MemoryClient:
+    def __init__(self, data=None):
+        self._lock = threading.RLock()
+        self._data = {}
+        if data:
+            self.load(data)
+
+    @staticmethod
+    def document_path(collection_path, value):
+        if isinstance(value, DocumentReference):
+            return value.path
+        return value if "/" in value else f"{collection_path}/{value}"
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def document(self, path):
+        return DocumentReference(self, path)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return Transaction(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        return [reference.get(field_paths=field_paths) for reference in references]
+
+    def _documents(self, collection_path):
+        prefix = collection_path + "/"
+        for path, data in sorted(self._data.items()):
+            if path.startswith(prefix) and "/" not in path[len(prefix):]:
+                yield DocumentReference(self, path), data
+
+    def _snapshot(self, reference, field_paths=None):
+        with self._lock:
+            data = self._data.get(reference.path)
+            if data is not None:
+                data = project(data, field_paths) if field_paths is not None else copy.deepcopy(data)
+            return DocumentSnapshot(reference, data)
+
+    # Apply a list of (kind, reference, data, merge) writes all or nothing
+    def _commit(self, writes):
+        with self._lock:
+            pending = {}
+            for kind, reference, data, merge in writes:
+                current = pending[reference.path] if reference.path in pending else self._data.get(reference.path)
+                if kind == "delete":
+                    pending[reference.path] = None
+                    continue
+                if kind == "create" and current is not None:
+                    raise ValueError(f"Document already exists: {reference.path}")
+                if kind == "update" and current is None:
+                    raise NotFound(f"No document to update: {reference.path}")
+
+                document = copy.deepcopy(current) if current is not None and (merge or kind == "update") else {}
+                if kind == "update":
+                    for field_path, value in data.items():
+                        set_field(document, split_field_path(field_path), value)
+                elif merge:
+                    merge_fields(document, data)
+                else:
+                    if any(value is DELETE_FIELD for value in data.values()):
+                        raise ValueError("DELETE_FIELD can only be used with update() or set(..., merge=True)")
+                    document = resolve(data, None, False)
+                pending[reference.path] = document
+
+            for path, document in pending.items():
+                if document is None:
+                    self._data.pop(path, None)
+                else:
+                    self._data[path] = document
+
+    # Replace the stored documents with {"collection/document": fields}
+    def load(self, data):
+        with self._lock:
+            self._data = {path: copy.deepcopy(fields) for path, fields in data.items()}
+
+    def dump(self):
+        with self._lock:
+            return copy.deepcopy(self._data)
+
+    def load_file(self, path):
+        with open(path, encoding="utf-8") as source:
+            self.load(json.load(source))
+
+    def dump_file(self, path):
+        with open(path, "w", encoding="utf-8") as out:
+            json.dump(self.dump(), out, indent=2, default=str)
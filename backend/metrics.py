@@ -0,0 +1,505 @@
+import os
+import sys
+import time
+import hmac
+import threading
+import importlib
+import contextvars
+from functools import wraps
+from contextlib import contextmanager
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from flask.json.provider import DefaultJSONProvider
+
+# Request and backend-call instrumentation, exposed in Prometheus text format.
+#
+# MetricsMiddleware wraps the WSGI app and records every request's latency
+# and status under its Flask route rule (so /get-code/<code_id> is one
+# series). Firestore, Storage and Auth client methods are wrapped when the
+# clients are built (see firebase_clients.py), and JSON serialization is
+# timed through TimedJSONProvider, so each call's latency is recorded too,
+# along with the route of the request that made it. Calls made inside
+# another instrumented call, such as a collection stream running its query,
+# are only counted once.
+#
+# With SLOW_REQUEST_PROFILE_MS set, a sampling profiler records the stacks
+# of threads serving requests and prints the hottest ones for any request
+# slower than that, or writes them in folded format to
+# SLOW_REQUEST_PROFILE_DIR.
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Backend client methods that make a round trip, by "module:Class"
+FIRESTORE_METHODS = {
+    "google.cloud.firestore_v1.document:DocumentReference": ["get", "set", "update", "delete", "create"],
+    "google.cloud.firestore_v1.query:Query": ["get", "stream"],
+    "google.cloud.firestore_v1.collection:CollectionReference": ["get", "stream", "add", "list_documents"],
+    "google.cloud.firestore_v1.client:Client": ["get_all", "collections"],
+    "google.cloud.firestore_v1.batch:WriteBatch": ["commit"],
+    "google.cloud.firestore_v1.transaction:Transaction": ["_begin", "_commit", "_rollback"],
+}
+STORAGE_METHODS = {
+    "google.cloud.storage.blob:Blob": [
+        "download_as_text", "download_as_bytes", "upload_from_file", "upload_from_string",
+        "exists", "delete", "make_public", "generate_signed_url",
+    ],
+    "google.cloud.storage._helpers:_PropertyMixin": ["reload", "patch"],
+    "google.cloud.storage.bucket:Bucket": ["list_blobs", "get_blob"],
+}
+LOCAL_FIRESTORE_METHODS = {
+    "memory_store:DocumentReference": ["get", "set", "update", "delete", "create"],
+    "memory_store:Query": ["get", "stream"],
+    "memory_store:CollectionReference": ["add"],
+    "memory_store:MemoryClient": ["get_all"],
+    "memory_store:WriteBatch": ["commit"],
+}
+LOCAL_STORAGE_METHODS = {
+    "local_storage:LocalBlob": [
+        "download_as_text", "download_as_bytes", "upload_from_file", "upload_from_string",
+        "exists", "delete", "reload", "patch", "generate_signed_url",
+    ],
+    "local_storage:LocalBucket": ["list_blobs", "get_blob"],
+}
+AUTH_FUNCTIONS = ["verify_id_token", "get_user", "create_user", "update_user", "delete_user", "delete_users"]
+
+# Methods returning iterators whose items are fetched as they are consumed
+STREAMING_METHODS = {"stream", "get_all", "list_blobs", "list_documents", "collections"}
+
+ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+
+_current_request = contextvars.ContextVar("current_request", default=None)
+_in_call = contextvars.ContextVar("in_call", default=False)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterMetric:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {}
+
+    def inc(self, labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.label_names, labels)} {format_value(value)}")
+        return lines
+
+
+class HistogramMetric:
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series["buckets"][index] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            for bound, count in zip(self.buckets, series["buckets"]):
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names, labels, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{format_labels(self.label_names, labels, [('le', '+Inf')])} {series['count']}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {series['count']}")
+        return lines
+
+
+# Process-wide store of every metric, plus collectors that report values
+# kept elsewhere (such as cache hit counts) when /metrics is scraped
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = CounterMetric("http_requests_total", "Requests served, by route, method and status.", ["route", "method", "status"])
+        self.request_seconds = HistogramMetric("http_request_duration_seconds", "Request latency, including streaming the body.", ["route", "method"])
+        self.in_flight = 0
+        self.call_seconds = HistogramMetric("backend_call_duration_seconds", "Latency of Firestore, Storage, Auth and JSON calls.", ["service", "operation"])
+        self.calls = CounterMetric("backend_calls_total", "Backend calls, by the route of the request that made them.", ["route", "service", "operation"])
+        self.call_errors = CounterMetric("backend_call_errors_total", "Backend calls that raised.", ["service", "operation"])
+        self.request_call_seconds = HistogramMetric("backend_time_per_request_seconds", "Time a request spent in backend calls, per service.", ["route", "service"])
+        self.collectors = []
+
+    def observe_call(self, service, operation, seconds, failed):
+        request = _current_request.get()
+        with self._lock:
+            self.call_seconds.observe((service, operation), seconds)
+            self.calls.inc((request.route if request else "none", service, operation))
+            if failed:
+                self.call_errors.inc((service, operation))
+        if request is not None:
+            request.add_call(service, seconds)
+
+    def start_request(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def observe_request(self, request, seconds):
+        with self._lock:
+            self.in_flight -= 1
+            self.requests.inc((request.route, request.method, request.status))
+            self.request_seconds.observe((request.route, request.method), seconds)
+            for service, service_seconds in request.call_seconds.items():
+                self.request_call_seconds.observe((request.route, service), service_seconds)
+
+    # `collector()` returns a list of
+    # (name, type, help, label names, {labels tuple: value})
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            lines = self.requests.render() + self.request_seconds.render()
+            lines += ["# HELP http_requests_in_flight Requests being served.", "# TYPE http_requests_in_flight gauge", f"http_requests_in_flight {self.in_flight}"]
+            lines += self.call_seconds.render() + self.calls.render() + self.call_errors.render() + self.request_call_seconds.render()
+        for collector in self.collectors:
+            for name, metric_type, help_text, label_names, values in collector():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+                lines += [f"{name}{format_labels(label_names, labels)} {format_value(value)}" for labels, value in sorted(values.items())]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+# What one request has done so far. Calls can be recorded from pool threads
+# working for the request, hence the lock.
+class RequestStats:
+    def __init__(self, route, method):
+        self.route = route
+        self.method = method
+        self.status = "500"
+        self.started = time.perf_counter()
+        self.call_seconds = {}
+        self.samples = Counter()
+        self._lock = threading.Lock()
+
+    def add_call(self, service, seconds):
+        with self._lock:
+            self.call_seconds[service] = self.call_seconds.get(service, 0) + seconds
+
+
+# Time the block as one call to `service`, unless it runs inside another
+# instrumented call
+@contextmanager
+def timed_call(service, operation):
+    if _in_call.get():
+        yield
+        return
+    token = _in_call.set(True)
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        _in_call.reset(token)
+        registry.observe_call(service, operation, time.perf_counter() - started, failed)
+
+
+# Helper function to time an iterator's items as they are fetched, as part of
+# the call that returned it
+def timed_iterator(iterator, service, operation, elapsed):
+    failed = False
+    try:
+        while True:
+            token = _in_call.set(True)
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                elapsed += time.perf_counter() - started
+                _in_call.reset(token)
+            yield item
+    finally:
+        registry.observe_call(service, operation, elapsed, failed)
+
+
+def timed(function, service, operation, streaming=False):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if _in_call.get():
+            return function(*args, **kwargs)
+        if not streaming:
+            with timed_call(service, operation):
+                return function(*args, **kwargs)
+
+        token = _in_call.set(True)
+        started = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException:
+            registry.observe_call(service, operation, time.perf_counter() - started, True)
+            raise
+        finally:
+            _in_call.reset(token)
+        return timed_iterator(iter(result), service, operation, time.perf_counter() - started)
+
+    wrapper._metrics_timed = True
+    return wrapper
+
+
+# Wrap the methods in `spec` ({"module:Class": [method names]}) on the
+# classes themselves, once, so every client object is instrumented
+def instrument_classes(spec, service):
+    if not ENABLED:
+        return
+    for target, names in spec.items():
+        module_name, class_name = target.split(":")
+        cls = getattr(importlib.import_module(module_name), class_name)
+        for name in names:
+            method = cls.__dict__.get(name)
+            if method is None or getattr(method, "_metrics_timed", False):
+                continue
+            setattr(cls, name, timed(method, service, f"{class_name}.{name}", streaming=name in STREAMING_METHODS))
+
+
+def instrument_firestore(local=False):
+    instrument_classes(LOCAL_FIRESTORE_METHODS if local else FIRESTORE_METHODS, "firestore")
+
+
+def instrument_storage(local=False):
+    instrument_classes(LOCAL_STORAGE_METHODS if local else STORAGE_METHODS, "storage")
+
+
+def instrument_auth(module):
+    if not ENABLED:
+        return
+    for name in AUTH_FUNCTIONS:
+        function = getattr(module, name, None)
+        if function is not None and not getattr(function, "_metrics_timed", False):
+            setattr(module, name, timed(function, "auth", name))
+
+
+# Flask JSON provider that times serialization
+class TimedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        with timed_call("json", "dumps"):
+            return super().dumps(obj, **kwargs)
+
+
+# Thread pool whose tasks run in the submitting request's context, so calls
+# they make are counted against that request
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# Helper function to turn a frame into a root-first "file:function" stack
+def collapse_stack(frame, max_depth=64):
+    stack = []
+    while frame is not None and len(stack) < max_depth:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+# Samples the stacks of the threads serving requests every `interval`
+# seconds, and reports requests slower than `threshold` seconds
+class SlowRequestProfiler:
+    def __init__(self, threshold, interval=0.005, output_dir=None, top=15):
+        self.threshold = threshold
+        self.interval = interval
+        self.output_dir = output_dir
+        self.top = top
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def begin(self, request):
+        with self._lock:
+            self._active[threading.get_ident()] = request
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+
+    def end(self, request, seconds):
+        with self._lock:
+            for thread_id, active in list(self._active.items()):
+                if active is request:
+                    del self._active[thread_id]
+        if seconds >= self.threshold and request.samples:
+            self.report(request, seconds)
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                active = list(self._active.items())
+            for thread_id, request in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    request.samples[collapse_stack(frame)] += 1
+
+    def report(self, request, seconds):
+        summary = f"Slow request: {request.method} {request.route} took {seconds * 1000:.0f} ms ({sum(request.samples.values())} samples)"
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+            route = request.route.strip("/").replace("/", "_").replace("<", "").replace(">", "") or "root"
+            path = os.path.join(self.output_dir, f"{int(time.time() * 1000)}-{request.method}-{route}.folded")
+            with open(path, "w") as out:
+                for stack, count in request.samples.most_common():
+                    out.write(f"{stack} {count}\n")
+            print(f"{summary}, stacks written to {path}")
+            return
+        print(summary)
+        for stack, count in request.samples.most_common(self.top):
+            print(f"  {count:>5} {stack}")
+
+
+# WSGI middleware recording request metrics and serving them at
+# `metrics_path`. Set METRICS_TOKEN to require it as a Bearer token there.
+class MetricsMiddleware:
+    def __init__(self, wsgi_app, flask_app, metrics_path="/metrics", token=None, public=False, profiler=None):
+        self.wsgi_app = wsgi_app
+        self.flask_app = flask_app
+        self.metrics_path = metrics_path
+        self.token = token
+        self.public = public
+        self.profiler = profiler
+
+    # Helper function to label a request with its route rule, so the number
+    # of series stays bounded
+    def route(self, environ):
+        try:
+            rule, _ = self.flask_app.url_map.bind_to_environ(environ).match(return_rule=True)
+            return rule.rule
+        except Exception:
+            return "unmatched"
+
+    def serve_metrics(self, environ, start_response):
+        supplied = environ.get("HTTP_AUTHORIZATION", "").replace("Bearer ", "")
+        if self.token and not hmac.compare_digest(supplied, self.token):
+            start_response("401 UNAUTHORIZED", [("Content-Type", "text/plain")])
+            return [b"Unauthorized\n"]
+        body = registry.render().encode("utf-8")
+        start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4; charset=utf-8"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    def __call__(self, environ, start_response):
+        # The endpoint is only served with a token, or when made public
+        # explicitly; otherwise the path is left to the app, which has no
+        # such route
+        if environ.get("PATH_INFO") == self.metrics_path and (self.token or self.public):
+            return self.serve_metrics(environ, start_response)
+
+        request = RequestStats(self.route(environ), environ.get("REQUEST_METHOD", "GET"))
+        context = contextvars.copy_context()
+        context.run(_current_request.set, request)
+
+        def capture_status(status, headers, exc_info=None):
+            request.status = status.split(" ", 1)[0]
+            return start_response(status, headers, exc_info)
+
+        registry.start_request()
+        if self.profiler is not None:
+            self.profiler.begin(request)
+        try:
+            body = context.run(self.wsgi_app, environ, capture_status)
+        except BaseException:
+            self.finish(request)
+            raise
+        return TrackedBody(body, context, lambda: self.finish(request))
+
+    def finish(self, request):
+        seconds = time.perf_counter() - request.started
+        registry.observe_request(request, seconds)
+        if self.profiler is not None:
+            self.profiler.end(request, seconds)
+
+
+# Helper functions to record a request served outside MetricsMiddleware, such
+# as the native ASGI routes. Calls made in the context begin_request ran in,
+# or in threads started from it, are counted towards the request.
+def begin_request(route, method):
+    request = RequestStats(route, method)
+    registry.start_request()
+    return request, _current_request.set(request)
+
+
+def end_request(request, token):
+    _current_request.reset(token)
+    registry.observe_request(request, time.perf_counter() - request.started)
+
+
+# Response body that is iterated inside the request's context, so calls made
+# while streaming are counted, and that records the request when closed
+class TrackedBody:
+    def __init__(self, body, context, on_close):
+        self.body = body
+        self.context = context
+        self.on_close = on_close
+
+    def __iter__(self):
+        iterator = self.context.run(iter, self.body)
+        while True:
+            try:
+                chunk = self.context.run(next, iterator)
+            except StopIteration:
+                return
+            yield chunk
+
+    def close(self):
+        try:
+            close = getattr(self.body, "close", None)
+            if close is not None:
+                self.context.run(close)
+        finally:
+            self.on_close()
+
+
+# Install the instrumentation on a Flask app, configured from the environment
+def install(flask_app):
+    if not ENABLED:
+        return
+    flask_app.json = TimedJSONProvider(flask_app)
+    profiler = None
+    if os.environ.get("SLOW_REQUEST_PROFILE_MS"):
+        profiler = SlowRequestProfiler(
+            threshold=float(os.environ["SLOW_REQUEST_PROFILE_MS"]) / 1000,
+            interval=float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000,
+            output_dir=os.environ.get("SLOW_REQUEST_PROFILE_DIR"),
+        )
+    flask_app.wsgi_app = MetricsMiddleware(
+        flask_app.wsgi_app,
+        flask_app,
+        token=os.environ.get("METRICS_TOKEN"),
+        public=os.environ.get("METRICS_PUBLIC", "").lower() in ("1", "true", "yes"),
+        profiler=profiler,
+    )
@@ -0,0 +1,15 @@
+from app import db
+from audit_log import AuditLog
+
+# Split the legacy per-user `logs` documents, which hold an `entries` array,
+# into one document per event so they show up in /logs.
+#
+#   $ python migrate_logs.py
+
+
+def main():
+    print(f"{AuditLog(db).migrate_legacy()} events migrated")
+
+
+if __name__ == "__main__":
+    main()
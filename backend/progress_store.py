@@ -0,0 +1,319 @@
+import zlib
+from firebase_clients import firestore, FieldPath
+
+# Items without a type are filed under this key
+UNTYPED = "other"
+
+
+# Helper function to get the field path of one progress item
+def item_path(item_type, material_id):
+    return FieldPath("materials", item_type or UNTYPED, material_id).to_api_repr()
+
+
+# Helper function to flatten a progress document into the list of items the
+# API has always returned. Documents written before progress was keyed by
+# material still carry an `items` array, which is merged in.
+def progress_items(progress_data, item_type=None):
+    items = {}
+    for item in progress_data.get("items", []):
+        items[(item.get("type") or UNTYPED, item["material_id"])] = item
+    for type_key, materials in progress_data.get("materials", {}).items():
+        for material_id, item in materials.items():
+            items[(type_key, material_id)] = item
+
+    if item_type:
+        items = {key: item for key, item in items.items() if key[0] == item_type}
+    return sorted(items.values(), key=lambda item: (item.get("accessed_at") or "", item.get("type") or UNTYPED, item["material_id"]))
+
+
+# Helper function to get the date an item was last active: its completion
+# date if it has one, otherwise when it was first accessed
+def activity_date(item):
+    return item.get("completion_date") or item.get("accessed_at") or ""
+
+
+# Helper function to count tracked and completed items per type
+def summarize(items):
+    summary = {}
+    for item in items:
+        counts = summary.setdefault(item.get("type") or UNTYPED, {"tracked": 0, "completed": 0})
+        counts["tracked"] += 1
+        if item.get("completed"):
+            counts["completed"] += 1
+    return summary
+
+
+# Helper function to build a student's entry in a school rollup
+def student_rollup(profile, summary, last_activity):
+    return {
+        "name": profile.get("name", "Unknown"),
+        "email": profile.get("email", "No email provided"),
+        "tracked": sum(counts["tracked"] for counts in summary.values()),
+        "completed": sum(counts["completed"] for counts in summary.values()),
+        "last_activity": last_activity,
+    }
+
+
+# Helper function to pick the rollup shard a student's entries are kept in
+def shard_for(user_id, shards):
+    return zlib.crc32(user_id.encode("utf-8")) % shards
+
+
+# Helper function to add one student's entry and material states to the
+# merge-write of a rollup shard. Values are set, never incremented, so
+# writing the same student twice, or rebuilding over a mark, cannot make the
+# counts drift.
+def add_to_rollup(changes, user_id, student, summary, items, last_activity):
+    changes.setdefault("students", {})[user_id] = student_rollup(student, summary, last_activity)
+    materials = changes.setdefault("materials", {})
+    for item in items:
+        materials.setdefault(item.get("type") or UNTYPED, {})[item["material_id"]] = {
+            "title": item.get("title"),
+            "students": {user_id: bool(item.get("completed"))},
+        }
+    changes["updated_at"] = firestore.SERVER_TIMESTAMP
+    return changes
+
+
+# Helper function to combine a school's rollup shards into the rollup the
+# API returns, counting per material the students tracking and completing it
+def merge_rollup(school_id, shards):
+    rollup = {"school_id": school_id, "students": {}, "materials": {}}
+    for shard in shards:
+        rollup["students"].update(shard.get("students", {}))
+        for type_key, materials in shard.get("materials", {}).items():
+            for material_id, material in materials.items():
+                totals = rollup["materials"].setdefault(type_key, {}).setdefault(
+                    material_id, {"title": material.get("title"), "tracked": 0, "completed": 0}
+                )
+                totals["title"] = totals["title"] or material.get("title")
+                totals["tracked"] += len(material.get("students", {}))
+                totals["completed"] += sum(1 for completed in material.get("students", {}).values() if completed)
+    return rollup
+
+
+# Progress of each user lives in progress/<uid>, with one map entry per
+# material under materials.<type>.<material_id> and per-type counts under
+# summary. Marking progress reads and writes only the entries being changed
+# and the summary, inside a transaction, so the cost stays constant as a
+# student's history grows and concurrent tabs do not overwrite each other.
+# Reads of a single type only download that type's entries.
+#
+# Each school's rollup is split over `rollup_shards` documents in
+# schoolProgress/<school_id>/shards, a student's entries always going to the
+# same shard, next to an index document schoolProgress/<school_id> holding
+# the shard count. The rollup is written after the student's transaction has
+# committed, so a classroom marking progress at once neither contends inside
+# the transactions nor piles every write onto one document. That write is
+# best-effort; rebuild_school_rollup repairs anything it missed.
+class ProgressStore:
+    def __init__(self, db, rollup_shards=10):
+        self.db = db
+        self.rollup_shards = rollup_shards
+
+    def ref(self, user_id):
+        return self.db.collection("progress").document(user_id)
+
+    def rollup_ref(self, school_id):
+        return self.db.collection("schoolProgress").document(school_id)
+
+    def shard_ref(self, school_id, shard):
+        return self.rollup_ref(school_id).collection("shards").document(str(shard))
+
+    # Apply many progress updates for one user atomically. Each update is a
+    # dict with material_id, type, title, completed, completion_date and
+    # accessed_at, as sent to /mark-progress. When `student` (the user's
+    # profile) has a school_id, that school's rollup is updated afterwards.
+    # A school without a rollup, such as one invalidated after a roster
+    # change, is left alone: it is rebuilt in full when it is next viewed.
+    def mark(self, user_id, updates, student=None):
+        progress_ref = self.ref(user_id)
+        school_id = (student or {}).get("school_id")
+        # Entries are keyed by (type, material_id), as the same material id
+        # can be tracked under several types. Repeated entries in one batch
+        # are applied in order, so the last one's completion state wins.
+        paths = {
+            (update.get("type") or UNTYPED, update["material_id"]): item_path(update.get("type"), update["material_id"])
+            for update in updates
+        }
+
+        @firestore.transactional
+        def apply(transaction):
+            # Only the entries being updated are read, plus the legacy array
+            # so it can be migrated the first time the document is written
+            snapshot = progress_ref.get(field_paths=list(paths.values()) + ["items", "summary"], transaction=transaction)
+            progress_data = snapshot.to_dict() if snapshot.exists else {}
+            if snapshot.exists and "summary" not in progress_data:
+                # Documents written before summaries were kept are read in
+                # full once so the summary can be built
+                progress_data = progress_ref.get(transaction=transaction).to_dict()
+                summary = summarize(progress_items(progress_data))
+            else:
+                summary = progress_data.get("summary", {})
+
+            legacy_items = progress_data.get("items")
+            if legacy_items is not None:
+                progress_data.setdefault("materials", {})
+                for item in legacy_items:
+                    type_key = item.get("type") or UNTYPED
+                    progress_data["materials"].setdefault(type_key, {}).setdefault(item["material_id"], item)
+
+            changes = {}
+            rollup_items = {}
+            for update in updates:
+                material_id = update["material_id"]
+                type_key = update.get("type") or UNTYPED
+                item = progress_data.get("materials", {}).get(type_key, {}).get(material_id)
+                counts = summary.setdefault(type_key, {"tracked": 0, "completed": 0})
+                completed_delta = bool(update.get("completed")) - bool(item and item.get("completed"))
+                counts["completed"] += completed_delta
+
+                # Update or add the progress record
+                if item is not None:
+                    item = {**item, "completed": update.get("completed"), "completion_date": update.get("completion_date")}
+                else:
+                    counts["tracked"] += 1
+                    item = {
+                        "material_id": material_id,
+                        "type": update.get("type"),
+                        "title": update.get("title"),
+                        "accessed_at": update.get("accessed_at"),
+                        "completed": update.get("completed"),
+                        "completion_date": update.get("completion_date"),
+                    }
+                progress_data.setdefault("materials", {}).setdefault(type_key, {})[material_id] = item
+                changes[paths[(type_key, material_id)]] = item
+                rollup_items[(type_key, material_id)] = {**item, "title": update.get("title") or item.get("title")}
+
+            if snapshot.exists and legacy_items is None:
+                changes["summary"] = summary
+                transaction.update(progress_ref, changes)
+            else:
+                # New documents, and the one-off migration of a legacy document
+                # to the keyed layout, are written whole
+                transaction.set(progress_ref, {
+                    "user_id": user_id,
+                    "materials": progress_data["materials"],
+                    "summary": summary,
+                })
+
+            return summary, list(rollup_items.values())
+
+        summary, rollup_items = apply(self.db.transaction())
+        if school_id:
+            last_activity = max((activity_date(update) for update in updates), default="")
+            self.update_rollup(school_id, user_id, student, summary, rollup_items, last_activity)
+
+    # Write one student's entries to their school's rollup shard, if the
+    # school has a rollup. Failures are only logged: the progress itself is
+    # already saved, and a rebuild brings the rollup back in line.
+    def update_rollup(self, school_id, user_id, student, summary, items, last_activity):
+        try:
+            index_doc = self.rollup_ref(school_id).get(field_paths=["shards"])
+            shards = index_doc.to_dict().get("shards") if index_doc.exists else None
+            if not shards:
+                return
+            changes = add_to_rollup({}, user_id, student, summary, items, last_activity)
+            self.shard_ref(school_id, shard_for(user_id, shards)).set(changes, merge=True)
+        except Exception as e:
+            print(f"Error updating school rollup {school_id}: {e}")
+
+    # Return the user's progress items. Only the entries of `item_type` are
+    # downloaded when it is given; `completed` and the `since`/`until` bounds
+    # on the item's activity date are applied after the download, before the
+    # list is returned, as is any paging done by the caller.
+    def items(self, user_id, item_type=None, completed=None, since=None, until=None):
+        field_paths = [FieldPath("materials", item_type).to_api_repr(), "items"] if item_type else None
+        progress_doc = self.ref(user_id).get(field_paths=field_paths)
+        if not progress_doc.exists:
+            return []
+
+        items = progress_items(progress_doc.to_dict(), item_type)
+        if completed is not None:
+            items = [item for item in items if bool(item.get("completed")) == completed]
+        if since:
+            items = [item for item in items if activity_date(item) >= since]
+        if until:
+            items = [item for item in items if activity_date(item) <= until]
+        return items
+
+    # Recompute a school's rollup from its students' progress documents.
+    # Used to backfill and to repair drift. Each chunk of students is read and
+    # written in one transaction, and entries are merged in per student, so a
+    # mark that lands during the rebuild is never overwritten by an older
+    # read. The index is marked ready only once every student is written.
+    def rebuild_school_rollup(self, school_id, chunk_size=100):
+        students = {
+            doc.id: doc.to_dict()
+            for doc in self.db.collection("users").where("school_id", "==", school_id).where("role", "==", "student").stream()
+        }
+        index_doc = self.rollup_ref(school_id).get(field_paths=["shards"])
+        shards = (index_doc.to_dict().get("shards") if index_doc.exists else None) or self.rollup_shards
+        self.rollup_ref(school_id).set({"school_id": school_id, "shards": shards, "ready": False})
+
+        # Students no longer in the school are dropped from the shards
+        for shard_doc in self.rollup_ref(school_id).collection("shards").stream():
+            shard = shard_doc.to_dict()
+            removals = {}
+            for user_id in shard.get("students", {}):
+                if user_id not in students:
+                    removals.setdefault("students", {})[user_id] = firestore.DELETE_FIELD
+            for type_key, materials in shard.get("materials", {}).items():
+                for material_id, material in materials.items():
+                    for user_id in material.get("students", {}):
+                        if user_id not in students:
+                            removals.setdefault("materials", {}).setdefault(type_key, {}).setdefault(
+                                material_id, {"students": {}}
+                            )["students"][user_id] = firestore.DELETE_FIELD
+            if removals:
+                shard_doc.reference.set(removals, merge=True)
+
+        @firestore.transactional
+        def write_chunk(transaction, chunk):
+            progress_docs = {
+                doc.id: doc
+                for doc in self.db.get_all([self.ref(user_id) for user_id in chunk], transaction=transaction)
+            }
+            changes = {}
+            for user_id in chunk:
+                progress_doc = progress_docs.get(user_id)
+                items = progress_items(progress_doc.to_dict()) if progress_doc is not None and progress_doc.exists else []
+                last_activity = max((activity_date(item) for item in items), default="")
+                add_to_rollup(
+                    changes.setdefault(shard_for(user_id, shards), {}),
+                    user_id, students[user_id], summarize(items), items, last_activity,
+                )
+            for shard, shard_changes in changes.items():
+                transaction.set(self.shard_ref(school_id, shard), shard_changes, merge=True)
+
+        student_ids = list(students)
+        for start in range(0, len(student_ids), chunk_size):
+            write_chunk(self.db.transaction(), student_ids[start:start + chunk_size])
+
+        self.rollup_ref(school_id).update({"ready": True, "updated_at": firestore.SERVER_TIMESTAMP})
+        return self.school_rollup(school_id)
+
+    # Drop a school's rollup so it is rebuilt on next view. Called when a
+    # student's name, role or school changes.
+    def invalidate_school_rollup(self, school_id):
+        self.rollup_ref(school_id).delete()
+        for shard_doc in self.rollup_ref(school_id).collection("shards").select([]).stream():
+            shard_doc.reference.delete()
+
+    # Return a school's rollup, or None if it has not been built
+    def school_rollup(self, school_id):
+        index_doc = self.rollup_ref(school_id).get()
+        if not index_doc.exists or not index_doc.to_dict().get("ready"):
+            return None
+        refs = [self.shard_ref(school_id, shard) for shard in range(index_doc.to_dict()["shards"])]
+        return merge_rollup(school_id, [doc.to_dict() for doc in self.db.get_all(refs) if doc.exists])
+
+    # Return the per-type counts for a user, reading only the summary field
+    def summary(self, user_id):
+        progress_doc = self.ref(user_id).get(field_paths=["summary"])
+        if not progress_doc.exists:
+            return {}
+        summary = progress_doc.to_dict().get("summary")
+        if summary is None:
+            summary = summarize(progress_items(self.ref(user_id).get().to_dict()))
+        return summary
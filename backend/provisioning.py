@@ -0,0 +1,118 @@
+import io
+import csv
+from firebase_clients import auth
+from audit_log import MAX_BATCH_WRITES, make_event
+
+VALID_ROLES = ["admin", "instructor", "student"]
+ROSTER_FIELDS = ["email", "password", "name", "role", "school_name", "school_id"]
+
+# Each provisioned user takes two batch writes: the profile and its log event
+USERS_PER_BATCH = MAX_BATCH_WRITES // 2
+
+
+# Helper function to keep the known roster fields of a row, as trimmed strings
+def normalize_row(row):
+    if not isinstance(row, dict):
+        return {}
+    normalized = {}
+    for key, value in row.items():
+        key = str(key).strip() if key is not None else ""
+        if key in ROSTER_FIELDS and value is not None:
+            normalized[key] = str(value).strip()
+    return normalized
+
+
+# Helper function to read a roster from CSV text with a header row
+def parse_csv_roster(text):
+    return [normalize_row(row) for row in csv.DictReader(io.StringIO(text))]
+
+
+# Helper function to check one roster row, returning an error message or None
+def validate_row(row):
+    missing = [field for field in ["email", "password", "name", "role", "school_name"] if not row.get(field)]
+    if missing:
+        return f"Missing required fields: {', '.join(missing)}"
+    if row["role"] not in VALID_ROLES:
+        return f"Invalid role. Must be one of: {', '.join(VALID_ROLES)}"
+    return None
+
+
+# Helper function to create one Auth account, returning (uid, error)
+def create_auth_user(row):
+    try:
+        user = auth.create_user(email=row["email"], password=row["password"], display_name=row["name"])
+        return user.uid, None
+    except auth.EmailAlreadyExistsError:
+        return None, "Email already in use"
+    except Exception as e:
+        return None, str(e)
+
+
+# Helper function to delete Auth accounts whose profiles could not be written
+def rollback_auth_users(uids):
+    try:
+        result = auth.delete_users(uids)
+        for error in result.errors:
+            print(f"Failed to clean up auth user {uids[error.index]}: {error.reason}")
+    except Exception as e:
+        print(f"Failed to clean up auth users {uids}: {str(e)}")
+
+
+# Create every valid roster row. Auth accounts are created concurrently on
+# `executor`; profiles and "User Created" log events are then written with
+# WriteBatches. If a batch fails, the Auth accounts of its rows are deleted
+# again so no account is left without a profile. Returns one result per row,
+# in roster order, with the row number, email, status and user_id or error.
+def provision_users(db, rows, executor, created_by, log_collection="logs"):
+    results = [{"row": index + 1, "email": row.get("email", "")} for index, row in enumerate(rows)]
+
+    pending = []
+    seen_emails = set()
+    for index, row in enumerate(rows):
+        error = validate_row(row)
+        if error is None and row["email"].lower() in seen_emails:
+            error = "Duplicate email in roster"
+        if error is not None:
+            results[index].update(status="error", error=error)
+            continue
+        seen_emails.add(row["email"].lower())
+        pending.append(index)
+
+    created = []
+    futures = {index: executor.submit(create_auth_user, rows[index]) for index in pending}
+    for index, future in futures.items():
+        uid, error = future.result()
+        if error is not None:
+            results[index].update(status="error", error=error)
+        else:
+            created.append((index, uid))
+
+    for start in range(0, len(created), USERS_PER_BATCH):
+        chunk = created[start:start + USERS_PER_BATCH]
+        batch = db.batch()
+        for index, uid in chunk:
+            row = rows[index]
+            batch.set(db.collection("users").document(uid), {
+                "user_id": uid,
+                "email": row["email"],
+                "name": row["name"],
+                "role": row["role"],
+                "school_name": row["school_name"],
+                "school_id": row.get("school_id", ""),
+                "verified": False,
+            })
+            batch.set(db.collection(log_collection).document(), make_event(
+                uid, "User Created", email=row["email"], name=row["name"], role=row["role"], created_by=created_by,
+            ))
+        try:
+            batch.commit()
+        except Exception as e:
+            print(f"Provisioning batch error: {str(e)}")
+            rollback_auth_users([uid for _, uid in chunk])
+            for index, _ in chunk:
+                results[index].update(status="error", error=f"Profile could not be saved: {str(e)}")
+            continue
+        for index, uid in chunk:
+            results[index].update(status="created", user_id=uid)
+
+    return results
@@ -0,0 +1,22 @@
+from app import db, clock_store
+
+# Rebuild the clockTotals day and week totals from the clockSessions
+# records. Users whose history is still a legacy clockHistory entries array
+# are converted to sessions first.
+#
+#   $ python rebuild_clock_totals.py
+
+
+def main():
+    for history_doc in db.collection("clockHistory").select([]).stream():
+        try:
+            if clock_store.migrate_legacy(history_doc.id):
+                print(f"{history_doc.id}: migrated clock history")
+        except Exception as e:
+            print(f"{history_doc.id}: migration error: {str(e)}")
+
+    print(f"{clock_store.rebuild_totals()} totals written")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import sys
+
+from app import db, progress_store
+
+# Rebuild the schoolProgress/<school_id> rollups from the students' progress
+# documents. Pass school ids to rebuild only those schools; with no arguments
+# every school that has students is rebuilt.
+#
+#   $ python rebuild_school_progress.py [school_id ...]
+
+
+# Helper function to find every school that has at least one student
+def all_school_ids():
+    school_ids = set()
+    students = db.collection("users").where("role", "==", "student").select(["school_id"]).stream()
+    for doc in students:
+        school_id = doc.to_dict().get("school_id")
+        if school_id:
+            school_ids.add(school_id)
+    return sorted(school_ids)
+
+
+def main(school_ids):
+    for school_id in school_ids or all_school_ids():
+        try:
+            rollup = progress_store.rebuild_school_rollup(school_id)
+            print(f"{school_id}: {len(rollup['students'])} students, "
+                  f"{sum(len(materials) for materials in rollup['materials'].values())} materials")
+        except Exception as e:
+            print(f"{school_id}: rebuild error: {str(e)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
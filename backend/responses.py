@@ -0,0 +1,252 @@
+import os
+import gzip
+import zlib
+import hashlib
+from flask import request
+from werkzeug.http import parse_accept_header, parse_etags
+
+# brotli is optional; without it responses are only ever gzipped
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Response layer shared by the Flask app and the ASGI entry point:
+#
+# - JSON and text bodies of at least COMPRESS_MIN_BYTES are compressed with
+#   brotli or gzip, whichever the client prefers. Streamed responses are
+#   compressed chunk by chunk, so each chunk still reaches the client as
+#   soon as it is ready.
+# - The read-only routes in CACHE_CONTROL get their Cache-Control header
+#   and, unless streamed, a strong ETag over the serialized body. A request
+#   whose If-None-Match matches is answered with an empty 304.
+#
+# Each encoding of a body has its own ETag ("<digest>", "<digest>-gzip",
+# "<digest>-br"), as a strong ETag must identify exact bytes. Any of them
+# matches If-None-Match, so a client that is switched to another encoding
+# (for example by a proxy) still revalidates. Set COMPRESS_MIN_BYTES=0 to
+# turn compression off.
+
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "5"))
+
+# Encodings in order of preference when the client weighs them equally
+ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "text/")
+
+# Cache-Control of the read-only routes, by Flask endpoint. Shared catalogues
+# may be reused for a minute; per-user data must be revalidated every time,
+# which is cheap with an ETag.
+CATALOG_CACHE = "public, max-age=60"
+PRIVATE_CACHE = "private, no-cache"
+CACHE_CONTROL = {
+    "get_pdfs": CATALOG_CACHE,
+    "get_code": CATALOG_CACHE,
+    "get_code_file": CATALOG_CACHE,
+    "get_users": PRIVATE_CACHE,
+    "get_user": PRIVATE_CACHE,
+    "get_user_progress": PRIVATE_CACHE,
+    "get_user_progress_summary": PRIVATE_CACHE,
+    "get_student_progress": PRIVATE_CACHE,
+    "get_school_progress": PRIVATE_CACHE,
+    "get_clock_sessions": PRIVATE_CACHE,
+    "get_clock_reports": PRIVATE_CACHE,
+    "get_logs": PRIVATE_CACHE,
+}
+
+
+def is_compressible(content_type):
+    return COMPRESS_MIN_BYTES > 0 and (content_type or "").startswith(COMPRESSIBLE_TYPES)
+
+
+# Helper function to pick the encoding for an Accept-Encoding header, or None
+def choose_encoding(accept_encoding):
+    accept = parse_accept_header(accept_encoding or "")
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        quality = accept[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def etag_for(digest, encoding):
+    return f"{digest}-{encoding}" if encoding else digest
+
+
+# Helper function to check If-None-Match against every encoding of a body
+def etag_matches(if_none_match, digest):
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return any(etags.contains_weak(etag_for(digest, encoding)) for encoding in [None, "br", "gzip"])
+
+
+# Compresses a stream of chunks, flushing after each one so nothing is held
+# back; the compressor keeps its window, so later chunks still compress well
+class StreamEncoder:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data):
+        if self.encoding == "br":
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+# Work out how to send a complete body. Returns (status, body, headers) where
+# headers are the ones to add or replace; a 304 has an empty body.
+def prepare(method, endpoint, status, content_type, body, accept_encoding, if_none_match):
+    headers = {}
+    encoding = None
+    if is_compressible(content_type):
+        headers["Vary"] = "Accept-Encoding"
+        if len(body) >= COMPRESS_MIN_BYTES:
+            encoding = choose_encoding(accept_encoding)
+
+    cache_control = CACHE_CONTROL.get(endpoint)
+    if cache_control and method in ("GET", "HEAD") and status == 200:
+        headers["Cache-Control"] = cache_control
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        headers["ETag"] = f'"{etag_for(digest, encoding)}"'
+        if etag_matches(if_none_match, digest):
+            return 304, b"", headers
+
+    if encoding:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return status, body, headers
+
+
+# Flask after_request hook applying the layer to every response
+def finalize_response(response):
+    if response.direct_passthrough or "Content-Encoding" in response.headers:
+        return response
+
+    if response.is_streamed:
+        if not is_compressible(response.mimetype):
+            return response
+        response.vary.add("Accept-Encoding")
+        if request.method in ("GET", "HEAD") and response.status_code == 200 and request.endpoint in CACHE_CONTROL:
+            response.headers["Cache-Control"] = CACHE_CONTROL[request.endpoint]
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+        if encoding:
+            response.response = encode_stream(response.response, response.iter_encoded(), encoding)
+            response.headers["Content-Encoding"] = encoding
+            response.headers.pop("Content-Length", None)
+        return response
+
+    status, body, headers = prepare(
+        request.method,
+        request.endpoint,
+        response.status_code,
+        response.mimetype,
+        response.get_data(),
+        request.headers.get("Accept-Encoding"),
+        request.headers.get("If-None-Match"),
+    )
+    if status == 304:
+        response.status_code = 304
+        response.set_data(b"")
+        response.headers.pop("Content-Type", None)
+    elif "Content-Encoding" in headers:
+        response.set_data(body)
+    for name, value in headers.items():
+        if name == "Vary":
+            response.vary.add(value)
+        else:
+            response.headers[name] = value
+    return response
+
+
+def encode_stream(source, chunks, encoding):
+    encoder = StreamEncoder(encoding)
+    try:
+        for chunk in chunks:
+            data = encoder.chunk(chunk)
+            if data:
+                yield data
+        yield encoder.finish()
+    finally:
+        # Closing the original body ends stream_with_context's request context
+        close = getattr(source, "close", None)
+        if close is not None:
+            close()
+
+
+# Wraps an ASGI `send` so native async routes get the same treatment. A
+# response whose first body message is also its last is handled like a
+# Flask response; one that streams is compressed chunk by chunk.
+def asgi_send(send, scope, endpoint):
+    request_headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope.get("headers", [])}
+    accept_encoding = request_headers.get("accept-encoding")
+    start = None
+    encoder = None
+
+    async def wrapped(message):
+        nonlocal start, encoder
+        if message["type"] == "http.response.start":
+            start = message
+            return
+        if message["type"] != "http.response.body":
+            return await send(message)
+
+        if start is not None:
+            headers = [(name, value) for name, value in start.get("headers", []) if name.lower() != b"content-length"]
+            content_type = dict(headers).get(b"content-type", b"").decode("latin-1")
+            status = start["status"]
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            start = None
+
+            if not more_body:
+                status, body, extra = prepare(
+                    scope["method"], endpoint, status, content_type, body,
+                    accept_encoding, request_headers.get("if-none-match"),
+                )
+                if status == 304:
+                    headers = [(name, value) for name, value in headers if name.lower() != b"content-type"]
+                headers += [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in extra.items()]
+                headers.append((b"content-length", str(len(body)).encode("latin-1")))
+                await send({"type": "http.response.start", "status": status, "headers": headers})
+                return await send({"type": "http.response.body", "body": body})
+
+            if is_compressible(content_type):
+                headers.append((b"vary", b"Accept-Encoding"))
+                if status == 200 and endpoint in CACHE_CONTROL:
+                    headers.append((b"cache-control", CACHE_CONTROL[endpoint].encode("latin-1")))
+                encoding = choose_encoding(accept_encoding)
+                if encoding:
+                    encoder = StreamEncoder(encoding)
+                    headers.append((b"content-encoding", encoding.encode("latin-1")))
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+
+        if encoder is None:
+            return await send(message)
+        data = encoder.chunk(message.get("body", b""))
+        if not message.get("more_body", False):
+            data += encoder.finish()
+        await send({"type": "http.response.body", "body": data, "more_body": message.get("more_body", False)})
+
+    return wrapped
+
+
+def install(flask_app):
+    flask_app.after_request(finalize_response)
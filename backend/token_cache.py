@@ -0,0 +1,75 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from firebase_clients import auth
+
+
+# Bounded LRU of decoded ID token claims, keyed by a hash of the token so raw
+# tokens are never kept in memory. Entries live until the token's own `exp`.
+class TokenCache:
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(id_token):
+        return hashlib.sha256(id_token.encode("utf-8")).hexdigest()
+
+    def get(self, id_token):
+        key = self._key(id_token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, claims = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def put(self, id_token, claims):
+        expires_at = claims.get("exp")
+        if not expires_at or time.time() >= expires_at:
+            return
+        key = self._key(id_token)
+        with self._lock:
+            self._entries[key] = (expires_at, claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, id_token):
+        with self._lock:
+            self._entries.pop(self._key(id_token), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+token_cache = TokenCache(max_size=int(os.environ.get("TOKEN_CACHE_SIZE", "1024")))
+
+
+# Verify a Firebase ID token, skipping the signature check for tokens that
+# have already been verified and have not expired yet
+def verify_id_token(id_token):
+    if not id_token:
+        raise ValueError("No idToken provided")
+    claims = token_cache.get(id_token)
+    if claims is None:
+        claims = auth.verify_id_token(id_token)
+        token_cache.put(id_token, claims)
+    return claims
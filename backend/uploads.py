@@ -0,0 +1,129 @@
+import re
+import time
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+
+# Resumable upload chunks must be a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = 32 * 256 * 1024
+
+
+# Client-chosen upload ids become Firestore document ids, so only short ids
+# of letters, digits, "-" and "_" that start with a letter or digit are
+# accepted; that rules out "/", ".." and the reserved "__...__" ids
+UPLOAD_ID_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,63}")
+
+
+def valid_upload_id(upload_id):
+    return bool(UPLOAD_ID_PATTERN.fullmatch(upload_id or ""))
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadHashMismatch(Exception):
+    pass
+
+
+# Progress of running uploads, kept in Firestore so a client can poll it
+# through any worker, not just the one receiving the upload. Progress is
+# written at most every `write_every` seconds per upload. Each document
+# carries an expires_at time (`keep_for` seconds after the upload finished,
+# or `stale_after` seconds after it started, for an upload whose worker died)
+# for a Firestore TTL policy to delete it by; get() ignores expired ones.
+class UploadTracker:
+    def __init__(self, db, collection="pdfUploads", keep_for=600, stale_after=3600, write_every=1.0):
+        self.db = db
+        self.collection = collection
+        self.keep_for = keep_for
+        self.stale_after = stale_after
+        self.write_every = write_every
+        self._last_write = {}
+        self._lock = threading.Lock()
+
+    def upload_ref(self, upload_id):
+        return self.db.collection(self.collection).document(upload_id)
+
+    def start(self, upload_id, filename, total_bytes):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            self._last_write[upload_id] = time.monotonic()
+        self.upload_ref(upload_id).set({
+            "upload_id": upload_id,
+            "filename": filename,
+            "received_bytes": 0,
+            "total_bytes": total_bytes,
+            "status": "uploading",
+            "expires_at": now + timedelta(seconds=self.stale_after),
+        })
+
+    def advance(self, upload_id, received_bytes):
+        now = time.monotonic()
+        with self._lock:
+            if upload_id not in self._last_write or now - self._last_write[upload_id] < self.write_every:
+                return
+            self._last_write[upload_id] = now
+        # Progress is only informational, so a failed write never fails the upload
+        try:
+            self.upload_ref(upload_id).update({"received_bytes": received_bytes})
+        except Exception as e:
+            print(f"Error recording upload progress: {e}")
+
+    def finish(self, upload_id, status, received_bytes=None):
+        with self._lock:
+            self._last_write.pop(upload_id, None)
+        changes = {
+            "status": status,
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.keep_for),
+        }
+        if received_bytes is not None:
+            changes["received_bytes"] = received_bytes
+        try:
+            self.upload_ref(upload_id).update(changes)
+        except Exception as e:
+            print(f"Error recording upload status: {e}")
+
+    def get(self, upload_id):
+        snapshot = self.upload_ref(upload_id).get()
+        if not snapshot.exists:
+            return None
+        upload = snapshot.to_dict()
+        expires_at = upload.pop("expires_at", None)
+        if expires_at is not None and expires_at < datetime.now(timezone.utc):
+            return None
+        return upload
+
+
+# Copy `source` into `blob` through a resumable upload session, one chunk at
+# a time, hashing the content on the way. Raising before the writer closes
+# cancels the session, so a rejected upload never replaces the stored blob.
+# Returns (sha256 hex digest, size in bytes).
+def stream_to_blob(source, blob, content_type, max_bytes, expected_sha256=None,
+                   chunk_size=UPLOAD_CHUNK_SIZE, on_progress=None):
+    digest = hashlib.sha256()
+    size = 0
+    if expected_sha256:
+        blob.metadata = {**(blob.metadata or {}), "sha256": expected_sha256}
+
+    with blob.open("wb", chunk_size=chunk_size, content_type=content_type) as out:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+            digest.update(chunk)
+            out.write(chunk)
+            if on_progress is not None:
+                on_progress(size)
+
+        sha256 = digest.hexdigest()
+        if expected_sha256 and sha256 != expected_sha256:
+            raise UploadHashMismatch("Uploaded content does not match X-Content-SHA256")
+
+    if not expected_sha256:
+        blob.metadata = {**(blob.metadata or {}), "sha256": sha256}
+        blob.patch()
+    return sha256, size
@@ -0,0 +1,146 @@
+import time
+import threading
+from collections import OrderedDict
+from flask import g, has_request_context
+
+
+# Read-through cache in front of the `users` collection. Profiles are memoised
+# for the lifetime of a request on flask.g and kept in a short-TTL process
+# cache shared across requests. Routes that write a profile must call
+# invalidate() so the next read goes back to Firestore.
+class UserRepository:
+    def __init__(self, db, ttl=30, max_size=2048):
+        self.db = db
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _request_memo(self):
+        if not has_request_context():
+            return None
+        if "user_profiles" not in g:
+            g.user_profiles = {}
+        return g.user_profiles
+
+    def _cached(self, uid):
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, profile = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[uid]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(uid)
+            self.hits += 1
+            return profile
+
+    def _store(self, uid, profile):
+        memo = self._request_memo()
+        if memo is not None:
+            memo[uid] = profile
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[uid] = (time.monotonic() + self.ttl, profile)
+            self._entries.move_to_end(uid)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    # Return a copy of the user's profile, or None if the document does not exist
+    def get(self, uid):
+        if not uid:
+            return None
+        memo = self._request_memo()
+        if memo is not None and uid in memo:
+            return dict(memo[uid])
+
+        profile = self._cached(uid)
+        if profile is None:
+            user_doc = self.db.collection("users").document(uid).get()
+            if not user_doc.exists:
+                return None
+            profile = user_doc.to_dict()
+        self._store(uid, profile)
+        return dict(profile)
+
+    # Return {uid: profile} for every uid that exists, fetching all cache
+    # misses with a single multi-document read
+    def get_many(self, uids):
+        memo = self._request_memo()
+        profiles = {}
+        missing = []
+        for uid in dict.fromkeys(uid for uid in uids if uid):
+            if memo is not None and uid in memo:
+                profiles[uid] = dict(memo[uid])
+                continue
+            profile = self._cached(uid)
+            if profile is None:
+                missing.append(uid)
+            else:
+                self._store(uid, profile)
+                profiles[uid] = dict(profile)
+
+        if missing:
+            refs = [self.db.collection("users").document(uid) for uid in missing]
+            for user_doc in self.db.get_all(refs):
+                if not user_doc.exists:
+                    continue
+                profile = user_doc.to_dict()
+                self._store(user_doc.id, profile)
+                profiles[user_doc.id] = dict(profile)
+        return profiles
+
+    # Async counterparts of get() and get_many() for the ASGI routes. They
+    # share the process cache but read misses through `async_db`.
+    async def get_async(self, uid, async_db):
+        if not uid:
+            return None
+        profile = self._cached(uid)
+        if profile is None:
+            user_doc = await async_db.collection("users").document(uid).get()
+            if not user_doc.exists:
+                return None
+            profile = user_doc.to_dict()
+        self._store(uid, profile)
+        return dict(profile)
+
+    async def get_many_async(self, uids, async_db):
+        profiles = {}
+        missing = []
+        for uid in dict.fromkeys(uid for uid in uids if uid):
+            profile = self._cached(uid)
+            if profile is None:
+                missing.append(uid)
+            else:
+                profiles[uid] = dict(profile)
+
+        if missing:
+            refs = [async_db.collection("users").document(uid) for uid in missing]
+            async for user_doc in async_db.get_all(refs):
+                if not user_doc.exists:
+                    continue
+                profile = user_doc.to_dict()
+                self._store(user_doc.id, profile)
+                profiles[user_doc.id] = dict(profile)
+        return profiles
+
+    def invalidate(self, uid):
+        memo = self._request_memo()
+        if memo is not None:
+            memo.pop(uid, None)
+        with self._lock:
+            self._entries.pop(uid, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
@@ -11,7 +11,7 @@ import { Accordion, AccordionContent, AccordionItem, AccordionTrigger } from "@/
 import { Alert, AlertDescription, AlertTitle } from "@/components/ui/alert"
 import { getUser } from "@/lib/getUser"
 import type { CodingProblem } from "@/lib/CodingProblem"
-import { apiUrlBase, codeExecUrl } from "@/lib/configEnv"
+import { apiUrlBase, codeExecUrl, runCodeOnBackend } from "@/lib/configEnv"
 import { auth } from "@/lib/firebaseConfig"
 import { useLaikaPageContext } from "@/components/LaikaPageContext"
 import { Loader2 } from "lucide-react"
@@ -141,24 +141,29 @@ export default function ArduinoIDE({ problems }: ArduinoIDEProps) {
         setIsCorrect(false)
         return
       }
-      const response = await fetch(codeExecUrl, {
+      // With runCodeOnBackend the backend runs the sketch and grades it
+      // against the problem; otherwise the Cloud Run service runs it and the
+      // output is compared here
+      const response = await fetch(runCodeOnBackend ? `${apiUrlBase}/run-code` : codeExecUrl, {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
           Authorization: `Bearer ${idToken}`,
         },
-        body: JSON.stringify({ code }),
+        body: JSON.stringify(runCodeOnBackend ? { code, problem_id: problems[currentProblem]?.id } : { code }),
       })
       const result = await response.json()
       if (result.error) {
+        setOutput(result.output || "")
         setError(result.error)
         setIsCorrect(false)
+      } else if (runCodeOnBackend) {
+        setOutput(result.output)
+        setIsCorrect(Boolean(result.correct))
       } else {
-        const output = result.output
-        let trimmedOutput = output.replace(/\s+$/, '');
+        const trimmedOutput = result.output.replace(/\s+$/, '')
         setOutput(trimmedOutput)
-        const correct = trimmedOutput === problems[currentProblem]?.expectedOutput
-        setIsCorrect(correct)
+        setIsCorrect(trimmedOutput === problems[currentProblem]?.expectedOutput)
       }
     } catch (error) {
       setError("Error: Failed to run code. Please try again.")
@@ -205,9 +210,13 @@ export default function ArduinoIDE({ problems }: ArduinoIDEProps) {
           accessed_at: new Date().toISOString(),
         }
 
+        const idToken = await auth.currentUser?.getIdToken()
         const response = await fetch(`${apiUrlBase}/mark-progress`, {
           method: "POST",
-          headers: { "Content-Type": "application/json" },
+          headers: {
+            "Content-Type": "application/json",
+            ...(idToken ? { Authorization: `Bearer ${idToken}` } : {}),
+          },
           body: JSON.stringify(requestBody),
         })
 
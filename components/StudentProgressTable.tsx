@@ -44,31 +44,22 @@ export function StudentProgressTable() {
     const userData = getUser()
     const fetchStudentProgress = async () => {
       try {
-        const response = await fetch(`${apiUrlBase}/student-progress?user_id=${userData.user_id}`)
+        // The school rollup holds every student's counts in a single document
+        const response = await fetch(`${apiUrlBase}/school-progress?user_id=${userData.user_id}`)
         if (!response.ok) {
           throw new Error("Failed to fetch student progress")
         }
         const progressData = await response.json()
 
-        // Fetch user details for each student
-        const userDetailsPromises = progressData.map(async (student: any) => {
-          const userResponse = await fetch(`${apiUrlBase}/users/${student.user_id}`)
-          if (!userResponse.ok) {
-            throw new Error(`Failed to fetch user data for user_id: ${student.user_id}`)
-          }
-          const userData = await userResponse.json()
-          return {
-            user_id: student.user_id,
-            name: userData.name, // Assuming userData has `name`
-            email: userData.email, // Assuming userData has `email`
-            total_materials: 29 /*student.items.length,*/,
-            completed_materials: student.items.filter((item: any) => item.completed).length,
-            last_activity: student.items[0]?.completion_date || student.items[0]?.accessed_at, // Use last activity timestamp
-            items: student.items, // Store the items for later use
-          }
-        })
+        const studentsWithUserData = (progressData.students || []).map((student: any) => ({
+          user_id: student.user_id,
+          name: student.name,
+          email: student.email,
+          total_materials: 29 /*student.tracked,*/,
+          completed_materials: student.completed,
+          last_activity: student.last_activity,
+        }))
 
-        const studentsWithUserData = await Promise.all(userDetailsPromises)
         setStudents(studentsWithUserData)
       } catch (error) {
         console.error("Error fetching student progress:", error)
@@ -80,9 +71,27 @@ export function StudentProgressTable() {
     fetchStudentProgress()
   }, [])
 
-  const handleViewDetails = (student: StudentProgress) => {
+  // A student's individual items are only loaded when their details are opened
+  const handleViewDetails = async (student: StudentProgress) => {
     setSelectedStudent(student)
     setIsDetailsDialogOpen(true)
+    if (student.items) return
+
+    setDetailsLoading(true)
+    try {
+      const response = await fetch(`${apiUrlBase}/get-user-progress?user_id=${student.user_id}`)
+      if (!response.ok) {
+        throw new Error("Failed to fetch student details")
+      }
+      const items = await response.json()
+      const withItems = { ...student, items: Array.isArray(items) ? items : [] }
+      setStudents((current) => current.map((s) => (s.user_id === student.user_id ? withItems : s)))
+      setSelectedStudent((current) => (current?.user_id === student.user_id ? withItems : current))
+    } catch (error) {
+      console.error("Error fetching student details:", error)
+    } finally {
+      setDetailsLoading(false)
+    }
   }
 
   const handleSort = (field: keyof StudentProgress) => {
@@ -275,7 +284,9 @@ export function StudentProgressTable() {
           </div>
 
           <ScrollArea className="flex-1 pr-4">
-            {!selectedStudent?.items || selectedStudent.items.length === 0 ? (
+            {detailsLoading ? (
+              <div className="flex justify-center items-center py-8">Loading materials...</div>
+            ) : !selectedStudent?.items || selectedStudent.items.length === 0 ? (
               <div className="flex flex-col items-center justify-center py-8 text-center">
                 <AlertCircle className="h-12 w-12 text-muted-foreground mb-4" />
                 <p className="text-muted-foreground">No learning materials data available for this student.</p>
@@ -50,7 +50,7 @@ interface CodeResource {
   name: string
   description: string
   language: string
-  code: string
+  code?: string
   filename: string
 }
 
@@ -103,8 +103,32 @@ export default function StudentTrainingMaterials() {
     }
   }, [codeResources])
 
+  // The code listing is fetched without sources; load the selected file's source on demand
+  useEffect(() => {
+    if (!selectedCodeResource || selectedCodeResource.code !== undefined) return
+
+    let isMounted = true
+    const fetchCodeSource = async () => {
+      try {
+        const response = await fetch(`${apiUrlBase}/get-code/${selectedCodeResource.id}`)
+        if (!response.ok) throw new Error("Failed to fetch code source")
+        const codeData: CodeResource = await response.json()
+        if (!isMounted) return
+        setCodeResources((prev) => prev.map((code) => (code.id === codeData.id ? codeData : code)))
+        setSelectedCodeResource(codeData)
+      } catch (error) {
+        console.error("Error fetching code source:", error)
+      }
+    }
+
+    fetchCodeSource()
+    return () => {
+      isMounted = false
+    }
+  }, [selectedCodeResource])
+
   const downloadCode = () => {
-    if (!selectedCodeResource) return
+    if (!selectedCodeResource || selectedCodeResource.code === undefined) return
 
     const blob = new Blob([selectedCodeResource.code], { type: "text/plain" })
     const url = URL.createObjectURL(blob)
@@ -149,7 +173,7 @@ export default function StudentTrainingMaterials() {
         if (!isMounted) return
         setPdfs(pdfData)
 
-        const codeResponse = await fetch(`${apiUrlBase}/get-code`)
+        const codeResponse = await fetch(`${apiUrlBase}/get-code?content=false`)
         if (!codeResponse.ok) throw new Error("Failed to fetch code resources")
         const codeData: CodeResource[] = await codeResponse.json()
         if (!isMounted) return
@@ -195,9 +219,13 @@ export default function StudentTrainingMaterials() {
         console.log("No authenticated user; skipping mark as completed")
         return
       }
+      const idToken = await user.getIdToken()
       const response = await fetch(`${apiUrlBase}/mark-progress`, {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: {
+          "Content-Type": "application/json",
+          Authorization: `Bearer ${idToken}`,
+        },
         body: JSON.stringify({
           user_id: userId,
           material_id: selectedPdf.id,
@@ -40,10 +40,22 @@ export function UserList() {
     const fetchUsers = async () => {
       setIsLoading(true)
       try {
-        const response = await fetch(`${apiUrlBase}/users`)
-        if (!response.ok) throw new Error("Failed to fetch users")
-        const data: User[] = await response.json()
-        setUsers(data)
+        const idToken = await auth.currentUser?.getIdToken()
+        // Page through the users, downloading only the fields the table shows
+        const allUsers: User[] = []
+        let cursor: string | null = null
+        do {
+          const params = new URLSearchParams({ limit: "500", fields: "name,email,role" })
+          if (cursor) params.set("start_after", cursor)
+          const response = await fetch(`${apiUrlBase}/users?${params}`, {
+            headers: { Authorization: `Bearer ${idToken}` },
+          })
+          if (!response.ok) throw new Error("Failed to fetch users")
+          const data: { users: User[]; next_cursor: string | null } = await response.json()
+          allUsers.push(...data.users)
+          cursor = data.next_cursor
+        } while (cursor)
+        setUsers(allUsers)
       } catch (error) {
         console.error("Error fetching data:", error)
         setError("Failed to load users")
@@ -15,3 +15,8 @@ export const apiUrlBase = getAPIURLBase();
 export const codeExecUrl =
     process.env.NEXT_PUBLIC_CODE_EXEC_URL ||
     'https://cpp-runner-293736072539.us-central1.run.app';
+
+// Run and grade code with the backend's /run-code route instead of the Cloud Run
+// service. Only enable this where the backend runs under gunicorn on a host with
+// g++; the serverless /backend deployment cannot run code.
+export const runCodeOnBackend = process.env.NEXT_PUBLIC_RUN_CODE_ON_BACKEND === 'true';